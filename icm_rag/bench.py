@@ -0,0 +1,271 @@
+import functools
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, List, Optional, Sequence
+
+import numpy as np
+from retrieve import Retriever
+from utils.log import log_done, log_info, log_ongoing, log_warning
+
+LOAD_MODES = ["closed", "open"]
+
+
+def synthetic_questions(
+    ret: Retriever, n_questions: int = 1000, n_words: int = 12, seed: int = 0
+) -> List[str]:
+    """
+    Sample synthetic questions from the indexed chunks: each one is a random
+    window of consecutive words of a random chunk.
+
+    Args:
+        ret (Retriever): Retriever to sample chunks from.
+        n_questions (int): Number of questions to sample.
+        n_words (int): Maximum number of words per question.
+        seed (int): Random seed.
+
+    Returns:
+        List[str]: Synthetic questions.
+    """
+    n_chunks = len(ret.chunk_to_unique)
+    if n_chunks == 0:
+        raise ValueError("Cannot sample synthetic questions from an empty index.")
+
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(0, n_chunks, size=n_questions).tolist()
+    questions = []
+    for chunk in ret._load_chunks(ids):
+        words = chunk.split()
+        start = int(rng.integers(0, max(len(words) - n_words, 0) + 1))
+        questions.append(" ".join(words[start : start + n_words]))  # noqa: E203
+    return questions
+
+
+def latency_stats(latencies: Sequence[float], elapsed: float) -> dict:
+    """
+    Summarize latencies of completed queries.
+
+    Args:
+        latencies (Sequence[float]): Latency of every query, in seconds.
+        elapsed (float): Wall-clock duration of the run, in seconds.
+
+    Returns:
+        dict: Number of queries, sustained QPS, and mean, p50 / p95 / p99
+            and maximum latency, in milliseconds.
+    """
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000
+    if len(latencies_ms) == 0:
+        latencies_ms = np.full(1, np.nan)
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "n_queries": len(latencies),
+        "qps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(np.max(latencies_ms)),
+    }
+
+
+class LoadGenerator:
+    """
+    This class implements a load generator for retrieval. Questions are
+    replayed, in order and cyclically, against a target, i.e. any callable
+    answering a single question: an in-process retriever (see `for_retriever`),
+    or a client of a retrieval server.
+
+    Two modes are supported:
+        (1) Closed loop: a fixed number of clients, each sending its next
+            question as soon as the previous one is answered. Measures the
+            maximum sustained throughput.
+        (2) Open loop: questions arrive at a fixed rate, regardless of how
+            fast they are answered. Latency is measured from the scheduled
+            arrival, so it includes queueing, i.e. time spent waiting for a
+            free worker when the target falls behind.
+    """
+
+    def __init__(self, target: Callable[[str], Any], questions: Sequence[str]):
+        """
+        Args:
+            target (Callable[[str], Any]): Function answering a single question.
+                Called from multiple threads at once.
+            questions (Sequence[str]): Questions to replay.
+        """
+        if len(questions) == 0:
+            raise ValueError("Cannot generate load without questions.")
+        self.target = target
+        self.questions = list(questions)
+
+    @classmethod
+    def for_retriever(
+        cls,
+        ret: Retriever,
+        questions: Sequence[str],
+        k: int = 10,
+        where: Optional[dict] = None,
+    ) -> "LoadGenerator":
+        """
+        Create a load generator, querying given retriever for top-k spans.
+        """
+        return cls(functools.partial(ret.query_spans, k=k, where=where), questions)
+
+    def _call(self, question: str, errors: List[str]) -> bool:
+        """
+        Answer a question, recording the error, if any.
+        """
+        try:
+            self.target(question)
+            return True
+        except Exception as e:
+            errors.append(repr(e))
+            return False
+
+    def _result(
+        self, mode: str, latencies: List[float], errors: List[str], elapsed: float
+    ) -> dict:
+        if errors:
+            log_warning(f"{len(errors)} quer(ies) failed, first with: {errors[0]}")
+        return {
+            "mode": mode,
+            "duration": elapsed,
+            "n_errors": len(errors),
+            **latency_stats(latencies, elapsed),
+        }
+
+    def closed_loop(self, concurrency: int = 1, duration: float = 10.0) -> dict:
+        """
+        Run closed-loop load: `concurrency` clients, for `duration` seconds.
+
+        Args:
+            concurrency (int): Number of concurrent clients.
+            duration (float): Duration of the run, in seconds.
+
+        Returns:
+            dict: Mode, concurrency, duration, number of errors (nothing is
+                ever dropped) and latency statistics (see `latency_stats`).
+        """
+        stop = threading.Event()
+        counter = itertools.count()
+        latencies: List[float] = []
+        errors: List[str] = []
+
+        def client() -> None:
+            while not stop.is_set():
+                question = self.questions[next(counter) % len(self.questions)]
+                start = time.perf_counter()
+                if self._call(question, errors):
+                    latencies.append(time.perf_counter() - start)
+
+        clients = [threading.Thread(target=client) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        result = self._result("closed", latencies, errors, elapsed)
+        return {**result, "concurrency": concurrency, "rate": None, "n_dropped": 0}
+
+    def open_loop(
+        self, rate: float, duration: float = 10.0, concurrency: int = 32
+    ) -> dict:
+        """
+        Run open-loop load: questions arriving at `rate` per second, for
+        `duration` seconds, answered by up to `concurrency` workers. Once
+        arrivals stop, the backlog is drained for at most another `duration`
+        seconds; questions still queued by then are dropped, so an overloaded
+        target cannot stall the run. Dropped questions have no latency, so
+        their count should be checked alongside the percentiles.
+
+        Args:
+            rate (float): Arrival rate, in questions per second.
+            duration (float): Duration of the arrivals, in seconds.
+            concurrency (int): Maximum number of questions in flight.
+
+        Returns:
+            dict: Mode, arrival rate, concurrency, duration, numbers of errors
+                and dropped questions, and latency statistics (see
+                `latency_stats`).
+        """
+        if rate <= 0:
+            raise ValueError(f"Invalid arrival rate: {rate}")
+
+        latencies: List[float] = []
+        errors: List[str] = []
+
+        def answer(question: str, arrival: float) -> None:
+            if self._call(question, errors):
+                latencies.append(time.perf_counter() - arrival)
+
+        n_arrivals = max(int(rate * duration), 1)
+        futures = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            start = time.perf_counter()
+            for idx in range(n_arrivals):
+                arrival = start + idx / rate
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                question = self.questions[idx % len(self.questions)]
+                futures.append(executor.submit(answer, question, arrival))
+
+            _, pending = wait(futures, timeout=duration)
+            n_dropped = sum(future.cancel() for future in pending)
+        elapsed = time.perf_counter() - start
+
+        result = self._result("open", latencies, errors, elapsed)
+        return {
+            **result,
+            "concurrency": concurrency,
+            "rate": rate,
+            "n_dropped": n_dropped,
+        }
+
+    def run(
+        self,
+        mode: str = "closed",
+        concurrency: Sequence[int] = (1, 4, 8),
+        rates: Sequence[float] = (),
+        duration: float = 10.0,
+    ) -> List[dict]:
+        """
+        Run load of given mode, at every level of load.
+
+        Args:
+            mode (str): Load mode, "closed" or "open".
+            concurrency (Sequence[int]): Numbers of clients (closed loop). In
+                open loop, the largest one caps the questions in flight.
+            rates (Sequence[float]): Arrival rates (open loop only).
+            duration (float): Duration of every run, in seconds.
+
+        Returns:
+            List[dict]: Result of every run. See `closed_loop` and `open_loop`.
+        """
+        if mode not in LOAD_MODES:
+            raise ValueError(f"Invalid load mode selected: {mode}")
+        if mode == "open" and not rates:
+            raise ValueError("Open-loop load requires at least one arrival rate.")
+
+        log_ongoing(f"Generating {mode}-loop load...")
+        results = []
+        if mode == "closed":
+            for n_clients in concurrency:
+                results.append(self.closed_loop(n_clients, duration))
+        else:
+            for rate in rates:
+                results.append(self.open_loop(rate, duration, max(concurrency)))
+
+        for result in results:
+            log_info(
+                f"{mode} loop, concurrency={result['concurrency']}, "
+                f"rate={result['rate']}: {result['qps']:.1f} queries/s, "
+                f"p50={result['p50_ms']:.2f} ms, p95={result['p95_ms']:.2f} ms, "
+                f"p99={result['p99_ms']:.2f} ms, {result['n_dropped']} dropped"
+            )
+        log_done(f"Successfully generated {mode}-loop load!")
+        return results
@@ -1,11 +1,17 @@
 import json
-from typing import List, Tuple, Union
+import threading
+import time
+from statistics import NormalDist
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
-from retrieve import Retriever
+from retrieve import PreforkPool, QueryCache, Reranker, Retriever
+from retrieve.retriever import CosSimRetriever
 from tqdm import tqdm
-from utils.log import log_done, log_ongoing
+from utils import log
+from utils.data import QuestionSet
+from utils.log import log_done, log_info, log_ongoing
 
 
 class Evaluation:
@@ -14,11 +20,27 @@ class Evaluation:
     It is given a fully set-up retriever and questions DataFrame, and contains
     all the relevant methods for implementing metrics such as Recall and
     Precision.
+    If the retriever indexes multiple corpora, `where` restricts retrieval to
+    the corpus (or documents) the questions are about.
+    If a `PreforkPool` is given, questions are sharded across its workers.
+    If a `Reranker` is given, top-k chunks are picked from its candidates.
     """
 
-    def __init__(self, ret: Retriever, questions_df: pd.DataFrame):
+    def __init__(
+        self,
+        ret: Retriever,
+        questions_df: Union[pd.DataFrame, QuestionSet],
+        where: Optional[dict] = None,
+        pool: Optional[PreforkPool] = None,
+        reranker: Optional[Reranker] = None,
+        k: int = 10,
+    ):
         self.ret = ret
         self.questions_df = questions_df
+        self.where = where
+        self.pool = pool
+        self.reranker = reranker
+        self.k = k
 
     def __call__(self, metrics) -> dict:
         """
@@ -47,6 +69,31 @@ class Evaluation:
         """
         return json.loads(references)
 
+    def _iter_questions(self) -> Iterator[Tuple[str, List[Tuple[int, int]]]]:
+        """
+        Iterate over questions, together with their reference ranges.
+        Compiled `QuestionSet` references are sliced directly from flat arrays,
+        while DataFrame references are parsed from JSON.
+
+        Returns:
+            Iterator[Tuple[str, List[Tuple[int, int]]]]: Pairs of question and
+                its reference ranges, in format (start, end).
+        """
+        if isinstance(self.questions_df, QuestionSet):
+            for idx in range(len(self.questions_df)):
+                ref_starts, ref_ends = self.questions_df.references(idx)
+                ref_ranges = list(zip(ref_starts.tolist(), ref_ends.tolist()))
+                yield str(self.questions_df.questions[idx]), ref_ranges
+            return
+
+        for _, entry in self.questions_df.iterrows():
+            ref_chunks = self._parse_references(entry["references"])
+            ref_ranges = [
+                (int(ref_chunk["start_index"]), int(ref_chunk["end_index"]))
+                for ref_chunk in ref_chunks
+            ]
+            yield entry["question"], ref_ranges
+
     def _intersection(
         self, range1: Tuple[int, int], range2: Tuple[int, int]
     ) -> Union[Tuple[int, int], None]:
@@ -122,6 +169,68 @@ class Evaluation:
         """
         return sum(end - start for start, end in ranges)
 
+    def _score(
+        self, ref_ranges: List[Tuple[int, int]], ret_spans: np.ndarray
+    ) -> Tuple[float, float]:
+        """
+        Score retrieved spans of a single question against its references.
+
+        Args:
+            ref_ranges (List[Tuple[int, int]]): Reference ranges of question.
+            ret_spans (np.ndarray): Retrieved spans, of dtype `SPAN_DTYPE`.
+
+        Returns:
+            Tuple[float, float]: Recall and precision of the question.
+        """
+        ret_ranges = []
+        intersections = []
+
+        # Build retrieved ranges and compute intersections
+        for ret_start, ret_end in zip(
+            ret_spans["start_index"].tolist(), ret_spans["end_index"].tolist()
+        ):
+            ret_range = (ret_start, ret_end)
+            ret_ranges.append(ret_range)
+
+            # Check against all reference ranges
+            for ref_range in ref_ranges:
+                inter = self._intersection(ref_range, ret_range)
+                if inter:
+                    intersections.append(inter)
+
+        # Merge overlaps to avoid double-counting
+        ref_union = self._union_ranges(ref_ranges)
+        ret_union = self._union_ranges(ret_ranges)
+        inter_union = self._union_ranges(intersections)
+
+        total_ref_len = self._sum_of_ranges(ref_union)
+        total_ret_len = self._sum_of_ranges(ret_union)
+        total_inter_len = self._sum_of_ranges(inter_union)
+
+        recall = total_inter_len / total_ref_len if total_ref_len > 0 else 0
+        precision = total_inter_len / total_ret_len if total_ret_len > 0 else 0
+        return recall, precision
+
+    def _query_all(self, questions: List[str]) -> Iterator[np.ndarray]:
+        """
+        Query the retriever for top-k chunks of each question, in a single
+        batched call, or sharded across the pool's workers, if any. Only
+        offsets are needed, so chunk text and embeddings are not loaded.
+        If re-ranking, candidates of all the questions are re-ranked together.
+        """
+        k = self.k
+        if self.reranker is not None:
+            k = self.reranker.candidate_budget(self.k)
+
+        if self.pool is not None:
+            all_spans = self.pool.query_spans(questions, k, where=self.where)
+        else:
+            all_spans = self.ret.query_batch(questions, k, where=self.where)
+
+        if self.reranker is not None:
+            return iter(self.reranker.rerank(self.ret, questions, all_spans, k=self.k))
+        return iter(all_spans)
+
     def eval(self, metrics: List[str] = []):
         """
         Evaluate the experiment.
@@ -137,46 +246,13 @@ class Evaluation:
         recall_scores = []
         precision_scores = []
 
-        for idx, entry in tqdm(self.questions_df.iterrows()):
-            question = entry["question"]
-            ref_chunks = self._parse_references(entry["references"])
-            ret_chunks = self.ret.query(question)
-
-            ref_ranges = []
-            ret_ranges = []
-            intersections = []
-
-            # Build reference ranges
-            for ref_chunk in ref_chunks:
-                ref_start = int(ref_chunk["start_index"])
-                ref_end = int(ref_chunk["end_index"])
-                ref_ranges.append((ref_start, ref_end))
-
-            # Build retrieved ranges and compute intersections
-            for ret_chunk in ret_chunks:
-                ret_start = int(ret_chunk["metadata"]["start_index"])
-                ret_end = int(ret_chunk["metadata"]["end_index"])
-                ret_range = (ret_start, ret_end)
-                ret_ranges.append(ret_range)
-
-                # Check against all reference ranges
-                for ref_range in ref_ranges:
-                    inter = self._intersection(ref_range, ret_range)
-                    if inter:
-                        intersections.append(inter)
-
-            # Merge overlaps to avoid double-counting
-            ref_union = self._union_ranges(ref_ranges)
-            ret_union = self._union_ranges(ret_ranges)
-            inter_union = self._union_ranges(intersections)
-
-            total_ref_len = self._sum_of_ranges(ref_union)
-            total_ret_len = self._sum_of_ranges(ret_union)
-            total_inter_len = self._sum_of_ranges(inter_union)
-
-            recall = total_inter_len / total_ref_len if total_ref_len > 0 else 0
-            precision = total_inter_len / total_ret_len if total_ret_len > 0 else 0
+        questions = list(self._iter_questions())
+        all_spans = self._query_all([question for question, _ in questions])
 
+        for (_, ref_ranges), ret_spans in tqdm(
+            zip(questions, all_spans), total=len(questions)
+        ):
+            recall, precision = self._score(ref_ranges, ret_spans)
             recall_scores.append(recall)
             precision_scores.append(precision)
 
@@ -199,3 +275,461 @@ class Evaluation:
 
         log_done("Successfully finished evaluation!")
         return eval_res
+
+    def eval_sequential(
+        self,
+        metrics: List[str] = [],
+        ci_width: float = 0.05,
+        confidence: float = 0.95,
+        baseline: Optional[Dict[str, float]] = None,
+        min_questions: int = 30,
+        block_size: int = 16,
+        seed: int = 0,
+    ) -> dict:
+        """
+        Evaluate the experiment sequentially, with early stopping.
+        Questions are processed in randomized order, while running means and
+        variances of every metric are maintained. Stopping is tested at the
+        end of every block, once `min_questions` are scored, and stops once
+        either:
+            (1) Confidence intervals of all metrics are narrower than
+                `ci_width`, or
+            (2) Upper confidence bound of any metric falls below its
+                `baseline` value, i.e. the configuration is dominated.
+        Otherwise, all the questions are scored.
+
+        Testing the same fixed-level interval over and over would stop
+        (e.g. as dominated) far more often than `1 - confidence` suggests.
+        Hence, the error rate is spent across tests instead: the j-th test
+        uses (normal approximation) intervals of error rate
+        `(1 - confidence) / (j * (j + 1))`, split between the metrics, which
+        sums up to `1 - confidence` over any number of tests.
+
+        Args:
+            metrics (List[str]): List of metrics to return.
+            ci_width (float): Target width of confidence intervals.
+            confidence (float): Confidence level of the intervals.
+            baseline (Optional[Dict[str, float]]): Metric values of the
+                baseline (incumbent), e.g. {"recall": 0.8}.
+            min_questions (int): Minimum number of questions to score, before
+                stopping is considered.
+            block_size (int): Number of questions queried at once.
+            seed (int): Seed of the question order.
+
+        Returns:
+            dict: Experiment results, as returned by `eval`, computed over the
+                scored questions only, together with:
+                (1) n_questions (int): Number of scored questions.
+                (2) question_idx (List[int]): Indices of scored questions, in
+                    order of per-question scores.
+                (3) stop_reason (str): "ci_width", "dominated" or "exhausted".
+                (4) <metric>_ci (float): Half-width of metric's interval, at
+                    the error rate of the last test.
+        """
+        log_ongoing("Starting sequential evaluation process...")
+        questions = list(self._iter_questions())
+        order = np.random.default_rng(seed).permutation(len(questions)).tolist()
+        baseline = baseline or {}
+
+        stats = {"recall": _RunningMean(), "precision": _RunningMean()}
+        scores: Dict[str, List[float]] = {"recall": [], "precision": []}
+        scored = []
+        stop_reason = "exhausted"
+        n_tests = 0
+        z = _spent_z(confidence, 1, len(stats))
+
+        with tqdm(total=len(questions)) as progress:
+            for i in range(0, len(order), block_size):
+                block = order[i : i + block_size]  # noqa: E203
+                all_spans = self._query_all([questions[idx][0] for idx in block])
+
+                for idx, ret_spans in zip(block, all_spans):
+                    recall, precision = self._score(questions[idx][1], ret_spans)
+                    for metric, value in [("recall", recall), ("precision", precision)]:
+                        stats[metric].add(value)
+                        scores[metric].append(value)
+                    scored.append(idx)
+                    progress.update(1)
+
+                # Tested once per block, as every test spends error rate
+                if len(scored) < min_questions or len(scored) == len(questions):
+                    continue
+                n_tests += 1
+                z = _spent_z(confidence, n_tests, len(stats))
+                half_widths = {m: z * stats[m].sem() for m in stats}
+                if any(
+                    stats[m].mean + half_widths[m] < baseline[m]
+                    for m in stats
+                    if m in baseline
+                ):
+                    stop_reason = "dominated"
+                    break
+                if all(2 * hw < ci_width for hw in half_widths.values()):
+                    stop_reason = "ci_width"
+                    break
+
+        eval_res = {
+            "n_questions": len(scored),
+            "question_idx": scored,
+            "stop_reason": stop_reason,
+        }
+        for metric in ["recall", "precision"]:
+            if metric in metrics:
+                eval_res[metric] = stats[metric].mean
+                eval_res[f"{metric}_std"] = stats[metric].std()
+                eval_res[f"{metric}_ci"] = z * stats[metric].sem()
+                eval_res[f"{metric}_scores"] = scores[metric]
+
+        log_done(
+            f"Successfully finished sequential evaluation, after {len(scored)} / "
+            f"{len(questions)} questions ({stop_reason})!"
+        )
+        return eval_res
+
+    def two_stage_report(
+        self,
+        coarse_dims: Sequence[int] = (32, 64, 128),
+        n_candidates: Sequence[int] = (50, 100, 200),
+        projection: str = "pca",
+        k: int = 10,
+    ) -> pd.DataFrame:
+        """
+        Measure the recall@k versus speed trade-off of two-stage retrieval.
+        Every configuration is compared against exact, full-dimension search:
+        recall@k is the fraction of exact top-k chunks it also retrieves.
+        Questions are embedded once, so only the search itself is timed.
+        Requires a retriever supporting two-stage retrieval (CosSimRetriever).
+
+        Args:
+            coarse_dims (Sequence[int]): Dimensions of coarse scoring to try.
+            n_candidates (Sequence[int]): Numbers of re-ranked candidates to try.
+            projection (str): Projection method, "pca" or "truncate".
+            k (int): Number of chunks to retrieve.
+
+        Returns:
+            pd.DataFrame: One row per configuration (exact search first), with
+                `coarse_dim`, `n_candidates`, `recall_at_k`, `ms_per_query`,
+                `speedup` and `fit_seconds` columns.
+        """
+        ret = self.ret
+        if not isinstance(ret, CosSimRetriever):
+            raise ValueError(f"Two-stage retrieval is unsupported: {ret}")
+
+        log_ongoing("Measuring two-stage retrieval trade-off...")
+        query_embs = [ret.embed(question) for question, _ in self._iter_questions()]
+        config = (ret.coarse_dim, ret.projection, ret.n_candidates)
+
+        def run(coarse_dim, n_cand):
+            ret.set_two_stage(coarse_dim, projection, n_cand)
+            fit_start = time.perf_counter()
+            if coarse_dim is not None:
+                ret._coarse_index()
+            fit_seconds = time.perf_counter() - fit_start
+
+            start = time.perf_counter()
+            ids = [
+                set(ret._search(query_emb, k, where=self.where)["id"].tolist())
+                for query_emb in query_embs
+            ]
+            ms_per_query = (time.perf_counter() - start) * 1000 / max(len(ids), 1)
+            return ids, ms_per_query, fit_seconds
+
+        exact_ids, exact_ms, _ = run(None, 0)
+        rows = [(None, None, 1.0, exact_ms, 0.0)]
+        for coarse_dim in coarse_dims:
+            for n_cand in n_candidates:
+                ids, ms, fit_seconds = run(coarse_dim, n_cand)
+                recall = np.mean(
+                    [
+                        len(found & exact) / len(exact) if exact else 1.0
+                        for found, exact in zip(ids, exact_ids)
+                    ]
+                )
+                rows.append((coarse_dim, n_cand, float(recall), ms, fit_seconds))
+
+        ret.set_two_stage(*config)
+
+        report = pd.DataFrame(
+            rows,
+            columns=[
+                "coarse_dim",
+                "n_candidates",
+                "recall_at_k",
+                "ms_per_query",
+                "fit_seconds",
+            ],
+        )
+        report["speedup"] = exact_ms / report["ms_per_query"]
+        for _, row in report.iterrows():
+            log_info(
+                f"coarse_dim={row['coarse_dim']}, "
+                f"n_candidates={row['n_candidates']}: "
+                f"recall@{k}={row['recall_at_k']:.3f}, "
+                f"{row['ms_per_query']:.3f} ms/query ({row['speedup']:.2f}x)"
+            )
+        log_done("Successfully measured two-stage retrieval trade-off!")
+        return report
+
+    def concurrency_report(
+        self,
+        thread_counts: Sequence[int] = (1, 2, 4, 8),
+        duration: float = 2.0,
+        ingest_batch_size: int = 64,
+        k: int = 10,
+    ) -> pd.DataFrame:
+        """
+        Stress-test concurrent querying during continuous ingestion: measure
+        query throughput with increasing numbers of query threads, while a
+        writer thread keeps adding (and deleting) documents in the same
+        retriever. Questions are embedded once, so only the search is timed.
+
+        Ingested documents are copies of already indexed chunks, added with
+        their stored embeddings under a separate corpus. Only the latest few
+        are kept, and all of them are deleted (and compacted away) at the end.
+        Requires a retriever supporting concurrent querying (CosSimRetriever).
+
+        Args:
+            thread_counts (Sequence[int]): Numbers of query threads to try.
+            duration (float): Duration of each run, in seconds.
+            ingest_batch_size (int): Number of chunks per ingested document.
+            k (int): Number of chunks to retrieve.
+
+        Returns:
+            pd.DataFrame: One row per number of threads, with `threads`,
+                `queries`, `qps`, `speedup`, `ingested_chunks` and `epochs`
+                (i.e. snapshots published during the run) columns.
+        """
+        ret = self.ret
+        if not isinstance(ret, CosSimRetriever):
+            raise ValueError(f"Concurrent querying is unsupported: {ret}")
+
+        log_ongoing("Measuring query throughput during ingestion...")
+        questions = [question for question, _ in self._iter_questions()]
+        query_embs = list(ret.embed(questions, 32).reshape(len(questions), -1))
+
+        n_source = min(len(ret.chunk_to_unique), ingest_batch_size * 16)
+        source_chunks = ret._load_chunks(list(range(n_source)))
+        source_embs = ret._load_embs(list(range(n_source)))
+        corpus = "__concurrency_report__"
+        keep_docs = 8
+        errors: List[BaseException] = []
+
+        def guarded(func):
+            # Exceptions of threads are re-raised once they are joined
+            def wrapper(*args) -> None:
+                try:
+                    func(*args)
+                except BaseException as e:
+                    errors.append(e)
+
+            return wrapper
+
+        def ingest(stop: threading.Event, counts: List[int]) -> None:
+            doc_id = 0
+            while not stop.is_set():
+                lo = doc_id * ingest_batch_size % n_source
+                batch = slice(lo, lo + ingest_batch_size)
+                ret.add_chunks(
+                    source_chunks[batch],
+                    corpus=corpus,
+                    doc_id=doc_id,
+                    chunk_embs=source_embs[batch],
+                )
+                if doc_id >= keep_docs:
+                    ret.delete_document(corpus, doc_id - keep_docs)
+                counts[0] += len(source_chunks[batch])
+                doc_id += 1
+            for old_id in range(max(doc_id - keep_docs, 0), doc_id):
+                ret.delete_document(corpus, old_id)
+
+        def query(idx: int, n_threads: int, stop: threading.Event, counts) -> None:
+            while not stop.is_set():
+                query_emb = query_embs[(counts[idx] * n_threads + idx) % len(questions)]
+                ret._search(query_emb, k, where=self.where)
+                counts[idx] += 1
+
+        def run(n_threads: int) -> Tuple[int, float, int, int]:
+            stop = threading.Event()
+            query_counts = [0] * n_threads
+            ingest_counts = [0]
+            threads = [
+                threading.Thread(target=guarded(ingest), args=(stop, ingest_counts))
+            ]
+            threads += [
+                threading.Thread(
+                    target=guarded(query), args=(idx, n_threads, stop, query_counts)
+                )
+                for idx in range(n_threads)
+            ]
+
+            epoch = ret.epoch
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            time.sleep(duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            if errors:
+                raise errors[0]
+            n_queries = sum(query_counts)
+            n_epochs = ret.epoch - epoch
+            return n_queries, n_queries / elapsed, ingest_counts[0], n_epochs
+
+        # Every ingested document would otherwise be logged
+        log_enabled = log.log_enabled
+        log.set_log_enabled(False)
+        try:
+            rows = [(n_threads, *run(n_threads)) for n_threads in thread_counts]
+        finally:
+            log.set_log_enabled(log_enabled)
+        ret.compact()
+
+        report = pd.DataFrame(
+            rows, columns=["threads", "queries", "qps", "ingested_chunks", "epochs"]
+        )
+        report["speedup"] = report["qps"] / report["qps"].iloc[0]
+        for _, row in report.iterrows():
+            log_info(
+                f"threads={row['threads']}: {row['qps']:.1f} queries/s "
+                f"({row['speedup']:.2f}x), {row['ingested_chunks']} chunk(s) "
+                f"ingested, {row['epochs']} snapshot(s)"
+            )
+        log_done("Successfully measured query throughput during ingestion!")
+        return report
+
+    def query_cache_report(
+        self,
+        thresholds: Sequence[float] = (0.85, 0.9, 0.95, 0.98),
+        max_entries: int = 1024,
+        ttl: Optional[float] = None,
+    ) -> pd.DataFrame:
+        """
+        Measure hit rate and quality impact of the semantic query cache.
+        Questions are queried one at a time, in order, as a stream of traffic:
+        first uncached, and then through a fresh `QueryCache` per threshold.
+        Quality is measured as recall and precision against the references,
+        and as overlap@k, i.e. the fraction of uncached top-k chunks that are
+        also retrieved through the cache.
+
+        Args:
+            thresholds (Sequence[float]): Similarity thresholds to try.
+            max_entries (int): Maximum number of cached queries.
+            ttl (Optional[float]): Time to live of an entry, in seconds.
+
+        Returns:
+            pd.DataFrame: One row per threshold (uncached first), with
+                `threshold`, `hit_rate`, `recall`, `precision`,
+                `overlap_at_k`, `ms_per_query` and `speedup` columns.
+        """
+        log_ongoing("Measuring semantic query cache hit rate and quality...")
+        questions = list(self._iter_questions())
+        query_cache = self.ret.query_cache
+
+        def run(threshold):
+            cache = None
+            if threshold is not None:
+                cache = QueryCache(threshold, max_entries=max_entries, ttl=ttl)
+            self.ret.set_query_cache(cache)
+
+            start = time.perf_counter()
+            all_spans = [
+                self.ret.query_spans(question, self.k, where=self.where)
+                for question, _ in questions
+            ]
+            ms_per_query = (time.perf_counter() - start) * 1000 / max(len(questions), 1)
+
+            scores = [
+                self._score(ref_ranges, spans)
+                for (_, ref_ranges), spans in zip(questions, all_spans)
+            ]
+            recall, precision = np.mean(scores, axis=0) if scores else (0.0, 0.0)
+            hit_rate = 0.0 if cache is None else cache.hit_rate
+            return all_spans, hit_rate, recall, precision, ms_per_query
+
+        try:
+            exact_spans, _, recall, precision, exact_ms = run(None)
+            rows = [(None, 0.0, recall, precision, 1.0, exact_ms)]
+            for threshold in thresholds:
+                all_spans, hit_rate, recall, precision, ms = run(threshold)
+                overlap = np.mean(
+                    [
+                        (
+                            len(set(spans["id"].tolist()) & set(exact["id"].tolist()))
+                            / len(exact)
+                            if len(exact) > 0
+                            else 1.0
+                        )
+                        for spans, exact in zip(all_spans, exact_spans)
+                    ]
+                )
+                rows.append(
+                    (threshold, hit_rate, recall, precision, float(overlap), ms)
+                )
+        finally:
+            self.ret.set_query_cache(query_cache)
+
+        report = pd.DataFrame(
+            rows,
+            columns=[
+                "threshold",
+                "hit_rate",
+                "recall",
+                "precision",
+                "overlap_at_k",
+                "ms_per_query",
+            ],
+        )
+        report["speedup"] = exact_ms / report["ms_per_query"]
+        for _, row in report.iterrows():
+            log_info(
+                f"threshold={row['threshold']}: "
+                f"hit rate={row['hit_rate']:.3f}, "
+                f"recall={row['recall']:.4f}, precision={row['precision']:.4f}, "
+                f"overlap@{self.k}={row['overlap_at_k']:.3f}, "
+                f"{row['ms_per_query']:.3f} ms/query ({row['speedup']:.2f}x)"
+            )
+        log_done("Successfully measured semantic query cache!")
+        return report
+
+
+def _spent_z(confidence: float, test_idx: int, n_metrics: int) -> float:
+    """
+    Critical value of the two-sided normal interval of the `test_idx`-th
+    (1-based) sequential test, spending error rate `1 - confidence` over all
+    the tests, and splitting it evenly between `n_metrics` metrics.
+    """
+    alpha = (1 - confidence) / (test_idx * (test_idx + 1)) / n_metrics
+    return NormalDist().inv_cdf(1 - alpha / 2)
+
+
+class _RunningMean:
+    """
+    Running mean and variance, by Welford's online algorithm.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float) -> None:
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+
+    def std(self) -> float:
+        """
+        Population standard deviation, same as `np.std`.
+        """
+        return (self._m2 / self.n) ** 0.5 if self.n > 0 else 0.0
+
+    def sem(self) -> float:
+        """
+        Standard error of the mean, using the sample variance.
+        """
+        if self.n < 2:
+            return float("inf")
+        return (self._m2 / (self.n - 1) / self.n) ** 0.5
@@ -20,34 +20,7 @@ cd $UTILS_DIR
 #     "$EXPERIMENTS_DIR/state_of_the_union/experiments.csv" \
 #     "$EXPERIMENTS_DIR/plots/recall_vs_precision_database_sotu.png"
 
-# K choice vs Dataset
-FUNC=recall_vs_precision ./plot.py \
-    "k" \
-    "$EXPERIMENTS_DIR/wikitexts/experiments.csv" \
-    "$EXPERIMENTS_DIR/plots/recall_vs_precision_k_wikitexts.png"
-
-FUNC=recall_vs_precision ./plot.py \
-    "k" \
-    "$EXPERIMENTS_DIR/chatlogs/experiments.csv" \
-    "$EXPERIMENTS_DIR/plots/recall_vs_precision_k_chatlogs.png"
-
-FUNC=recall_vs_precision ./plot.py \
-    "k" \
-    "$EXPERIMENTS_DIR/state_of_the_union/experiments.csv" \
-    "$EXPERIMENTS_DIR/plots/recall_vs_precision_k_sotu.png"
-
-# Chunk Size and Chunk Ooverlap vs Dataset
-FUNC=recall_vs_precision ./plot.py \
-    "chunk_size" "chunk_overlap" \
-    "$EXPERIMENTS_DIR/wikitexts/experiments.csv" \
-    "$EXPERIMENTS_DIR/plots/recall_vs_precision_cs_co_wikitexts.png"
-
-FUNC=recall_vs_precision ./plot.py \
-    "chunk_size" "chunk_overlap" \
-    "$EXPERIMENTS_DIR/chatlogs/experiments.csv" \
-    "$EXPERIMENTS_DIR/plots/recall_vs_precision_cs_co_chatlogs.png"
-
-FUNC=recall_vs_precision ./plot.py \
-    "chunk_size" "chunk_overlap" \
-    "$EXPERIMENTS_DIR/state_of_the_union/experiments.csv" \
-    "$EXPERIMENTS_DIR/plots/recall_vs_precision_cs_co_sotu.png"
+# K choice vs Dataset, and Chunk Size and Chunk Overlap vs Dataset.
+# All the figures are rendered in a single, parallel batch. See `plots.json`.
+FUNC=recall_vs_precision_batch ./plot.py \
+    "$EXPERIMENTS_DIR/plots/plots.json"
@@ -1,21 +1,30 @@
 #!/usr/bin/env python3
 
 import os
-from pathlib import Path
+import sys
+import time
 
+import pandas as pd
+from bench import LoadGenerator, synthetic_questions
 from dotenv import load_dotenv
 from eval import Evaluation
-from retrieve import FixedTokenChunker, Retriever
-from sentence_transformers import SentenceTransformer
+from retrieve import CHUNKERS, IndexKey, IndexRegistry, PreforkPool, Reranker, Retriever
+from sentence_transformers import CrossEncoder, SentenceTransformer
+from tune import ChunkTuner, sample_configs
 from utils import parse_args  # noqa: E501
 from utils import (  # noqa: F401
-    download,
+    ResultsStore,
+    corpus_digest,
+    download_all,
     expand_path,
+    load_checksums,
     load_df,
+    load_questions,
     log_experiment,
     log_info,
     make_path,
     parse_txt,
+    pin_checksums,
     preprocess_df,
 )
 
@@ -24,57 +33,257 @@ load_dotenv(os.getenv("DOTENV_PATH"))
 
 if __name__ == "__main__":
     args = parse_args()
+    timings = {}
 
-    # Download and prepare dataset
+    # Checked upfront, rather than once corpora are indexed and evaluated
+    if args.ret_type != "cos_sim":
+        for option in ["coarse_dim", "two_stage_report", "concurrency_report"]:
+            if getattr(args, option) is not None:
+                raise ValueError(f"`{option}` requires `--ret_type cos_sim`.")
+        if args.workers > 1:
+            raise ValueError("`workers` > 1 requires `--ret_type cos_sim`.")
+
+    # Download and prepare datasets
+    start = time.perf_counter()
     args.dataset_dir = make_path(args.dataset_dir)
-    file_path = download(
+    manifest_path = os.getenv("DEFAULT__CORPORA_CHECKSUMS_PATH")
+    file_paths = download_all(
         base_url=os.getenv("DEFAULT__CORPORA_GITHUB_RAW_URL", ""),
         local_dir=args.dataset_dir,
-        dataset=args.dataset,
+        datasets=args.dataset,
         force_download=False,
+        checksums=load_checksums(manifest_path),
     )
-    if file_path is None:
+    checksums = pin_checksums(manifest_path, file_paths)
+    if any(file_path is None for file_path in file_paths.values()):
         raise ValueError("Download method returned None.")
 
-    content = parse_txt(file_path)
+    contents = {ds: parse_txt(file_path) for ds, file_path in file_paths.items()}
+
+    # Questions are compiled into a columnar cache once, and then memory-mapped
+    args.cache_dir = make_path(args.cache_dir)
+    questions = load_questions(
+        args.questions_df_path,
+        cache_dir=args.cache_dir,
+        force=args.recompile_questions,
+    )
+    timings["prepare"] = time.perf_counter() - start
+
+    if args.pipelined and args.late_chunking:
+        raise ValueError("Late chunking is not supported by pipelined ingestion.")
+    if args.load_mode is not None and args.results_db is None:
+        raise ValueError("Load tests require a results store (`results_db`).")
+
+    def build_index(key, ret):
+        # All corpora are indexed once, into a single index
+        ret.reset()
+        for ds, content in contents.items():
+            if args.pipelined:
+                ret.ingest(
+                    content, corpus=ds, reset=False, emb_batch_size=args.batch_size
+                )
+            else:
+                ret.add_document(
+                    content,
+                    corpus=ds,
+                    emb_batch_size=args.batch_size,
+                    late_chunking=args.late_chunking,
+                )
 
-    questions_df = load_df(args.questions_df_path)
-    questions_df = preprocess_df(questions_df, dataset=args.dataset)
-    questions_df_filepath = Path(args.dataset_dir) / Path("questions_df.csv")
-    questions_df.to_csv(questions_df_filepath, index=False)
+    # Passed to every retriever created, rather than set once it is built,
+    # as only retrievers of the matching type accept them (checked upfront)
+    ret_kwargs = {}
+    if args.coarse_dim is not None:
+        ret_kwargs = {
+            "coarse_dim": args.coarse_dim,
+            "projection": args.projection,
+            "n_candidates": args.n_candidates,
+        }
+    if args.ret_type == "sharded":
+        ret_kwargs["n_shards"] = args.n_shards
 
-    # Set up chunker and embedding model
-    chunker = FixedTokenChunker(
+    key = IndexKey(
+        corpus="+".join(sorted(contents)),
+        model=args.emb_model,
+        chunker=args.chunker,
         chunk_size=args.chunk_size,
         chunk_overlap=args.chunk_overlap,
+        backend=args.ret_type,
+        late_chunking=args.late_chunking,
+        corpus_digest=corpus_digest(file_paths, checksums),
     )
-    emb_model = SentenceTransformer(args.emb_model)
 
-    # Create Retriever
-    ret = Retriever.from_kwargs(
-        type=args.ret_type,
-        chunker=chunker,
-        emb_model=emb_model,
-    )
-    ret.from_document(content)
+    if args.tune_configs is not None:
+        # Chunk size and overlap are tuned, rather than evaluated as given.
+        # Indexes of the candidates are persisted, so re-runs reuse them.
+        index_dir = args.index_dir or os.path.join(args.cache_dir, "indexes")
+        registry = IndexRegistry(
+            make_path(index_dir),
+            build=build_index,
+            cache_dir=args.cache_dir,
+            ret_kwargs=ret_kwargs,
+        )
+        tuner = ChunkTuner(
+            registry,
+            key,
+            questions,
+            datasets=args.dataset,
+            k=args.k,
+            metric=args.tune_metric,
+            min_questions=args.tune_min_questions,
+        )
+        configs = sample_configs(
+            args.tune_chunk_sizes, args.tune_chunk_overlaps, args.tune_configs
+        )
+        best, table = tuner.run(configs)
+        registry.close()
 
-    # Set up evaluation framework
-    eval = Evaluation(ret, questions_df)
-    res = eval(["recall", "precision"])
+        if args.tune_report is not None:
+            report_path = expand_path(args.tune_report)
+            table.to_csv(report_path, index=False)
+            log_info(f"Saved chunk configuration tuning report to: {report_path}")
+        log_info(f"Best configuration: chunk_size={best[0]}, chunk_overlap={best[1]}")
+        sys.exit(0)
 
-    log_info(f"Recall: {res['recall'] * 100:.2f} +- {res['recall_std'] * 100:.2f}")
-    log_info(
-        f"Precision: {res['precision'] * 100:.2f} +- {res['precision_std'] * 100:.2f}"
-    )
+    start = time.perf_counter()
+    if args.index_dir is not None:
+        # Index is loaded from its persisted artifacts, if built by a past run
+        registry = IndexRegistry(
+            make_path(args.index_dir),
+            build=build_index,
+            cache_dir=args.cache_dir,
+            ret_kwargs=ret_kwargs,
+        )
+        ret = registry.get(key)
+    else:
+        # Fixed-size chunks window over a token stream, cached once per corpus
+        chunker_kwargs = {}
+        if args.chunker == "fixed_token":
+            chunker_kwargs["cache_dir"] = args.cache_dir
+        chunker = CHUNKERS[args.chunker](
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            **chunker_kwargs,
+        )
+        ret = Retriever.from_kwargs(
+            type=args.ret_type,
+            chunker=chunker,
+            emb_model=SentenceTransformer(args.emb_model),
+            **ret_kwargs,
+        )
+        build_index(None, ret)
+    timings["index"] = time.perf_counter() - start
+
+    # Workers are forked once the model is loaded and the index is built
+    pool = PreforkPool(ret, processes=args.workers) if args.workers > 1 else None
+
+    reranker = None
+    if args.rerank_model is not None:
+        reranker = Reranker(
+            CrossEncoder(args.rerank_model),
+            n_candidates=args.rerank_candidates,
+            batch_size=args.rerank_batch_size,
+            budget_ms=args.rerank_budget_ms,
+        )
+
+    reports = []
+    concurrency_reports = []
+    query_cache_reports = []
+    for ds in args.dataset:
+        # Retrieval is restricted to the corpus of the questions
+        eval = Evaluation(
+            ret,
+            questions.filter(ds),
+            where={"corpus": ds},
+            pool=pool,
+            reranker=reranker,
+            k=args.k,
+        )
+        start = time.perf_counter()
+        if args.ci_width is not None:
+            baseline = {
+                metric: value
+                for metric, value in [
+                    ("recall", args.baseline_recall),
+                    ("precision", args.baseline_precision),
+                ]
+                if value is not None
+            }
+            res = eval.eval_sequential(
+                ["recall", "precision"], ci_width=args.ci_width, baseline=baseline
+            )
+            log_info(f"Scored {res['n_questions']} questions ({res['stop_reason']}).")
+        else:
+            res = eval(["recall", "precision"])
+        ds_timings = {**timings, "eval": time.perf_counter() - start}
+
+        log_info(f"Dataset: {ds}")
+        log_info(f"Recall: {res['recall'] * 100:.2f} +- {res['recall_std'] * 100:.2f}")
+        log_info(
+            f"Precision: {res['precision'] * 100:.2f} "
+            f"+- {res['precision_std'] * 100:.2f}"
+        )
+
+        setup = {
+            "exp_name": args.exp_name,
+            "dataset": ds,
+            "chunker": str(ret.chunker),
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "ret_type": args.ret_type,
+            "k": args.k,
+            "emb_model": args.emb_model,
+        }
+        if reranker is not None:
+            setup["rerank_model"] = args.rerank_model
+
+        if args.log is not None:
+            log_experiment(setup, res, log_path=expand_path(args.log))
+        if args.results_db is not None:
+            with ResultsStore(args.results_db, shared=args.results_shared) as store:
+                store.log_run(setup, res, timings=ds_timings)
+
+        if args.two_stage_report is not None:
+            report = eval.two_stage_report(projection=args.projection, k=args.k)
+            reports.append(report.assign(dataset=ds))
+        if args.concurrency_report is not None:
+            report = eval.concurrency_report(k=args.k)
+            concurrency_reports.append(report.assign(dataset=ds))
+        if args.query_cache_report is not None:
+            report = eval.query_cache_report()
+            query_cache_reports.append(report.assign(dataset=ds))
+
+        if args.load_mode is not None:
+            if args.load_synthetic is not None:
+                load_test_questions = synthetic_questions(ret, args.load_synthetic)
+            else:
+                load_test_questions = questions.filter(ds).questions.tolist()
+
+            # Every k is a separate configuration, next to its quality metrics
+            for load_k in args.load_k or [args.k]:
+                results = LoadGenerator.for_retriever(
+                    ret, load_test_questions, k=load_k, where={"corpus": ds}
+                ).run(
+                    mode=args.load_mode,
+                    concurrency=args.load_concurrency,
+                    rates=args.load_rate,
+                    duration=args.load_duration,
+                )
+                with ResultsStore(args.results_db, shared=args.results_shared) as store:
+                    store.log_load_tests({**setup, "k": load_k}, results)
+
+    if pool is not None:
+        pool.close()
 
-    setup = {
-        "exp_name": args.exp_name,
-        "dataset": args.dataset,
-        "chunker": str(chunker),
-        "chunk_size": args.chunk_size,
-        "chunk_overlap": args.chunk_overlap,
-        "ret_type": args.ret_type,
-        "k": args.k,
-    }
-
-    log_experiment(setup, res, log_path=expand_path(args.log))
+    if reports:
+        report_path = expand_path(args.two_stage_report)
+        pd.concat(reports).to_csv(report_path, index=False)
+        log_info(f"Saved two-stage retrieval report to: {report_path}")
+    if concurrency_reports:
+        report_path = expand_path(args.concurrency_report)
+        pd.concat(concurrency_reports).to_csv(report_path, index=False)
+        log_info(f"Saved concurrency report to: {report_path}")
+    if query_cache_reports:
+        report_path = expand_path(args.query_cache_report)
+        pd.concat(query_cache_reports).to_csv(report_path, index=False)
+        log_info(f"Saved query cache report to: {report_path}")
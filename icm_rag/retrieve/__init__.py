@@ -1,4 +1,21 @@
-from .chunking import FixedTokenChunker
+from .chunking import FixedTokenChunker, RecursiveTokenChunker
+from .pool import PreforkPool
+from .query_cache import QueryCache
+from .registry import CHUNKERS, IndexKey, IndexRegistry
+from .rerank import Reranker
+from .result import SPAN_DTYPE, RetrievedChunk
 from .retriever import Retriever
 
-__all__ = ["FixedTokenChunker", "Retriever"]
+__all__ = [
+    "CHUNKERS",
+    "FixedTokenChunker",
+    "IndexKey",
+    "IndexRegistry",
+    "PreforkPool",
+    "QueryCache",
+    "RecursiveTokenChunker",
+    "Reranker",
+    "Retriever",
+    "RetrievedChunk",
+    "SPAN_DTYPE",
+]
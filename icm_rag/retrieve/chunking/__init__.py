@@ -1,3 +1,4 @@
 from .fixed_token_chunker import FixedTokenChunker
+from .recursive_token_chunker import RecursiveTokenChunker
 
-__all__ = ["FixedTokenChunker"]
+__all__ = ["FixedTokenChunker", "RecursiveTokenChunker"]
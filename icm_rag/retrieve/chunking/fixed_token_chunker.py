@@ -1,6 +1,8 @@
 # This script is being used as a part of JetBrains Internship Application Test Task.
 # As such, it has only been modified for logging purposes,
-# i.e. __str__(self) is implemented.
+# i.e. __str__(self) is implemented, and for performance purposes,
+# i.e. TextSplitter._merge_splits runs in linear time, and FixedTokenChunker
+# may window over a cached token stream.
 # All the credits go to the authors.
 
 # This script is adapted from the LangChain package, developed by LangChain AI.
@@ -12,17 +14,22 @@
 
 import logging
 from abc import ABC, abstractmethod
+from collections import deque
 from enum import Enum
+from pathlib import Path
 from typing import (
     AbstractSet,
     Any,
     Callable,
     Collection,
+    Deque,
+    Dict,
     Iterable,
     List,
     Literal,
     Optional,
     Sequence,
+    Tuple,
     Type,
     TypeVar,
     Union,
@@ -31,6 +38,7 @@ from typing import (
 from attr import dataclass
 
 from .base_chunker import BaseChunker
+from .token_cache import load_tokens, token_windows
 
 logger = logging.getLogger(__name__)
 
@@ -90,11 +98,19 @@ class TextSplitter(BaseChunker, ABC):
         # chunks to send to the LLM.
         separator_len = self._length_function(separator)
 
+        # Each split is measured only once. Repeated splits (e.g. boilerplate)
+        # are measured once per call, too.
+        lengths: Dict[str, int] = {}
+
         docs = []
-        current_doc: List[str] = []
+        # Pieces of the current document, together with their lengths.
+        # Popping from the front of a deque is O(1), unlike slicing a list.
+        current_doc: Deque[Tuple[str, int]] = deque()
         total = 0
         for d in splits:
-            _len = self._length_function(d)
+            _len = lengths.get(d)
+            if _len is None:
+                _len = lengths[d] = self._length_function(d)
             if (
                 total + _len + (separator_len if len(current_doc) > 0 else 0)
                 > self._chunk_size
@@ -105,7 +121,8 @@ class TextSplitter(BaseChunker, ABC):
                         f"which is longer than the specified {self._chunk_size}"
                     )
                 if len(current_doc) > 0:
-                    doc = self._join_docs(current_doc, separator)
+                    pieces = [piece for piece, _ in current_doc]
+                    doc = self._join_docs(pieces, separator)
                     if doc is not None:
                         docs.append(doc)
                     # Keep on popping if:
@@ -116,13 +133,13 @@ class TextSplitter(BaseChunker, ABC):
                         > self._chunk_size
                         and total > 0
                     ):
-                        total -= self._length_function(current_doc[0]) + (
+                        total -= current_doc[0][1] + (
                             separator_len if len(current_doc) > 1 else 0
                         )
-                        current_doc = current_doc[1:]
-            current_doc.append(d)
+                        current_doc.popleft()
+            current_doc.append((d, _len))
             total += _len + (separator_len if len(current_doc) > 1 else 0)
-        doc = self._join_docs(current_doc, separator)
+        doc = self._join_docs([piece for piece, _ in current_doc], separator)
         if doc is not None:
             docs.append(doc)
         return docs
@@ -204,9 +221,16 @@ class FixedTokenChunker(TextSplitter):
         chunk_overlap: int = 200,
         allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),
         disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+        cache_dir: Optional[Union[Path, str]] = None,
         **kwargs: Any,
     ) -> None:
-        """Create a new TextSplitter."""
+        """Create a new TextSplitter.
+
+        Args:
+            cache_dir: If given, the token stream of every text is cached under
+                this directory, and later splits (with any chunk size and
+                overlap) window over it, without re-encoding the text.
+        """
         super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
         try:
             import tiktoken
@@ -224,8 +248,12 @@ class FixedTokenChunker(TextSplitter):
         self._tokenizer = enc
         self._allowed_special = allowed_special
         self._disallowed_special = disallowed_special
+        self._cache_dir = cache_dir
 
     def split_text(self, text: str) -> List[str]:
+        if self._cache_dir is not None:
+            return self._split_text_cached(text)
+
         def _encode(_text: str) -> List[int]:
             return self._tokenizer.encode(
                 _text,
@@ -242,6 +270,28 @@ class FixedTokenChunker(TextSplitter):
 
         return split_text_on_tokens(text=text, tokenizer=tokenizer)
 
+    def _split_text_cached(self, text: str) -> List[str]:
+        """Split text over its memory-mapped token stream.
+        Chunks are sliced from the text by the tokens' character offsets,
+        which, unlike decoding, never splits a multi-byte character.
+        """
+        token_ids, char_offsets = load_tokens(
+            text,
+            self._tokenizer,
+            self._cache_dir,
+            allowed_special=self._allowed_special,
+            disallowed_special=self._disallowed_special,
+        )
+        starts, ends = token_windows(
+            len(token_ids), self._chunk_size, self._chunk_overlap
+        )
+        return [
+            text[lo:hi]
+            for lo, hi in zip(
+                char_offsets[starts].tolist(), char_offsets[ends].tolist()
+            )
+        ]
+
     def __str__(self):
         return f"FixedTokenChunker"
 
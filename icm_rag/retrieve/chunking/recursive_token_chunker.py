@@ -0,0 +1,143 @@
+# This script is adapted from the LangChain package, developed by LangChain AI.
+# Original code can be found at: https://github.com/langchain-ai/langchain/blob/master/libs/text-splitters/langchain_text_splitters/character.py
+# License: MIT License
+# It has been modified to measure chunk sizes in tiktoken tokens by default,
+# so that it can be benchmarked against FixedTokenChunker.
+
+# mypy: disable-error-code="call-arg"
+# flake8: noqa
+
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from .fixed_token_chunker import TextSplitter
+
+
+def _split_text_with_regex(
+    text: str, separator: str, keep_separator: bool
+) -> List[str]:
+    # Now that we have the separator, split the text
+    if separator:
+        if keep_separator:
+            # The parentheses in the pattern keep the delimiters in the result.
+            _splits = re.split(f"({separator})", text)
+            splits = [_splits[i] + _splits[i + 1] for i in range(1, len(_splits), 2)]
+            if len(_splits) % 2 == 0:
+                splits += _splits[-1:]
+            splits = [_splits[0]] + splits
+        else:
+            splits = re.split(separator, text)
+    else:
+        splits = list(text)
+    return [s for s in splits if s != ""]
+
+
+class RecursiveTokenChunker(TextSplitter):
+    """Splitting text by recursively looking at separators, from the coarsest
+    (paragraphs) to the finest (characters), until chunks are small enough."""
+
+    def __init__(
+        self,
+        chunk_size: int = 4000,
+        chunk_overlap: int = 200,
+        separators: Optional[List[str]] = None,
+        keep_separator: bool = True,
+        is_separator_regex: bool = False,
+        encoding_name: str = "cl100k_base",
+        length_function: Optional[Callable[[str], int]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Create a new RecursiveTokenChunker.
+
+        Args:
+            chunk_size: Maximum size of chunks to return, in tokens
+            chunk_overlap: Overlap in tokens between chunks
+            separators: Separators to split on, from the coarsest to the finest
+            keep_separator: Whether to keep the separator in the chunks
+            is_separator_regex: Whether separators are regular expressions
+            encoding_name: tiktoken encoding used to count tokens
+            length_function: If given, used instead of the tiktoken token count
+        """
+        if length_function is None:
+            try:
+                import tiktoken
+            except ImportError:
+                raise ImportError(
+                    "Could not import tiktoken python package. "
+                    "This is needed in order to for RecursiveTokenChunker. "
+                    "Please install it with `pip install tiktoken`."
+                )
+            enc = tiktoken.get_encoding(encoding_name)
+
+            def length_function(text: str) -> int:
+                return len(enc.encode(text, disallowed_special=()))
+
+        # Every piece is measured both when choosing splits and when merging
+        # them, so lengths are memoized for the duration of `split_text`.
+        self._raw_length_function = length_function
+        self._length_cache: Dict[str, int] = {}
+
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=self._cached_length,
+            keep_separator=keep_separator,
+            **kwargs,
+        )
+        self._separators = separators or ["\n\n", "\n", ".", "?", "!", " ", ""]
+        self._is_separator_regex = is_separator_regex
+
+    def _cached_length(self, text: str) -> int:
+        length = self._length_cache.get(text)
+        if length is None:
+            length = self._length_cache[text] = self._raw_length_function(text)
+        return length
+
+    def _split_text(self, text: str, separators: List[str]) -> List[str]:
+        """Split incoming text and return chunks."""
+        final_chunks = []
+        # Get appropriate separator to use
+        separator = separators[-1]
+        new_separators = []
+        for i, _s in enumerate(separators):
+            _separator = _s if self._is_separator_regex else re.escape(_s)
+            if _s == "":
+                separator = _s
+                break
+            if re.search(_separator, text):
+                separator = _s
+                new_separators = separators[i + 1 :]
+                break
+
+        _separator = separator if self._is_separator_regex else re.escape(separator)
+        splits = _split_text_with_regex(text, _separator, self._keep_separator)
+
+        # Now go merging things, recursively splitting longer texts.
+        _good_splits = []
+        _separator = "" if self._keep_separator else separator
+        for s in splits:
+            if self._length_function(s) < self._chunk_size:
+                _good_splits.append(s)
+            else:
+                if _good_splits:
+                    merged_text = self._merge_splits(_good_splits, _separator)
+                    final_chunks.extend(merged_text)
+                    _good_splits = []
+                if not new_separators:
+                    final_chunks.append(s)
+                else:
+                    other_info = self._split_text(s, new_separators)
+                    final_chunks.extend(other_info)
+        if _good_splits:
+            merged_text = self._merge_splits(_good_splits, _separator)
+            final_chunks.extend(merged_text)
+        return final_chunks
+
+    def split_text(self, text: str) -> List[str]:
+        try:
+            return self._split_text(text, self._separators)
+        finally:
+            self._length_cache = {}
+
+    def __str__(self):
+        return f"RecursiveTokenChunker"
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import AbstractSet, Collection, List, Literal, Tuple, Union
+
+import numpy as np
+from utils.log import log_done, log_ongoing
+
+TOKEN_CACHE_ARRAYS = ["token_ids", "char_offsets"]
+
+
+def token_cache_path(
+    text: str,
+    encoding_name: str,
+    cache_dir: Union[Path, str],
+    allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),
+) -> Path:
+    """
+    Get the directory of the token cache, for given corpus and encoding.
+
+    Args:
+        text (str): Content of the corpus.
+        encoding_name (str): Name of the tiktoken encoding, e.g. "cl100k_base".
+        cache_dir (Union[Path, str]): Root caching directory.
+        allowed_special (Union[Literal["all"], AbstractSet[str]]): Special
+            tokens allowed in the text, which change its tokenization.
+
+    Returns:
+        Path: Directory holding the token cache of `text`.
+    """
+    special = allowed_special if allowed_special == "all" else sorted(allowed_special)
+    digest = hashlib.sha256(text.encode("utf-8"))
+    digest.update(json.dumps(special).encode("utf-8"))
+    return Path(cache_dir) / "tokens" / encoding_name / digest.hexdigest()[:16]
+
+
+def _char_offsets(text: str, token_bytes: List[bytes]) -> np.ndarray:
+    """
+    Map every token to the character its first byte belongs to. A trailing
+    entry holds the length of the text, so that token window `[start, end)`
+    covers `text[offsets[start] : offsets[end]]`.
+    """
+    raw = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    # Every byte, other than UTF-8 continuation bytes, starts a character
+    char_of_byte = np.cumsum((raw & 0xC0) != 0x80) - 1
+
+    byte_lens = np.fromiter(map(len, token_bytes), dtype=np.int64)
+    byte_starts = np.cumsum(byte_lens) - byte_lens
+
+    offsets = np.empty(len(byte_lens) + 1, dtype=np.int64)
+    offsets[:-1] = char_of_byte[byte_starts]
+    offsets[-1] = len(text)
+    return offsets
+
+
+def _save_array(path: Path, array: np.ndarray) -> None:
+    """
+    Save array atomically, so that concurrent runs never read a partial file.
+    """
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def compile_tokens(
+    text: str,
+    tokenizer,
+    cache_dir: Union[Path, str],
+    allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),
+    disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    force: bool = False,
+) -> Path:
+    """
+    Encode corpus once, and cache its token stream as `.npy` arrays: token ids
+    (uint32), and the character offset of every token in the corpus.
+
+    Args:
+        text (str): Content of the corpus.
+        tokenizer (tiktoken.Encoding): Encoding to tokenize the corpus with.
+        cache_dir (Union[Path, str]): Root caching directory.
+        allowed_special (Union[Literal["all"], AbstractSet[str]]): Special
+            tokens allowed in the text.
+        disallowed_special (Union[Literal["all"], Collection[str]]): Special
+            tokens disallowed in the text.
+        force (bool): If True, re-encode even if the cache exists.
+
+    Returns:
+        Path: Directory holding the token cache.
+    """
+    cache_path = token_cache_path(text, tokenizer.name, cache_dir, allowed_special)
+    if not force and os.path.exists(cache_path / "meta.json"):
+        return cache_path
+
+    log_ongoing(f"Encoding corpus with {tokenizer.name} into: {cache_path}")
+    token_ids = tokenizer.encode(
+        text,
+        allowed_special=allowed_special,
+        disallowed_special=disallowed_special,
+    )
+    arrays = {
+        "token_ids": np.asarray(token_ids, dtype=np.uint32),
+        "char_offsets": _char_offsets(text, tokenizer.decode_tokens_bytes(token_ids)),
+    }
+
+    os.makedirs(cache_path, exist_ok=True)
+    for name in TOKEN_CACHE_ARRAYS:
+        _save_array(cache_path / f"{name}.npy", arrays[name])
+
+    # Written last, so that only complete caches are ever considered valid
+    with open(cache_path / "meta.json", "w", encoding="utf-8") as file:
+        json.dump({"encoding": tokenizer.name, "n_tokens": len(token_ids)}, file)
+
+    log_done(f"Successfully cached {len(token_ids)} tokens!")
+    return cache_path
+
+
+def load_tokens(
+    text: str,
+    tokenizer,
+    cache_dir: Union[Path, str],
+    allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),
+    disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the token stream of corpus from cache, encoding it first if needed.
+
+    Args:
+        text (str): Content of the corpus.
+        tokenizer (tiktoken.Encoding): Encoding to tokenize the corpus with.
+        cache_dir (Union[Path, str]): Root caching directory.
+        allowed_special (Union[Literal["all"], AbstractSet[str]]): Special
+            tokens allowed in the text.
+        disallowed_special (Union[Literal["all"], Collection[str]]): Special
+            tokens disallowed in the text.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Memory-mapped token ids, of shape
+            (n_tokens,), and character offsets, of shape (n_tokens + 1,).
+    """
+    cache_path = compile_tokens(
+        text,
+        tokenizer,
+        cache_dir,
+        allowed_special=allowed_special,
+        disallowed_special=disallowed_special,
+    )
+    token_ids, char_offsets = (
+        np.load(cache_path / f"{name}.npy", mmap_mode="r")
+        for name in TOKEN_CACHE_ARRAYS
+    )
+    return token_ids, char_offsets
+
+
+def token_windows(
+    n_tokens: int, tokens_per_chunk: int, chunk_overlap: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get token windows of fixed size and overlap, the same ones as
+    `split_text_on_tokens` produces.
+
+    Args:
+        n_tokens (int): Number of tokens in the stream.
+        tokens_per_chunk (int): Maximum number of tokens per window.
+        chunk_overlap (int): Number of tokens shared by consecutive windows.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Starting (inclusive) and ending
+            (exclusive) token indices of the windows.
+    """
+    if n_tokens == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # The last window is the first one to reach the end of the stream
+    stride = tokens_per_chunk - chunk_overlap
+    n_windows = max(-(-(n_tokens - tokens_per_chunk) // stride), 0) + 1
+    starts = np.arange(n_windows, dtype=np.int64) * stride
+    ends = np.minimum(starts + tokens_per_chunk, n_tokens)
+    return starts, ends
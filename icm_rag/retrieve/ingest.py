@@ -0,0 +1,147 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from utils.log import log_done, log_info, log_ongoing
+
+# Marks the end of the stream of batches, between two stages
+_DONE = None
+
+STAGES = ["chunk", "metadata", "embed", "index"]
+
+
+class IngestionPipeline:
+    """
+    This class implements pipelined ingestion of a document into a retriever.
+    Chunk batches flow through bounded asyncio queues:
+
+        chunk -> metadata -> embed -> index
+
+    Each stage runs its work on a thread executor, so CPU-bound metadata
+    generation (Python) overlaps with embedding (which releases the GIL) and
+    with indexing. Bounded queues provide backpressure: a stage blocks once
+    `queue_size` batches are waiting for the next one.
+    """
+
+    def __init__(
+        self,
+        ret,
+        add_metadata: bool = True,
+        corpus_id: int = 0,
+        doc_id: int = 0,
+        batch_size: int = 256,
+        emb_batch_size: int = 16,
+        queue_size: int = 4,
+    ):
+        self.ret = ret
+        self.add_metadata = add_metadata
+        self.corpus_id = corpus_id
+        self.doc_id = doc_id
+        self.batch_size = batch_size
+        self.emb_batch_size = emb_batch_size
+        self.queue_size = queue_size
+
+        self.stats: Dict[str, dict] = {
+            stage: {"batches": 0, "items": 0, "seconds": 0.0} for stage in STAGES
+        }
+
+    def run(self, content: str) -> Dict[str, dict]:
+        """
+        Ingest given document into the retriever.
+
+        Args:
+            content (str): Document to chunk.
+
+        Returns:
+            Dict[str, dict]: Per-stage counters, i.e. number of batches and
+                items processed, busy seconds and throughput (items / second).
+        """
+        log_ongoing("Running pipelined ingestion...")
+        start = time.perf_counter()
+        asyncio.run(self._run(content))
+        elapsed = time.perf_counter() - start
+
+        for stage, stats in self.stats.items():
+            stats["throughput"] = (
+                stats["items"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+            )
+            log_info(
+                f"Stage {stage}: {stats['items']} items in {stats['batches']} "
+                f"batches, {stats['seconds']:.2f}s busy, "
+                f"{stats['throughput']:.1f} items/s"
+            )
+        log_done(f"Successfully ingested document in {elapsed:.2f}s!")
+
+        return self.stats
+
+    async def _run(self, content: str) -> None:
+        to_metadata: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        to_embed: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        to_index: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        # One worker per stage, so that all the stages may run at once
+        with ThreadPoolExecutor(max_workers=len(STAGES)) as executor:
+            self._executor = executor
+            await asyncio.gather(
+                self._chunk_stage(content, to_metadata),
+                self._metadata_stage(content, to_metadata, to_embed),
+                self._embed_stage(to_embed, to_index),
+                self._index_stage(to_index),
+            )
+
+    async def _timed(self, stage: str, items: int, func: Callable, *args):
+        """
+        Run `func(*args)` on the executor, and record it in stage counters.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        res = await loop.run_in_executor(self._executor, func, *args)
+
+        stats = self.stats[stage]
+        stats["seconds"] += time.perf_counter() - start
+        stats["batches"] += 1
+        stats["items"] += items if items >= 0 else len(res)
+        return res
+
+    async def _chunk_stage(self, content: str, out_q: asyncio.Queue) -> None:
+        chunks = await self._timed("chunk", -1, self.ret.chunk, content)
+        for i in range(0, len(chunks), self.batch_size):
+            await out_q.put(chunks[i : i + self.batch_size])  # noqa: E203
+        await out_q.put(_DONE)
+
+    def _make_metadata(self, chunks: List[str], content: str) -> List[dict]:
+        return [self.ret._make_metadata_for_chunk(chunk, content) for chunk in chunks]
+
+    async def _metadata_stage(
+        self, content: str, in_q: asyncio.Queue, out_q: asyncio.Queue
+    ) -> None:
+        while (chunks := await in_q.get()) is not _DONE:
+            metadata = []
+            if self.add_metadata:
+                metadata = await self._timed(
+                    "metadata", len(chunks), self._make_metadata, chunks, content
+                )
+            await out_q.put((chunks, metadata))
+        await out_q.put(_DONE)
+
+    async def _embed_stage(self, in_q: asyncio.Queue, out_q: asyncio.Queue) -> None:
+        while (item := await in_q.get()) is not _DONE:
+            chunks, metadata = item
+
+            # Batches are deduplicated in order, so only new texts are embedded
+            texts = self.ret._dedupe(chunks, self.corpus_id, self.doc_id)
+            embs = None
+            if texts:
+                embs = await self._timed(
+                    "embed", len(texts), self.ret.embed, texts, self.emb_batch_size
+                )
+            await out_q.put((chunks, metadata, texts, embs))
+        await out_q.put(_DONE)
+
+    async def _index_stage(self, in_q: asyncio.Queue) -> None:
+        while (item := await in_q.get()) is not _DONE:
+            chunks, metadata, texts, embs = item
+            await self._timed(
+                "index", len(chunks), self.ret._append, chunks, metadata, texts, embs
+            )
@@ -0,0 +1,163 @@
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+
+def _special_tokens(tokenizer) -> Tuple[List[int], List[int]]:
+    """
+    Get special tokens surrounding each model input, e.g. [CLS] and [SEP].
+    """
+    prefix = tokenizer.cls_token_id
+    if prefix is None:
+        prefix = tokenizer.bos_token_id
+    suffix = tokenizer.sep_token_id
+    if suffix is None:
+        suffix = tokenizer.eos_token_id
+    return (
+        [] if prefix is None else [prefix],
+        [] if suffix is None else [suffix],
+    )
+
+
+def _normalizes(emb_model) -> bool:
+    """
+    Check whether the SentenceTransformer pipeline normalizes its output.
+    """
+    return any(type(module).__name__ == "Normalize" for module in emb_model)
+
+
+@torch.no_grad()
+def embed_token_windows(
+    emb_model,
+    content: str,
+    window_overlap: int = 32,
+    batch_size: int = 16,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encode the whole document once, in model-context windows, and get the
+    contextual embedding of every model token.
+    Consecutive windows overlap by `window_overlap` tokens, so that tokens
+    near window edges still get some context. Each token keeps the
+    embedding from the window it is most central in. The overlap is capped
+    at a quarter of the window, for models with a short context.
+
+    Args:
+        emb_model (SentenceTransformer): Embedding model, whose first module is
+            the transformer, with a fast tokenizer.
+        content (str): Document to encode.
+        window_overlap (int): Number of tokens shared by consecutive windows.
+        batch_size (int): Number of windows encoded at once.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Token embeddings, of shape
+            (n_tokens, dim), and character offsets of the tokens, of shape
+            (n_tokens, 2).
+    """
+    tokenizer = emb_model.tokenizer
+    encoding = tokenizer(
+        content,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        verbose=False,
+    )
+    token_ids = encoding["input_ids"]
+    offsets = np.asarray(encoding["offset_mapping"], dtype=np.int64).reshape(-1, 2)
+
+    prefix, suffix = _special_tokens(tokenizer)
+    window_size = emb_model.max_seq_length - len(prefix) - len(suffix)
+    window_overlap = min(window_overlap, window_size // 4)
+
+    stride = window_size - window_overlap
+    starts = list(range(0, max(len(token_ids) - window_overlap, 1), stride))
+
+    transformer = emb_model[0]
+    device = emb_model.device
+    pad_id = tokenizer.pad_token_id or 0
+    token_embs = None
+
+    for i in range(0, len(starts), batch_size):
+        batch_starts = starts[i : i + batch_size]  # noqa: E203
+        windows = [
+            prefix + token_ids[start : start + window_size] + suffix  # noqa: E203
+            for start in batch_starts
+        ]
+        max_len = max(len(window) for window in windows)
+        input_ids = torch.full((len(windows), max_len), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(windows), max_len), dtype=torch.long)
+        for j, window in enumerate(windows):
+            input_ids[j, : len(window)] = torch.tensor(window)
+            attention_mask[j, : len(window)] = 1
+
+        out = transformer(
+            {
+                "input_ids": input_ids.to(device),
+                "attention_mask": attention_mask.to(device),
+            }
+        )["token_embeddings"]
+        out = out.float().cpu().numpy()
+        if token_embs is None:
+            token_embs = np.empty((len(token_ids), out.shape[-1]), dtype=np.float32)
+
+        # Overlapping halves are split between the neighbouring windows
+        for j, start in enumerate(batch_starts):
+            n_tokens = min(window_size, len(token_ids) - start)
+            lo = 0 if start == 0 else window_overlap // 2
+            hi = n_tokens if start == starts[-1] else stride + window_overlap // 2
+            hi = min(hi, n_tokens)
+            token_embs[start + lo : start + hi] = out[  # noqa: E203
+                j, len(prefix) + lo : len(prefix) + hi  # noqa: E203
+            ]
+
+    if token_embs is None:
+        dim = emb_model.get_sentence_embedding_dimension()
+        token_embs = np.empty((0, dim), dtype=np.float32)
+    return token_embs, offsets
+
+
+def late_chunk_embed(
+    emb_model,
+    content: str,
+    spans: List[Tuple[int, int]],
+    window_overlap: int = 32,
+    batch_size: int = 16,
+) -> Tuple[torch.Tensor, np.ndarray]:
+    """
+    Embed chunks by late chunking, i.e. by mean-pooling the contextual token
+    embeddings of the whole document over each chunk's character span.
+    The encoder runs over the document once, so the cost does not depend on
+    how much the chunks overlap.
+
+    Args:
+        emb_model (SentenceTransformer): Embedding model.
+        content (str): Document the chunks were created from.
+        spans (List[Tuple[int, int]]): Character (start, end) span of each
+            chunk within the document. Negative spans are not embedded.
+        window_overlap (int): Number of tokens shared by consecutive windows.
+        batch_size (int): Number of windows encoded at once.
+
+    Returns:
+        Tuple[torch.Tensor, np.ndarray]: Embedding of each chunk, and a mask
+            of chunks that could not be embedded (e.g. unknown span, or no
+            model token within it). Those rows are left as zeros.
+    """
+    token_embs, offsets = embed_token_windows(
+        emb_model, content, window_overlap=window_overlap, batch_size=batch_size
+    )
+
+    spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+    chunk_embs = np.zeros((len(spans), token_embs.shape[1]), dtype=np.float32)
+
+    # Map character spans to model tokens, by token start offsets
+    first = np.searchsorted(offsets[:, 0], spans[:, 0], side="left")
+    last = np.searchsorted(offsets[:, 0], spans[:, 1], side="left")
+    missing = (spans[:, 0] < 0) | (last <= first)
+
+    for idx in np.flatnonzero(~missing):
+        chunk_embs[idx] = token_embs[first[idx] : last[idx]].mean(axis=0)  # noqa
+
+    if _normalizes(emb_model):
+        norms = np.linalg.norm(chunk_embs, axis=1, keepdims=True)
+        chunk_embs /= np.maximum(norms, 1e-12)
+
+    return torch.from_numpy(chunk_embs), missing
@@ -0,0 +1,163 @@
+import functools
+import gc
+import multiprocessing
+import os
+import traceback
+from typing import Any, Callable, List, Optional, Sequence
+
+import numpy as np
+import torch
+from utils.log import log_done, log_ongoing
+
+
+def _worker_loop(ret, conn, threads_per_worker: int) -> None:
+    """
+    Serve shards received over the pipe, until it is closed.
+    Each message is a pair of (function, shard), and is answered with a pair
+    of (success flag, result or formatted traceback).
+    """
+    torch.set_num_threads(threads_per_worker)
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+
+        func, shard = msg
+        try:
+            conn.send((True, func(ret, shard)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+def _query_shard(
+    ret, queries: List[str], k: int = 10, where: Optional[dict] = None
+) -> List[np.ndarray]:
+    return ret.query_batch(queries, k, where=where)
+
+
+class PreforkPool:
+    """
+    This class implements a pre-fork pool of retrieval workers.
+    The parent process loads the embedding model and builds the retriever
+    once, and then forks the workers, which inherit both copy-on-write.
+
+    Before forking, the retriever moves its embeddings (and the model its
+    weights) into shared memory, so that no worker holds a private copy, and
+    the garbage collector is frozen, so that it never writes to the inherited
+    objects, which would copy their pages.
+
+    Workers receive shards of work (e.g. queries) over pipes.
+    """
+
+    def __init__(
+        self,
+        ret,
+        processes: Optional[int] = None,
+        threads_per_worker: int = 1,
+    ):
+        """
+        Args:
+            ret (Retriever): Fully set-up retriever, shared by the workers.
+            processes (Optional[int]): Number of workers. Defaults to the
+                number of CPUs.
+            threads_per_worker (int): Number of torch threads in each worker.
+        """
+        self.ret = ret
+        self.processes = processes or os.cpu_count() or 1
+
+        log_ongoing(f"Forking {self.processes} retrieval worker(s)...")
+        ret._prepare_fork()
+
+        ctx = multiprocessing.get_context("fork")
+        self.conns = []
+        self.workers = []
+
+        gc.collect()
+        gc.freeze()
+        try:
+            for _ in range(self.processes):
+                parent_conn, child_conn = ctx.Pipe()
+                worker = ctx.Process(
+                    target=_worker_loop,
+                    args=(ret, child_conn, threads_per_worker),
+                    daemon=True,
+                )
+                worker.start()
+                child_conn.close()
+                self.conns.append(parent_conn)
+                self.workers.append(worker)
+        finally:
+            gc.unfreeze()
+        log_done(f"Successfully forked {self.processes} retrieval worker(s)!")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop the workers.
+        """
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for worker in self.workers:
+            worker.join()
+        self.conns = []
+        self.workers = []
+
+    def map(self, func: Callable[[Any, list], list], items: Sequence) -> list:
+        """
+        Split items into contiguous shards, one per worker, and run
+        `func(ret, shard)` on each of them in parallel.
+
+        Args:
+            func (Callable[[Any, list], list]): Picklable (i.e. module-level)
+                function, returning one result per item of the shard.
+            items (Sequence): Items to process.
+
+        Returns:
+            list: Results, in the order of items.
+        """
+        if not self.conns:
+            raise ValueError("Pool is closed.")
+
+        bounds = np.linspace(0, len(items), len(self.conns) + 1).astype(int)
+        busy = []
+        for conn, start, end in zip(self.conns, bounds[:-1], bounds[1:]):
+            if start < end:
+                conn.send((func, list(items[start:end])))
+                busy.append(conn)
+
+        results = []
+        errors = []
+        for conn in busy:
+            ok, res = conn.recv()
+            if ok:
+                results.extend(res)
+            else:
+                errors.append(res)
+        if errors:
+            raise RuntimeError(f"Worker failed:\n{errors[0]}")
+        return results
+
+    def query_spans(
+        self, queries: Sequence[str], k: int = 10, where: Optional[dict] = None
+    ) -> List[np.ndarray]:
+        """
+        Query the retriever for each of the queries, in parallel.
+        See `Retriever.query_spans`.
+
+        Returns:
+            List[np.ndarray]: Spans of each query, in order of queries.
+        """
+        return self.map(functools.partial(_query_shard, k=k, where=where), queries)
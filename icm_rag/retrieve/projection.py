@@ -0,0 +1,81 @@
+from typing import Optional
+
+import numpy as np
+
+PROJECTIONS = ["pca", "truncate"]
+
+
+class Projection:
+    """
+    This class implements a projection of embeddings to a lower dimension,
+    used for coarse (first stage) scoring in two-stage retrieval.
+    Embeddings are normalized first, so that dot products of projected
+    vectors approximate cosine similarities of the full ones.
+
+    Supported methods:
+        "pca": Projection onto the top principal directions of the (unit)
+            embeddings, i.e. the best rank-`dim` approximation of their dot
+            products.
+        "truncate": Keeping only the first `dim` components, as with
+            Matryoshka-style embedding models.
+    """
+
+    def __init__(self, dim: int, method: str = "pca", max_fit_rows: int = 10000):
+        if method not in PROJECTIONS:
+            raise ValueError(f"Invalid projection method selected: {method}")
+        if dim <= 0:
+            raise ValueError(f"Projection dimension must be positive, got: {dim}")
+
+        self.dim = dim
+        self.method = method
+        self.max_fit_rows = max_fit_rows
+        self.components: Optional[np.ndarray] = None
+
+    def fit(self, embs: np.ndarray) -> "Projection":
+        """
+        Fit the projection to given (full-dimension) embeddings.
+        PCA is fitted on an evenly spaced sample of at most `max_fit_rows`.
+
+        Args:
+            embs (np.ndarray): Embeddings, of shape (n, full_dim).
+
+        Returns:
+            Projection: Self, for chaining.
+        """
+        embs = _normalize(embs)
+        dim = min(self.dim, embs.shape[1])
+
+        if self.method == "truncate":
+            self.components = np.eye(embs.shape[1], dtype=np.float32)[:dim]
+            return self
+
+        if len(embs) > self.max_fit_rows:
+            step = len(embs) / self.max_fit_rows
+            embs = embs[(np.arange(self.max_fit_rows) * step).astype(np.int64)]
+        _, _, vt = np.linalg.svd(embs, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:dim], dtype=np.float32)
+        return self
+
+    def transform(self, embs: np.ndarray) -> np.ndarray:
+        """
+        Project given embeddings to the reduced space.
+
+        Args:
+            embs (np.ndarray): Embeddings, of shape (n, full_dim) or (full_dim,).
+
+        Returns:
+            np.ndarray: Projected embeddings, of shape (n, dim) or (dim,).
+        """
+        if self.components is None:
+            raise ValueError("Projection must be fitted before use.")
+
+        embs = _normalize(embs)
+        if self.method == "truncate":
+            return np.ascontiguousarray(embs[..., : len(self.components)])
+        return embs @ self.components.T
+
+
+def _normalize(embs: np.ndarray) -> np.ndarray:
+    embs = np.asarray(embs, dtype=np.float32)
+    norms = np.linalg.norm(embs, axis=-1, keepdims=True)
+    return embs / np.maximum(norms, 1e-12)
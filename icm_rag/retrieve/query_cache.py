@@ -0,0 +1,240 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class QueryCache:
+    """
+    This class implements a semantic cache of query results. Embeddings of
+    recent queries are kept (L2-normalized) in a small matrix, and a new
+    query whose cosine similarity to a cached one reaches `threshold` is
+    served the cached spans, without scoring the index.
+
+    A cached entry only serves queries with the same filter, and at most as
+    many chunks as it holds. Entries are evicted in least recently used
+    order, once there are `max_entries` of them, or once they are older than
+    `ttl` seconds. All of them are invalidated once the index changes, i.e.
+    once the retriever's epoch moves on.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 1024,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            threshold (float): Minimum cosine similarity of a query to a
+                cached one, for the cached spans to be served.
+            max_entries (int): Maximum number of cached queries.
+            ttl (Optional[float]): Time to live of an entry, in seconds.
+                If None, entries only expire when evicted or invalidated.
+            clock (Callable[[], float]): Time source, in seconds.
+        """
+        if max_entries < 1:
+            raise ValueError(f"Invalid number of cache entries: {max_entries}")
+
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        """
+        Remove all the entries. Counters are kept.
+        """
+        self.epoch = -1
+        self._embs: Optional[np.ndarray] = None
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._k = np.zeros(self.max_entries, dtype=np.int64)
+        self._where = np.zeros(self.max_entries, dtype=np.int64)
+        self._expires = np.full(self.max_entries, np.inf)
+        self._spans: List[Optional[np.ndarray]] = [None] * self.max_entries
+        # Slots in least recently used order
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._where_ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Fraction of lookups served from the cache.
+        """
+        n_lookups = self.hits + self.misses
+        return self.hits / n_lookups if n_lookups > 0 else 0.0
+
+    def _normalize(self, query_emb: np.ndarray) -> np.ndarray:
+        query_emb = np.asarray(query_emb, dtype=np.float32).reshape(-1)
+        return query_emb / max(float(np.linalg.norm(query_emb)), 1e-12)
+
+    def _where_id(self, where: Optional[dict]) -> int:
+        key = json.dumps(where or {}, sort_keys=True, default=str)
+        return self._where_ids.setdefault(key, len(self._where_ids))
+
+    def _sync_epoch(self, epoch: int) -> bool:
+        """
+        Invalidate all the entries, if the index moved on to a newer epoch.
+        Returns False for queries against an older epoch, which are neither
+        served nor cached.
+        """
+        if epoch > self.epoch:
+            if self._lru:
+                self.invalidations += 1
+            self.clear()
+            self.epoch = epoch
+        return epoch == self.epoch
+
+    def _free(self, slot: int) -> None:
+        self._valid[slot] = False
+        self._spans[slot] = None
+        del self._lru[slot]
+
+    def lookup(
+        self,
+        query_emb: np.ndarray,
+        k: int = 10,
+        where: Optional[dict] = None,
+        epoch: int = 0,
+    ) -> Optional[np.ndarray]:
+        """
+        Look up the spans of the most similar cached query.
+
+        Args:
+            query_emb (np.ndarray): Query embedding.
+            k (int): Maximum number of chunks to retrieve.
+            where (Optional[dict]): Filter on chunk corpus and / or document.
+            epoch (int): Epoch of the index the query runs against.
+
+        Returns:
+            Optional[np.ndarray]: Top-k cached spans, or None, on a miss.
+        """
+        query_emb = self._normalize(query_emb)
+        with self._lock:
+            if not self._sync_epoch(epoch) or not self._lru:
+                self.misses += 1
+                return None
+
+            # Expired entries are dropped lazily, on lookup
+            for slot in np.flatnonzero(self._valid & (self._expires <= self.clock())):
+                self._free(int(slot))
+                self.evictions += 1
+
+            mask = self._valid & (self._k >= k) & (self._where == self._where_id(where))
+            if not mask.any():
+                self.misses += 1
+                return None
+
+            scores = np.where(mask, self._embs @ query_emb, -np.inf)
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._lru.move_to_end(slot)
+            return self._spans[slot][:k]
+
+    def store(
+        self,
+        query_emb: np.ndarray,
+        spans: np.ndarray,
+        k: int = 10,
+        where: Optional[dict] = None,
+        epoch: int = 0,
+    ) -> None:
+        """
+        Cache spans of a query, evicting the least recently used entry, if
+        the cache is full.
+
+        Args:
+            query_emb (np.ndarray): Query embedding.
+            spans (np.ndarray): Spans retrieved for the query.
+            k (int): Maximum number of chunks the spans were retrieved for.
+            where (Optional[dict]): Filter the spans were retrieved with.
+            epoch (int): Epoch of the index the spans were retrieved from.
+        """
+        query_emb = self._normalize(query_emb)
+        with self._lock:
+            if not self._sync_epoch(epoch):
+                return
+            if self._embs is None or self._embs.shape[1] != len(query_emb):
+                self._embs = np.zeros((self.max_entries, len(query_emb)), np.float32)
+
+            if len(self._lru) < self.max_entries:
+                slot = int(np.flatnonzero(~self._valid)[0])
+            else:
+                slot = next(iter(self._lru))
+                self._free(slot)
+                self.evictions += 1
+
+            self._embs[slot] = query_emb
+            self._valid[slot] = True
+            self._k[slot] = k
+            self._where[slot] = self._where_id(where)
+            if self.ttl is not None:
+                self._expires[slot] = self.clock() + self.ttl
+            self._spans[slot] = spans
+            self._lru[slot] = None
+
+    def query(
+        self,
+        query_embs: np.ndarray,
+        search: Callable[[np.ndarray], List[np.ndarray]],
+        k: int = 10,
+        where: Optional[dict] = None,
+        epoch: int = 0,
+    ) -> List[np.ndarray]:
+        """
+        Serve queries from the cache where possible, search for the rest in a
+        single call, and cache their results.
+
+        Args:
+            query_embs (np.ndarray): Query embeddings, of shape (n, dim).
+            search (Callable[[np.ndarray], List[np.ndarray]]): Function
+                retrieving spans of each of given query embeddings.
+            k (int): Maximum number of chunks to retrieve, per query.
+            where (Optional[dict]): Filter on chunk corpus and / or document.
+            epoch (int): Epoch of the index `search` runs against.
+
+        Returns:
+            List[np.ndarray]: Spans of each query.
+        """
+        all_spans = [self.lookup(emb, k, where, epoch) for emb in query_embs]
+        missing = [idx for idx, spans in enumerate(all_spans) if spans is None]
+        if missing:
+            for idx, spans in zip(missing, search(query_embs[missing])):
+                self.store(query_embs[idx], spans, k, where, epoch)
+                all_spans[idx] = spans
+        return all_spans
+
+    def stats(self) -> dict:
+        """
+        Get cache counters.
+
+        Returns:
+            dict: Number of entries, hits, misses, hit rate, evictions and
+                invalidations.
+        """
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
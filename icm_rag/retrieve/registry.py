@@ -0,0 +1,275 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+import torch
+from utils.log import log_done, log_info, log_ongoing
+
+from .chunking import FixedTokenChunker, RecursiveTokenChunker
+from .retriever import Retriever
+
+CHUNKERS = {
+    "fixed_token": FixedTokenChunker,
+    "recursive_token": RecursiveTokenChunker,
+}
+
+
+class IndexKey(NamedTuple):
+    """
+    Identity of an index: everything that changes its chunks or embeddings.
+    Corpora are identified by name, and by the digest of their content (see
+    `utils.download.corpus_digest`), so changed corpora are indexed anew.
+    """
+
+    corpus: str
+    model: str
+    chunker: str
+    chunk_size: int
+    chunk_overlap: int
+    backend: str
+    late_chunking: bool = False
+    corpus_digest: str = ""
+
+    @property
+    def digest(self) -> str:
+        """
+        Short, stable hash of the key, naming its persisted artifacts.
+        """
+        raw = json.dumps(self._asdict(), sort_keys=True).encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def _model_nbytes(model) -> int:
+    """
+    Get memory footprint of model parameters and buffers, in bytes.
+    """
+    if not isinstance(model, torch.nn.Module):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.nelement() * tensor.element_size() for tensor in tensors)
+
+
+class IndexRegistry:
+    """
+    This class implements a registry of indexes (i.e. retrievers) for a
+    long-lived process. Indexes are keyed by `IndexKey`, are loaded on demand
+    from artifacts persisted under `index_dir` (or built and persisted, if
+    there are none), and are evicted in least recently used order, once their
+    memory footprint exceeds the budget.
+
+    Retrievers of the same embedding model share a single model instance,
+    which is released only once no loaded index uses it. Evicted retrievers
+    are closed, so they should not be held on to across `get` calls.
+    """
+
+    def __init__(
+        self,
+        index_dir: Union[Path, str],
+        memory_budget_mb: Optional[float] = None,
+        build: Optional[Callable[[IndexKey, Retriever], None]] = None,
+        load_model: Optional[Callable[[str], Any]] = None,
+        cache_dir: Optional[Union[Path, str]] = None,
+        ret_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Args:
+            index_dir (Union[Path, str]): Directory of persisted indexes.
+            memory_budget_mb (Optional[float]): Memory budget of the loaded
+                indexes and models, in MB. If None, nothing is evicted.
+            build (Optional[Callable[[IndexKey, Retriever], None]]): Function
+                filling an empty retriever with the chunks of given key, used
+                when no persisted index exists. If None, missing indexes raise.
+            load_model (Optional[Callable[[str], Any]]): Function loading an
+                embedding model by name. Defaults to `SentenceTransformer`.
+            cache_dir (Optional[Union[Path, str]]): Caching directory, passed
+                to the chunkers that support it.
+            ret_kwargs (Optional[Dict[str, Any]]): Keyword arguments passed to
+                every retriever, e.g. `n_shards` of sharded retrievers.
+        """
+        if load_model is None:
+            from sentence_transformers import SentenceTransformer
+
+            load_model = SentenceTransformer
+
+        self.index_dir = Path(index_dir)
+        self.memory_budget = (
+            None if memory_budget_mb is None else int(memory_budget_mb * 2**20)
+        )
+        self.build = build
+        self.load_model = load_model
+        self.cache_dir = cache_dir
+        self.ret_kwargs = dict(ret_kwargs or {})
+
+        self.indexes: "OrderedDict[IndexKey, Retriever]" = OrderedDict()
+        self.models: Dict[str, Any] = {}
+        self.model_nbytes: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: IndexKey) -> bool:
+        return key in self.indexes
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def index_path(self, key: IndexKey) -> Path:
+        """
+        Get directory of the persisted index of given key.
+        """
+        return self.index_dir / key.backend / key.digest
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory footprint of the loaded indexes and models, in bytes.
+        """
+        indexes_nbytes = sum(ret.nbytes for ret in self.indexes.values())
+        return indexes_nbytes + sum(self.model_nbytes.values())
+
+    def model(self, name: str):
+        """
+        Get the shared instance of given embedding model, loading it if needed.
+
+        Args:
+            name (str): Name of the embedding model, e.g. "all-MiniLM-L6-v2".
+
+        Returns:
+            SentenceTransformer: Embedding model.
+        """
+        if name not in self.models:
+            log_ongoing(f"Loading embedding model: {name}")
+            self.models[name] = self.load_model(name)
+            self.model_nbytes[name] = _model_nbytes(self.models[name])
+            log_done(f"Successfully loaded embedding model: {name}")
+        return self.models[name]
+
+    def _create(self, key: IndexKey) -> Retriever:
+        """
+        Create an empty retriever for given key.
+        """
+        if key.chunker not in CHUNKERS:
+            raise ValueError(f"Invalid chunker selected: {key.chunker}")
+
+        chunker_kwargs = {}
+        if key.chunker == "fixed_token" and self.cache_dir is not None:
+            chunker_kwargs["cache_dir"] = self.cache_dir
+        chunker = CHUNKERS[key.chunker](
+            chunk_size=key.chunk_size,
+            chunk_overlap=key.chunk_overlap,
+            **chunker_kwargs,
+        )
+
+        # Collections of the ChromaDB client are shared, so names must differ
+        ret_kwargs = dict(self.ret_kwargs)
+        if key.backend == "chromadb":
+            ret_kwargs["collection_name"] = f"index_{key.digest}"
+        return Retriever.from_kwargs(
+            type=key.backend,
+            chunker=chunker,
+            emb_model=self.model(key.model),
+            **ret_kwargs,
+        )
+
+    def get(self, key: IndexKey) -> Retriever:
+        """
+        Get retriever of given key, loading (or building) it if needed, and
+        evicting least recently used ones, if over the memory budget.
+
+        Args:
+            key (IndexKey): Key of the index.
+
+        Returns:
+            Retriever: Retriever holding the index.
+        """
+        with self._lock:
+            if key in self.indexes:
+                self.hits += 1
+                self.indexes.move_to_end(key)
+                return self.indexes[key]
+
+            self.misses += 1
+            ret = self._create(key)
+            path = self.index_path(key)
+            if (path / "meta.json").exists():
+                ret.load(path)
+            elif self.build is not None:
+                self.build(key, ret)
+                ret.save(path)
+            else:
+                ret.close()
+                self._release_models()
+                raise ValueError(f"No persisted index for: {key}")
+
+            self.indexes[key] = ret
+            self._evict()
+            return ret
+
+    def evict(self, key: IndexKey) -> None:
+        """
+        Unload index of given key, if loaded. Its persisted artifacts are kept.
+
+        Args:
+            key (IndexKey): Key of the index.
+        """
+        with self._lock:
+            self._evict_key(key)
+            self._release_models()
+
+    def _evict_key(self, key: IndexKey) -> None:
+        ret = self.indexes.pop(key, None)
+        if ret is not None:
+            ret.close()
+            self.evictions += 1
+            log_info(f"Evicted index: {key}")
+
+    def _evict(self) -> None:
+        """
+        Evict least recently used indexes, until within the memory budget.
+        The most recently used index is always kept.
+        """
+        if self.memory_budget is None:
+            return
+        while len(self.indexes) > 1 and self.nbytes > self.memory_budget:
+            self._evict_key(next(iter(self.indexes)))
+            self._release_models()
+
+    def _release_models(self) -> None:
+        """
+        Drop models no loaded index uses.
+        """
+        used = {key.model for key in self.indexes}
+        for name in list(self.models):
+            if name not in used:
+                del self.models[name]
+                del self.model_nbytes[name]
+
+    def close(self) -> None:
+        """
+        Unload all the indexes and models.
+        """
+        with self._lock:
+            for key in list(self.indexes):
+                self._evict_key(key)
+            self._release_models()
+
+    def stats(self) -> dict:
+        """
+        Get registry counters.
+
+        Returns:
+            dict: Number of loaded indexes and models, memory footprint (MB),
+                hits, misses and evictions.
+        """
+        return {
+            "indexes": len(self.indexes),
+            "models": len(self.models),
+            "memory_mb": self.nbytes / 2**20,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,161 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .result import make_spans
+
+
+class Reranker:
+    """
+    This class implements cross-encoder re-ranking of retrieved chunks.
+    The top `n_candidates` chunks of each query (by bi-encoder score) are
+    re-scored as query / chunk pairs, and only the top-k are kept.
+
+    Pairs of all the given queries are scored together, in large batches,
+    and their scores are cached, so a pair is only ever scored once, as long
+    as it is among the `max_cache_entries` most recently used ones.
+    If a latency budget is set, the number of candidates is capped, so that
+    scoring a query's candidates is expected to fit the budget, based on the
+    measured scoring throughput.
+    """
+
+    def __init__(
+        self,
+        model,
+        n_candidates: int = 50,
+        batch_size: int = 64,
+        budget_ms: Optional[float] = None,
+        max_cache_entries: int = 100_000,
+    ):
+        """
+        Args:
+            model (CrossEncoder): Cross-encoder, or any model implementing
+                `predict(pairs, batch_size=...)`, returning a score per pair.
+            n_candidates (int): Maximum number of candidates per query.
+            batch_size (int): Number of pairs scored at once.
+            budget_ms (Optional[float]): Re-ranking latency budget per query,
+                in milliseconds. If None, candidates are not capped.
+            max_cache_entries (int): Maximum number of cached pair scores.
+                Least recently used ones are evicted first.
+        """
+        if max_cache_entries < 1:
+            raise ValueError(f"Invalid number of cache entries: {max_cache_entries}")
+
+        self.model = model
+        self.n_candidates = n_candidates
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.max_cache_entries = max_cache_entries
+
+        self.cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.scored_pairs = 0
+        self.scoring_seconds = 0.0
+
+    def candidate_budget(self, k: int) -> int:
+        """
+        Get number of candidates to re-rank per query, capped by the latency
+        budget. Never less than k, so that k chunks can always be returned.
+
+        Args:
+            k (int): Number of chunks to return per query.
+
+        Returns:
+            int: Number of candidates.
+        """
+        n_candidates = self.n_candidates
+        if self.budget_ms is not None and self.scored_pairs > 0:
+            ms_per_pair = self.scoring_seconds * 1000 / self.scored_pairs
+            n_candidates = min(n_candidates, int(self.budget_ms / ms_per_pair))
+        return max(n_candidates, k)
+
+    def _score_pairs(
+        self, pairs: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], float]:
+        """
+        Get scores of pairs, scoring those missing from the cache, in batches.
+        Scores are returned, rather than read back from the cache, which may
+        hold fewer entries than there are pairs.
+        """
+        scores = {}
+        missing = []
+        for pair in dict.fromkeys(pairs):
+            score = self.cache.get(pair)
+            if score is None:
+                missing.append(pair)
+            else:
+                self.cache.move_to_end(pair)
+                scores[pair] = score
+        if not missing:
+            return scores
+
+        start = time.perf_counter()
+        new_scores = self.model.predict(
+            missing, batch_size=self.batch_size, show_progress_bar=False
+        )
+        self.scoring_seconds += time.perf_counter() - start
+        self.scored_pairs += len(missing)
+
+        new_scores = dict(
+            zip(missing, np.asarray(new_scores, dtype=np.float32).tolist())
+        )
+        scores.update(new_scores)
+        self.cache.update(new_scores)
+        while len(self.cache) > self.max_cache_entries:
+            self.cache.popitem(last=False)
+        return scores
+
+    def rerank(
+        self,
+        ret,
+        queries: List[str],
+        candidates: List[np.ndarray],
+        k: int = 10,
+    ) -> List[np.ndarray]:
+        """
+        Re-rank candidate spans of each query, and keep the top-k.
+
+        Args:
+            ret (Retriever): Retriever the candidates come from.
+            queries (List[str]): Textual representation of queries.
+            candidates (List[np.ndarray]): Candidate spans of each query, as
+                returned by `query_spans`, with at least `candidate_budget(k)`
+                entries.
+            k (int): Number of chunks to return per query.
+
+        Returns:
+            List[np.ndarray]: Spans of each query, ordered by cross-encoder
+                score, which replaces the bi-encoder score.
+        """
+        n_candidates = self.candidate_budget(k)
+        candidates = [spans[:n_candidates] for spans in candidates]
+
+        # Chunk texts are loaded only for the (few) candidates
+        texts = [ret._load_chunks(spans["id"].tolist()) for spans in candidates]
+        scores_of = self._score_pairs(
+            [
+                (query, text)
+                for query, query_texts in zip(queries, texts)
+                for text in query_texts
+            ]
+        )
+
+        reranked = []
+        for query, spans, query_texts in zip(queries, candidates, texts):
+            scores = np.array(
+                [scores_of[(query, text)] for text in query_texts], dtype=np.float32
+            )
+            top_k = np.argsort(-scores, kind="stable")[:k]
+            top = spans[top_k]
+            reranked.append(
+                make_spans(
+                    ids=top["id"],
+                    scores=scores[top_k],
+                    starts=top["start_index"],
+                    ends=top["end_index"],
+                    corpus_ids=top["corpus_id"],
+                    doc_ids=top["doc_id"],
+                )
+            )
+        return reranked
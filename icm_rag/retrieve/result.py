@@ -0,0 +1,120 @@
+from typing import Any, Optional
+
+import numpy as np
+
+# Compact, spans-only representation of retrieval results.
+# One row per retrieved chunk; no chunk text and no embeddings are copied.
+SPAN_DTYPE = np.dtype(
+    [
+        ("id", np.int64),
+        ("score", np.float32),
+        ("start_index", np.int64),
+        ("end_index", np.int64),
+        ("corpus_id", np.int32),
+        ("doc_id", np.int32),
+    ]
+)
+
+
+def make_spans(ids, scores, starts, ends, corpus_ids=0, doc_ids=0) -> np.ndarray:
+    """
+    Pack retrieval results into a structured array of dtype `SPAN_DTYPE`.
+
+    Args:
+        ids (array-like): Retriever-local chunk ids.
+        scores (array-like): Similarity scores (higher is better).
+        starts (array-like): Starting indices of the chunks within the document.
+        ends (array-like): Ending indices of the chunks within the document.
+        corpus_ids (array-like): Ids of the corpora the chunks belong to.
+        doc_ids (array-like): Ids of the documents the chunks belong to.
+
+    Returns:
+        np.ndarray: Structured array of length `len(ids)`.
+    """
+    spans = np.empty(len(ids), dtype=SPAN_DTYPE)
+    spans["id"] = ids
+    spans["score"] = scores
+    spans["start_index"] = starts
+    spans["end_index"] = ends
+    spans["corpus_id"] = corpus_ids
+    spans["doc_id"] = doc_ids
+    return spans
+
+
+class RetrievedChunk:
+    """
+    Lightweight handle to a single retrieved chunk.
+    Holds only the chunk id, score and offsets. Textual content and embedding
+    are loaded lazily from the owning retriever, on first access.
+
+    For backwards compatibility, supports dict-like access to the "chunk",
+    "emb" and "metadata" keys.
+    """
+
+    __slots__ = ("id", "score", "start_index", "end_index", "_source", "_chunk", "_emb")
+
+    def __init__(
+        self,
+        id: int,
+        score: float,
+        start_index: int,
+        end_index: int,
+        source: Optional[Any] = None,
+    ):
+        self.id = int(id)
+        self.score = float(score)
+        self.start_index = int(start_index)
+        self.end_index = int(end_index)
+        self._source = source
+        self._chunk = None
+        self._emb = None
+
+    @property
+    def chunk(self) -> Optional[str]:
+        """
+        Textual content of the chunk, loaded from the retriever on first access.
+        """
+        if self._chunk is None and self._source is not None:
+            self._chunk = self._source._load_chunk(self.id)
+        return self._chunk
+
+    @property
+    def emb(self):
+        """
+        Embedding of the chunk, loaded from the retriever on first access.
+        """
+        if self._emb is None and self._source is not None:
+            self._emb = self._source._load_emb(self.id)
+        return self._emb
+
+    @property
+    def metadata(self) -> dict:
+        return {"start_index": self.start_index, "end_index": self.end_index}
+
+    def __getitem__(self, key: str):
+        if key not in ("chunk", "emb", "metadata"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self) -> str:
+        return (
+            f"RetrievedChunk(id={self.id}, score={self.score:.4f}, "
+            f"start_index={self.start_index}, end_index={self.end_index})"
+        )
+
+    @classmethod
+    def from_spans(cls, spans: np.ndarray, source: Optional[Any] = None) -> list:
+        """
+        Wrap each row of a spans array into a `RetrievedChunk`.
+
+        Args:
+            spans (np.ndarray): Structured array of dtype `SPAN_DTYPE`.
+            source: Retriever to lazily load chunk text and embeddings from.
+
+        Returns:
+            List[RetrievedChunk]: One handle per row, in the same order.
+        """
+        return [
+            cls(row["id"], row["score"], row["start_index"], row["end_index"], source)
+            for row in spans
+        ]
@@ -1,19 +1,67 @@
+import json
+import os
 import re
-from typing import Dict, List, Union
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import chromadb
 import numpy as np
 import torch
 from fuzzywuzzy import fuzz, process
-from sklearn.metrics.pairwise import cosine_similarity
 from tqdm import tqdm
-from utils.log import log_done, log_ongoing
+from utils.log import log_done, log_info, log_ongoing
+
+from .ingest import IngestionPipeline
+from .late_chunking import late_chunk_embed
+from .projection import Projection
+from .query_cache import QueryCache
+from .result import RetrievedChunk, make_spans
+from .snapshot import (
+    CoarseIndex,
+    GrowableArray,
+    IndexSnapshot,
+    expand_rows,
+    filter_rows,
+    growable_array,
+    resolve_where,
+)
+
+# Arrays of the index, shared by all backends, and persisted by `save`
+INDEX_ARRAYS = [
+    "chunk_to_unique",
+    "chunk_corpus",
+    "chunk_doc",
+    "row_corpus",
+    "row_doc",
+    "row_alive",
+    "starts",
+    "ends",
+]
 
 
 class Retriever:
+    # Index arrays grow in place, so that appending chunks is amortized O(1)
+    chunk_to_unique = growable_array("chunk_to_unique")
+    chunk_corpus = growable_array("chunk_corpus")
+    chunk_doc = growable_array("chunk_doc")
+    row_corpus = growable_array("row_corpus")
+    row_doc = growable_array("row_doc")
+    row_alive = growable_array("row_alive")
+    starts = growable_array("starts")
+    ends = growable_array("ends")
+
     def __init__(self, chunker, emb_model):
         self.chunker = chunker
         self.emb_model = emb_model
+        self._arrays: Dict[str, GrowableArray] = {}
+
+        # Held by every change of the index, so that there is a single writer
+        self._write_lock = threading.RLock()
+        # Moves on with every change of the index, invalidating cached queries
+        self.epoch = 0
+        self.query_cache: Optional[QueryCache] = None
+        self._reset_index()
 
         log_done(f"Successfully set-up retriever!")
 
@@ -24,6 +72,8 @@ class Retriever:
         Current options include:
             "cos_sim": CosSimRetriever (custom, simple implementation)
             "chromadb": ChromaDBRetriever (implemented using `chromadb` module).
+            "sharded": ShardedRetriever (cosine similarity, across worker
+                processes).
 
         Args:
             **kwargs: Keyword arguments
@@ -37,16 +87,27 @@ class Retriever:
                 pipeline.
         """
 
+        # Imported here, as the sharded retriever extends this class
+        from .sharded import ShardedRetriever
+
         TYPE_TO_CLASS = {
             "cos_sim": CosSimRetriever,
             "chromadb": ChromaDBRetriever,
+            "sharded": ShardedRetriever,
         }
         type = kwargs["type"]
         if type not in TYPE_TO_CLASS:
             raise ValueError(f"Invalid retriever type selected: {type}")
 
+        # Any other keyword arguments are specific to the retriever type
+        type_kwargs = {
+            key: value
+            for key, value in kwargs.items()
+            if key not in ["type", "chunker", "emb_model"]
+        }
+
         type_class = TYPE_TO_CLASS[type]
-        return type_class(kwargs["chunker"], kwargs["emb_model"])
+        return type_class(kwargs["chunker"], kwargs["emb_model"], **type_kwargs)
 
     def chunk(self, text: str) -> List[str]:
         """
@@ -90,19 +151,724 @@ class Retriever:
 
         return embs
 
-    def query(self, query: str, k: int = 10) -> List[dict]:
+    def query(
+        self, query: str, k: int = 10, where: Optional[dict] = None
+    ) -> List[RetrievedChunk]:
         """
         Query retriever for top-k relevant chunks.
 
         Args:
             query (str): Textual representation of query.
             k (int): Maximum number of chunks to retrieve.
+            where (Optional[dict]): Filter on chunk corpus and / or document,
+                e.g. {"corpus": "wikitexts"} or {"corpus": [...], "doc_id": 0}.
+
+        Returns:
+            List[RetrievedChunk]: List of retrieved chunks. Textual content and
+                embeddings are loaded lazily, upon first access.
+        """
+        spans = self.query_spans(query, k, where=where)
+        return RetrievedChunk.from_spans(spans, source=self)
+
+    def query_spans(
+        self, query: str, k: int = 10, where: Optional[dict] = None
+    ) -> np.ndarray:
+        """
+        Query retriever for top-k relevant chunks, in spans-only mode.
+        Neither textual content nor embeddings of the chunks are copied.
+
+        Args:
+            query (str): Textual representation of query.
+            k (int): Maximum number of chunks to retrieve.
+            where (Optional[dict]): Filter on chunk corpus and / or document.
+                See `query`.
+
+        Returns:
+            np.ndarray: Structured array of dtype `SPAN_DTYPE`, containing
+                chunk ids, scores, start / end indices, and corpus / document
+                ids, ordered by score.
+        """
+        return make_spans([], [], [], [])
+
+    def query_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+        where: Optional[dict] = None,
+        batch_size: int = 32,
+    ) -> List[np.ndarray]:
+        """
+        Query retriever for top-k relevant chunks of each query, in
+        spans-only mode. Child classes override it, to embed all the queries
+        in a single batched call, and search for all of them at once.
+
+        Args:
+            queries (List[str]): Textual representation of queries.
+            k (int): Maximum number of chunks to retrieve, per query.
+            where (Optional[dict]): Filter on chunk corpus and / or document.
+                See `query`.
+            batch_size (int): Batch size for query embedding.
+
+        Returns:
+            List[np.ndarray]: Spans of each query, as returned by `query_spans`.
+        """
+        return [self.query_spans(query, k, where=where) for query in queries]
+
+    def set_query_cache(self, query_cache: Optional[QueryCache]) -> None:
+        """
+        Serve near-duplicate queries from a semantic cache, see `QueryCache`.
+
+        Args:
+            query_cache (Optional[QueryCache]): Query cache. If None, every
+                query is searched for.
+        """
+        self.query_cache = query_cache
+
+    def _query_cached(
+        self,
+        query_embs: torch.Tensor,
+        search: Callable[[np.ndarray], List[np.ndarray]],
+        k: int = 10,
+        where: Optional[dict] = None,
+        epoch: int = 0,
+    ) -> List[np.ndarray]:
+        """
+        Search for already embedded queries, through the query cache, if set.
+        See `QueryCache.query`.
+        """
+        query_embs = query_embs.reshape(len(query_embs), -1).numpy()
+        if self.query_cache is None:
+            return search(query_embs)
+        return self.query_cache.query(query_embs, search, k, where=where, epoch=epoch)
+
+    def _load_chunk(self, idx: int) -> str:
+        """
+        Load textual content of the chunk with given id.
+        Used by `RetrievedChunk` for lazy loading.
+        """
+        raise NotImplementedError
+
+    def _load_chunks(self, ids: List[int]) -> List[str]:
+        """
+        Load textual content of the chunks with given ids.
+        Child classes may override it, to load all the chunks at once.
+        """
+        return [self._load_chunk(idx) for idx in ids]
+
+    def _load_emb(self, idx: int) -> torch.Tensor:
+        """
+        Load embedding of the chunk with given id.
+        Used by `RetrievedChunk` for lazy loading.
+        """
+        raise NotImplementedError
+
+    def _load_embs(self, ids: List[int]) -> torch.Tensor:
+        """
+        Load embeddings of the chunks with given ids, of shape (n_ids, dim).
+        Child classes may override it, to load all the embeddings at once.
+        """
+        return torch.stack([self._load_emb(idx) for idx in ids])
+
+    def _prepare_fork(self) -> None:
+        """
+        Prepare retriever to be shared by forked worker processes.
+        Embedding model weights are moved into shared memory. Child classes
+        extend it to share their own index, and to finish any lazily built
+        state, which would otherwise be built in every worker.
+        """
+        if isinstance(self.emb_model, torch.nn.Module):
+            self.emb_model.share_memory()
+
+    def _reset_dedupe(self) -> None:
+        """
+        Clear the mapping of chunks to unique texts.
+        """
+        # Maps (corpus id, document id, unique text) to its row
+        self.unique_rows: Dict[Tuple[int, int, str], int] = {}
+        self.unique_members: List[List[int]] = []  # Maps row to its chunks
+        self.chunk_to_unique = np.empty(0, dtype=np.int64)  # Maps chunk to row
+
+        # Corpus and document ids, of every chunk and of every row
+        self.corpus_names: Dict[str, int] = {}
+        self.chunk_corpus = np.empty(0, dtype=np.int32)
+        self.chunk_doc = np.empty(0, dtype=np.int32)
+        self.row_corpus = np.empty(0, dtype=np.int32)
+        self.row_doc = np.empty(0, dtype=np.int32)
+        self._filter_cache: Dict[str, Union[slice, np.ndarray]] = {}
+
+        # Deleted rows are tombstoned, i.e. masked out, until compaction
+        self.row_alive = np.empty(0, dtype=bool)
+        self.n_deleted_rows = 0
+
+    def _corpus_id(self, corpus: str) -> int:
+        """
+        Get compact integer id of given corpus name, registering it if new.
+        """
+        if corpus not in self.corpus_names:
+            self.corpus_names[corpus] = len(self.corpus_names)
+        return self.corpus_names[corpus]
+
+    def _dedupe(
+        self, chunks: List[str], corpus_id: int = 0, doc_id: int = 0
+    ) -> List[str]:
+        """
+        Register chunks, mapping each one to the row of its (unique) text.
+        Identical chunks of the same document share a single row, and hence,
+        a single embedding. Rows never span multiple documents, so filtering
+        on rows is exact.
+
+        Args:
+            chunks (List[str]): Chunks to register, in order of their ids.
+            corpus_id (int): Id of the corpus the chunks belong to.
+            doc_id (int): Id of the document (within corpus) chunks belong to.
+
+        Returns:
+            List[str]: Texts not registered before, in order of their new rows.
+                Only these need to be embedded.
+        """
+        first_idx = len(self.chunk_to_unique)
+        rows = np.empty(len(chunks), dtype=np.int64)
+        new_texts = []
+
+        for i, chunk in enumerate(chunks):
+            key = (corpus_id, doc_id, chunk)
+            row = self.unique_rows.get(key)
+            if row is None:
+                row = self.unique_rows[key] = len(self.unique_members)
+                self.unique_members.append([])
+                new_texts.append(chunk)
+            self.unique_members[row].append(first_idx + i)
+            rows[i] = row
+
+        self._arrays["chunk_to_unique"].append(rows)
+        self._arrays["chunk_corpus"].append(np.full(len(chunks), corpus_id))
+        self._arrays["chunk_doc"].append(np.full(len(chunks), doc_id))
+        self._arrays["row_corpus"].append(np.full(len(new_texts), corpus_id))
+        self._arrays["row_doc"].append(np.full(len(new_texts), doc_id))
+        self._arrays["row_alive"].append(np.ones(len(new_texts), dtype=bool))
+        self._filter_cache = {}
+        return new_texts
+
+    def _log_dedupe(self) -> None:
+        log_info(
+            f"Deduplicated {len(self.chunk_to_unique)} chunks into "
+            f"{len(self.unique_members)} unique ones "
+            f"(dedupe ratio: {self.dedupe_ratio * 100:.2f}%)."
+        )
+
+    @property
+    def dedupe_ratio(self) -> float:
+        """
+        Fraction of chunks whose text is a duplicate of another chunk.
+        """
+        if len(self.chunk_to_unique) == 0:
+            return 0.0
+        return 1.0 - len(self.unique_members) / len(self.chunk_to_unique)
+
+    def _expand(
+        self, rows: np.ndarray, scores: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Expand ranked unique rows back to all of their chunks, keeping the
+        ranking, and cut the result to top-k chunks.
+
+        Args:
+            rows (np.ndarray): Unique rows, ordered by score.
+            scores (np.ndarray): Scores of the rows.
+            k (int): Maximum number of chunks to return.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Chunk ids and their scores.
+        """
+        return expand_rows(self.unique_members, rows, scores, k)
+
+    def _resolve_where(
+        self, where: dict
+    ) -> Tuple[Union[List[int], None], Union[List[int], None]]:
+        """
+        Resolve filter into lists of allowed corpus and document ids.
+        None means that the column is not filtered on.
+
+        Args:
+            where (dict): Filter, with optional "corpus" (name or list of names)
+                and "doc_id" (id or list of ids) keys.
+
+        Returns:
+            Tuple[Union[List[int], None], Union[List[int], None]]: Allowed
+                corpus ids and document ids.
+        """
+        return resolve_where(where, self.corpus_names)
+
+    def _filter_rows(self, where: dict) -> Union[slice, np.ndarray]:
+        """
+        Get live rows passing given filter, computed once per filter and
+        cached until rows are added or deleted. Documents are ingested one at a time, so
+        their rows are contiguous, and are then returned as a slice, i.e. a
+        zero-copy view of the embeddings. Otherwise, row indices are returned.
+
+        Args:
+            where (dict): Filter. See `query`.
+
+        Returns:
+            Union[slice, np.ndarray]: Contiguous range of rows, or row indices.
+        """
+        key = json.dumps(where, sort_keys=True, default=str)
+        rows = self._filter_cache.get(key)
+        if rows is not None:
+            return rows
+
+        corpus_ids, doc_ids = self._resolve_where(where)
+        rows = filter_rows(
+            self.row_corpus, self.row_doc, self.row_alive, corpus_ids, doc_ids
+        )
+        self._filter_cache[key] = rows
+        return rows
+
+    def delete_document(self, corpus: str = "", doc_id: int = 0) -> int:
+        """
+        Delete all the chunks of given document. Their rows are tombstoned,
+        i.e. masked out of every query, while chunk ids of other documents are
+        kept. See `CosSimRetriever.compact` for reclaiming their space.
+
+        Args:
+            corpus (str): Name of the corpus the document belongs to.
+            doc_id (int): Id of the document, within corpus.
 
         Returns:
-            List[dict]: List of retrieved chunks, complete with textual content,
-                embeddings and metadata.
+            int: Number of chunks deleted.
+        """
+        if corpus not in self.corpus_names:
+            return 0
+        with self._write_lock:
+            rows = self._filter_rows({"corpus": corpus, "doc_id": doc_id})
+            rows = np.arange(len(self.row_alive))[rows]
+            if len(rows) == 0:
+                return 0
+
+            n_chunks = sum(len(self.unique_members[row]) for row in rows.tolist())
+            self._delete_rows(rows)
+        log_info(f"Deleted {n_chunks} chunk(s) of document {doc_id} of {corpus}.")
+        return n_chunks
+
+    def update_document(
+        self, content: str, corpus: str = "", doc_id: int = 0, **kwargs
+    ) -> None:
+        """
+        Replace chunks of given document with the chunks of its new content.
+        See `delete_document` and `add_document`.
+
+        Args:
+            content (str): New content of the document.
+            corpus (str): Name of the corpus the document belongs to.
+            doc_id (int): Id of the document, within corpus.
+            **kwargs: Keyword arguments passed to `add_document`.
+        """
+        with self._write_lock:
+            self.delete_document(corpus, doc_id)
+            self.add_document(content, corpus=corpus, doc_id=doc_id, **kwargs)
+
+    def _delete_rows(self, rows: np.ndarray) -> None:
+        """
+        Tombstone given (live) rows. Their texts are released for dedupe, so
+        that re-added chunks get new rows. Child classes extend it to delete
+        rows from their own storage.
+        """
+        texts = self._load_chunks([self.unique_members[row][0] for row in rows])
+        for row, text in zip(rows.tolist(), texts):
+            self.unique_rows.pop(
+                (int(self.row_corpus[row]), int(self.row_doc[row]), text), None
+            )
+        # Copied, rather than modified in place, as snapshots may view it
+        self.row_alive = self.row_alive.copy()
+        self.row_alive[rows] = False
+        self.n_deleted_rows += len(rows)
+        self._filter_cache = {}
+
+    def _compact_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Drop deleted rows and their chunks from the arrays and dedupe mappings,
+        renumbering the remaining ones. Child classes drop them from their
+        own storage.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Kept rows, and kept chunk ids, in
+                terms of the old numbering.
+        """
+        alive_rows = np.flatnonzero(self.row_alive)
+        alive_chunks = np.flatnonzero(self.row_alive[self.chunk_to_unique])
+        new_rows = np.full(len(self.row_alive), -1, dtype=np.int64)
+        new_rows[alive_rows] = np.arange(len(alive_rows))
+
+        self.chunk_to_unique = new_rows[self.chunk_to_unique[alive_chunks]]
+        for name in ["chunk_corpus", "chunk_doc", "starts", "ends"]:
+            setattr(self, name, getattr(self, name)[alive_chunks])
+        for name in ["row_corpus", "row_doc", "row_alive"]:
+            setattr(self, name, getattr(self, name)[alive_rows])
+
+        self.unique_members = [[] for _ in alive_rows]
+        for idx, row in enumerate(self.chunk_to_unique.tolist()):
+            self.unique_members[row].append(idx)
+        self.unique_rows = {
+            key: int(new_rows[row]) for key, row in self.unique_rows.items()
+        }
+        self.n_deleted_rows = 0
+        self._filter_cache = {}
+        return alive_rows, alive_chunks
+
+    def _append_offsets(self, chunks: List[str], metadata: List[dict]) -> None:
+        """
+        Keep chunk offsets in flat arrays, so that spans-only queries need not
+        touch the metadata dictionaries.
+        """
+        if not metadata:
+            metadata = [{"start_index": -1, "end_index": -1} for _ in chunks]
+        starts = np.array([meta["start_index"] for meta in metadata], np.int64)
+        ends = np.array([meta["end_index"] for meta in metadata], np.int64)
+        self._arrays["starts"].append(starts)
+        self._arrays["ends"].append(ends)
+
+    def _reset_index(self) -> None:
+        """
+        Empty the retriever, i.e. remove all the chunks.
+        Child classes extend it to clear their own storage.
+        """
+        self._reset_dedupe()
+        self.starts = np.empty(0, dtype=np.int64)
+        self.ends = np.empty(0, dtype=np.int64)
+        self.row_nbytes = 0
+
+    def _append(
+        self,
+        chunks: List[str],
+        metadata: List[dict],
+        texts: List[str],
+        embs: Union[torch.Tensor, None],
+    ) -> None:
+        """
+        Append already deduplicated and embedded chunks to the index.
+        Child classes extend it to store the embeddings.
+
+        Args:
+            chunks (List[str]): Chunks, already registered by `_dedupe`.
+            metadata (List[dict]): Metadata of each chunk. May be empty.
+            texts (List[str]): New unique texts, as returned by `_dedupe`.
+            embs (Union[torch.Tensor, None]): Embeddings of `texts`, or None,
+                if there are no new texts.
+        """
+        self._append_offsets(chunks, metadata)
+        if embs is not None:
+            self.row_nbytes += _rows_nbytes(texts, embs)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory footprint of the index, in bytes: its arrays, and
+        the embedding and text of every unique row, wherever the backend
+        keeps them. The embedding model is not included.
+        """
+        arrays_nbytes = sum(getattr(self, name).nbytes for name in INDEX_ARRAYS)
+        return self.row_nbytes + arrays_nbytes
+
+    def reset(self) -> None:
+        """
+        Empty the index, i.e. remove all the chunks, keeping the chunker and
+        embedding model, e.g. to rebuild it from scratch.
+        """
+        with self._write_lock:
+            self._reset_index()
+
+    def close(self) -> None:
+        """
+        Release the index. Child classes extend it to release their storage.
         """
-        return []
+        self._reset_index()
+
+    def save(self, path: Union[Path, str], batch_size: int = 4096) -> None:
+        """
+        Persist the index into given directory, as `.npy` arrays, together
+        with the text and embedding of every unique row. See `load`.
+
+        Args:
+            path (Union[Path, str]): Directory to save the index to.
+            batch_size (int): Number of rows read from the backend at once.
+        """
+        path = Path(path)
+        log_ongoing(f"Saving index to: {path}")
+        os.makedirs(path, exist_ok=True)
+
+        # Deleted rows are saved as tombstones, with no text and zero embedding
+        alive_rows = np.flatnonzero(self.row_alive).tolist()
+        texts = [""] * len(self.unique_members)
+        embs = None
+        for i in range(0, len(alive_rows), batch_size):
+            rows = alive_rows[i : i + batch_size]  # noqa: E203
+            ids = [self.unique_members[row][0] for row in rows]
+            row_embs = self._load_embs(ids).float().numpy()
+            if embs is None:
+                embs = np.zeros((len(texts), row_embs.shape[1]), dtype=np.float32)
+            embs[rows] = row_embs
+            for row, text in zip(rows, self._load_chunks(ids)):
+                texts[row] = text
+        if embs is None:
+            embs = np.empty((0, 0), dtype=np.float32)
+
+        for name in INDEX_ARRAYS:
+            np.save(path / f"{name}.npy", getattr(self, name))
+        np.save(path / "embs.npy", embs.astype(np.float32))
+        with open(path / "texts.json", "w", encoding="utf-8") as file:
+            json.dump(texts, file)
+
+        # Written last, so that only complete indexes are ever loaded
+        with open(path / "meta.json", "w", encoding="utf-8") as file:
+            json.dump({"corpus_names": self.corpus_names, "n_rows": len(texts)}, file)
+        log_done(f"Successfully saved {len(texts)} unique chunk(s)!")
+
+    def load(self, path: Union[Path, str]) -> None:
+        """
+        Load index persisted by `save`, replacing any previous contents.
+        Chunks are neither re-chunked nor re-embedded.
+
+        Args:
+            path (Union[Path, str]): Directory the index was saved to.
+        """
+        path = Path(path)
+        if not os.path.exists(path / "meta.json"):
+            raise ValueError(f"No saved index at: {path}")
+
+        log_ongoing(f"Loading index from: {path}")
+        with self._write_lock:
+            self._reset_index()
+            with open(path / "meta.json", "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            with open(path / "texts.json", "r", encoding="utf-8") as file:
+                texts = json.load(file)
+            for name in INDEX_ARRAYS:
+                setattr(self, name, np.load(path / f"{name}.npy"))
+            embs = torch.from_numpy(np.load(path / "embs.npy"))
+
+            # Dedupe mappings are rebuilt, so that documents can still be added
+            self.corpus_names = meta["corpus_names"]
+            self.unique_members = [[] for _ in texts]
+            for idx, row in enumerate(self.chunk_to_unique.tolist()):
+                self.unique_members[row].append(idx)
+            self.unique_rows = {
+                (corpus_id, doc_id, text): row
+                for row, (corpus_id, doc_id, text, alive) in enumerate(
+                    zip(
+                        self.row_corpus.tolist(),
+                        self.row_doc.tolist(),
+                        texts,
+                        self.row_alive.tolist(),
+                    )
+                )
+                if alive
+            }
+            self.n_deleted_rows = int((~self.row_alive).sum())
+
+            if texts:
+                self._load_index(texts, embs)
+                self.row_nbytes = _rows_nbytes(texts, embs)
+        log_done(f"Successfully loaded {len(texts)} unique chunk(s)!")
+
+    def _load_index(self, texts: List[str], embs: torch.Tensor) -> None:
+        """
+        Store texts and embeddings of all the unique rows, loaded by `load`.
+        The arrays and dedupe mappings are already restored.
+        """
+        raise NotImplementedError
+
+    def add_chunks(
+        self,
+        chunks: List[str],
+        metadata: List[dict] = [],
+        corpus: str = "",
+        doc_id: int = 0,
+        batch_size: int = 256,
+        emb_batch_size: int = 16,
+        chunk_embs: Optional[torch.Tensor] = None,
+    ) -> None:
+        """
+        Add given chunks to the retriever, next to the ones already present.
+        Chunks are deduplicated, embedded and indexed in batches of
+        `batch_size`, so only a single batch of embeddings is held at a time.
+        Each unique chunk text is embedded only once.
+
+        Args:
+            chunks (List[str]): Chunks to add.
+            metadata (List[dict]): Metadata of each chunk. May be empty.
+            corpus (str): Name of the corpus the chunks belong to.
+            doc_id (int): Id of the document (within corpus) chunks belong to.
+            batch_size (int): Number of chunks embedded and indexed at once.
+            emb_batch_size (int): Batch size for chunk embedding.
+            chunk_embs (Optional[torch.Tensor]): Precomputed embedding of each
+                chunk, e.g. by late chunking. If given, chunks are not embedded.
+                Identical chunks keep the embedding of their first occurrence.
+
+        Returns:
+            None
+        """
+        with self._write_lock:
+            corpus_id = self._corpus_id(corpus)
+            first_idx = len(self.chunk_to_unique)
+            for i in range(0, len(chunks), batch_size):
+                batch = chunks[i : i + batch_size]  # noqa: E203
+                batch_metadata = metadata[i : i + batch_size]  # noqa: E203
+
+                texts = self._dedupe(batch, corpus_id, doc_id)
+                if not texts:
+                    embs = None
+                elif chunk_embs is not None:
+                    n_rows = len(self.unique_members)
+                    embs = chunk_embs[
+                        [
+                            self.unique_members[row][0] - first_idx
+                            for row in range(n_rows - len(texts), n_rows)
+                        ]
+                    ]
+                else:
+                    embs = self.embed(texts, emb_batch_size)
+                self._append(batch, batch_metadata, texts, embs)
+        self._log_dedupe()
+
+    def add_document(
+        self,
+        content: str,
+        add_metadata: bool = True,
+        corpus: str = "",
+        doc_id: int = 0,
+        batch_size: int = 256,
+        emb_batch_size: int = 16,
+        late_chunking: bool = False,
+    ) -> None:
+        """
+        Add given document (content) to the chunk database, next to the ones
+        already present. Split document into chunks, embed the chunks, and,
+        if applicable, generate metadata pieces for each chunk.
+
+        Args:
+            content (str): Document to chunk.
+            add_metadata (bool): If true, will generate metadata for each chunk.
+                Otherwise, offsets of all chunks are set to -1.
+            corpus (str): Name of the corpus the document belongs to.
+            doc_id (int): Id of the document, within corpus.
+            batch_size (int): Number of chunks embedded and indexed at once.
+            emb_batch_size (int): Batch size for chunk embedding.
+            late_chunking (bool): If true, encode the whole document once, and
+                pool each chunk's embedding from the token embeddings within
+                its span. See `late_chunk_embed`. Requires `add_metadata`.
+
+        Returns:
+            None
+        """
+        if late_chunking and not add_metadata:
+            raise ValueError("Late chunking requires chunk metadata (offsets).")
+
+        chunks = self.chunk(content)
+
+        metadata = []
+        if add_metadata:
+            log_ongoing("Generating chunks metadata...")
+            for chunk in tqdm(chunks):
+                chunk_metadata = self._make_metadata_for_chunk(chunk, content)
+                metadata.append(chunk_metadata)
+            log_done("Successfully generated chunks metadata")
+
+        chunk_embs = None
+        if late_chunking:
+            chunk_embs = self._late_chunk_embed(content, chunks, metadata)
+
+        self.add_chunks(
+            chunks,
+            metadata,
+            corpus=corpus,
+            doc_id=doc_id,
+            batch_size=batch_size,
+            emb_batch_size=emb_batch_size,
+            chunk_embs=chunk_embs,
+        )
+
+    def _late_chunk_embed(
+        self, content: str, chunks: List[str], metadata: List[dict]
+    ) -> torch.Tensor:
+        """
+        Embed chunks of given document by late chunking.
+        Chunks whose span is unknown are embedded on their own.
+        """
+        log_ongoing("Embedding chunks by late chunking...")
+        spans = [(meta["start_index"], meta["end_index"]) for meta in metadata]
+        chunk_embs, missing = late_chunk_embed(self.emb_model, content, spans)
+
+        missing_idx = np.flatnonzero(missing)
+        if len(missing_idx) > 0:
+            log_info(f"Embedding {len(missing_idx)} chunk(s) without a known span.")
+            embs = self.embed([chunks[idx] for idx in missing_idx])
+            chunk_embs[torch.from_numpy(missing_idx)] = embs.reshape(
+                len(missing_idx), -1
+            ).to(chunk_embs.dtype)
+
+        log_done("Successfully embedded chunks by late chunking")
+        return chunk_embs
+
+    def from_document(
+        self,
+        content: str,
+        add_metadata: bool = True,
+        corpus: str = "",
+        doc_id: int = 0,
+    ) -> None:
+        """
+        Create chunk database from given document (content), replacing any
+        previous contents. See `add_document`.
+        """
+        with self._write_lock:
+            self._reset_index()
+            self.add_document(content, add_metadata, corpus=corpus, doc_id=doc_id)
+
+    def ingest(
+        self,
+        content: str,
+        add_metadata: bool = True,
+        corpus: str = "",
+        doc_id: int = 0,
+        reset: bool = True,
+        batch_size: int = 256,
+        emb_batch_size: int = 16,
+        queue_size: int = 4,
+    ) -> dict:
+        """
+        Add given document (content) to the chunk database, using the
+        pipelined ingestion. Chunk batches flow through metadata generation,
+        embedding and indexing concurrently. See `IngestionPipeline`.
+
+        Args:
+            content (str): Document to chunk.
+            add_metadata (bool): If true, will generate metadata for each chunk.
+            corpus (str): Name of the corpus the document belongs to.
+            doc_id (int): Id of the document, within corpus.
+            reset (bool): If true, replace previous contents of the database.
+            batch_size (int): Number of chunks per pipeline batch.
+            emb_batch_size (int): Batch size for chunk embedding.
+            queue_size (int): Maximum number of batches waiting between stages.
+
+        Returns:
+            dict: Throughput counters of each pipeline stage.
+        """
+        # Pipeline stages run in their own threads, while the lock is held
+        with self._write_lock:
+            if reset:
+                self._reset_index()
+            pipeline = IngestionPipeline(
+                self,
+                add_metadata=add_metadata,
+                corpus_id=self._corpus_id(corpus),
+                doc_id=doc_id,
+                batch_size=batch_size,
+                emb_batch_size=emb_batch_size,
+                queue_size=queue_size,
+            )
+            stats = pipeline.run(content)
+        self._log_dedupe()
+        return stats
 
     # Taken from author's implementation
     def _find_query_despite_whitespace(self, chunk: str, document: str):
@@ -196,34 +962,39 @@ class ChromaDBRetriever(Retriever):
     """
 
     def __init__(self, chunker, emb_model, collection_name: str = "example_collection"):
-        self.chunker = chunker
-        self.emb_model = emb_model
+        super().__init__(chunker, emb_model)
         self.client = chromadb.Client()
         self.collection = self.client.get_or_create_collection(name=collection_name)
+        self.max_batch_size = self.client.get_max_batch_size()
         self.chunk_id_map: Dict[int, str] = (
             {}
-        )  # Maps index to document ID in collection
+        )  # Maps unique row to document ID in collection
+        self.id_chunk_map: Dict[str, int] = {}  # Inverse of `chunk_id_map`
 
     def __getitem__(self, idx: int):
         """
         Retrieve document by index (uses chunk_id_map for look-up).
         """
-        if idx not in self.chunk_id_map:
+        if idx >= len(self.chunk_to_unique):
             return None
 
         result = self.collection.get(
-            ids=[self.chunk_id_map[idx]],
-            include=["documents", "embeddings", "metadatas"],
+            ids=[self.chunk_id_map[int(self.chunk_to_unique[idx])]],
+            include=["documents", "embeddings"],
         )
 
+        # Duplicates share a single document, so offsets are kept locally
         return {
             "chunk": result["documents"][0],
             "emb": torch.tensor(result["embeddings"][0]),
-            "metadata": result["metadatas"][0],
+            "metadata": {
+                "start_index": int(self.starts[idx]),
+                "end_index": int(self.ends[idx]),
+            },
         }
 
     def __iter__(self):
-        for i in range(len(self.chunk_id_map)):
+        for i in range(len(self.chunk_to_unique)):
             yield self.__getitem__(i)
 
     def chunk(self, text: str) -> List[str]:
@@ -232,63 +1003,317 @@ class ChromaDBRetriever(Retriever):
     def embed(self, chunks: Union[str, List[str]], batch_size: int = 1) -> torch.Tensor:
         return super().embed(chunks, batch_size)
 
-    def add_chunks(self, chunks: List[str], metadata: List[dict] = []):
-        embs = self.embed(chunks).tolist()
-        ids = [f"chunk_{i}" for i in range(len(chunks))]
+    def _reset_index(self) -> None:
+        super()._reset_index()
+
+        # Remove documents of the previous index, so that ids can be reused
+        self._delete_ids(list(getattr(self, "chunk_id_map", {}).values()))
+
+        self.chunk_id_map = {}
+        self.id_chunk_map = {}
+        self.epoch += 1
+
+    def _append(
+        self,
+        chunks: List[str],
+        metadata: List[dict],
+        texts: List[str],
+        embs: Union[torch.Tensor, None],
+    ) -> None:
+        super()._append(chunks, metadata, texts, embs)
+        if texts:
+            self._add_rows(texts, embs)
+        self.epoch += 1
+
+    def _add_rows(self, texts: List[str], embs: torch.Tensor) -> None:
+        """
+        Add documents of new unique rows to the collection.
+        """
+        # Only a single document is stored per unique text, with the offsets
+        # of its first occurrence. Rows are global, so ids of appended
+        # documents continue where the previous ones stopped.
+        first_row = len(self.chunk_id_map)
+        rows = range(first_row, first_row + len(texts))
+        ids = [f"chunk_{row}" for row in rows]
+        first_chunks = [self.unique_members[row][0] for row in rows]
 
         # Save mapping
-        for i, _id in enumerate(ids):
-            self.chunk_id_map[i] = _id
-
-        # Add to collection
-        self.collection.add(
-            ids=ids,
-            documents=chunks,
-            embeddings=embs,
-            metadatas=metadata if metadata else [{} for _ in chunks],
+        for row, _id in zip(rows, ids):
+            self.chunk_id_map[row] = _id
+            self.id_chunk_map[_id] = row
+
+        # Embeddings are passed as a NumPy view of the (CPU) tensor, with no
+        # conversion to nested lists. Adds never exceed Chroma's batch limit.
+        embs = embs.numpy()
+        for i in range(0, len(texts), self.max_batch_size):
+            batch = slice(i, i + self.max_batch_size)
+            self.collection.add(
+                ids=ids[batch],
+                documents=texts[batch],
+                embeddings=embs[batch],
+                metadatas=[
+                    {
+                        "start_index": int(self.starts[idx]),
+                        "end_index": int(self.ends[idx]),
+                        "corpus_id": int(self.chunk_corpus[idx]),
+                        "doc_id": int(self.chunk_doc[idx]),
+                    }
+                    for idx in first_chunks[batch]
+                ],
+            )
+
+    def _load_index(self, texts: List[str], embs: torch.Tensor) -> None:
+        self._add_rows(texts, embs)
+        dead_rows = np.flatnonzero(~self.row_alive)
+        if len(dead_rows) > 0:
+            self._delete_ids([self.chunk_id_map[row] for row in dead_rows.tolist()])
+        self.epoch += 1
+
+    def _delete_rows(self, rows: np.ndarray) -> None:
+        super()._delete_rows(rows)
+        # Row ids are kept in the mapping, so that new rows never reuse them
+        self._delete_ids([self.chunk_id_map[row] for row in rows.tolist()])
+        self.epoch += 1
+
+    def _delete_ids(self, ids: List[str]) -> None:
+        """
+        Delete documents from the collection, in batches.
+        """
+        while ids:
+            self.collection.delete(ids=ids[: self.max_batch_size])
+            ids = ids[self.max_batch_size :]  # noqa: E203
+
+    def close(self) -> None:
+        self.client.delete_collection(self.collection.name)
+        self.chunk_id_map = {}
+        super().close()
+
+    def _chroma_where(self, where: dict) -> Union[dict, None]:
+        """
+        Translate filter into ChromaDB `where` clause.
+        Returns None, if no chunk can pass the filter.
+        """
+        corpus_ids, doc_ids = self._resolve_where(where)
+        clauses = []
+        if corpus_ids is not None:
+            clauses.append({"corpus_id": {"$in": corpus_ids}})
+        if doc_ids is not None:
+            clauses.append({"doc_id": {"$in": doc_ids}})
+
+        if any(not clause[col]["$in"] for clause in clauses for col in clause):
+            return None
+        if len(clauses) > 1:
+            return {"$and": clauses}
+        return clauses[0] if clauses else {}
+
+    def query_spans(
+        self, query: str, k: int = 10, where: Optional[dict] = None
+    ) -> np.ndarray:
+        return self.query_batch([query], k, where=where)[0]
+
+    def query_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+        where: Optional[dict] = None,
+        batch_size: int = 32,
+    ) -> List[np.ndarray]:
+        chroma_where = {} if where is None else self._chroma_where(where)
+        if chroma_where is None or not queries:
+            return [make_spans([], [], [], []) for _ in queries]
+
+        # All the queries are embedded at once, and sent in as few requests
+        # as Chroma's batch limit allows
+        query_embs = self.embed(queries, batch_size).reshape(len(queries), -1)
+        return self._query_cached(
+            query_embs,
+            lambda embs: self._search_batch(embs, k, chroma_where),
+            k,
+            where=where,
+            epoch=self.epoch,
         )
 
-    def from_document(self, content: str, add_metadata: bool = True):
-        chunks = self.chunk(content)
+    def _search_batch(
+        self, query_embs: np.ndarray, k: int, chroma_where: dict
+    ) -> List[np.ndarray]:
+        """
+        Search for top-k chunks of already embedded queries.
+        """
+        all_spans = []
+        for i in range(0, len(query_embs), self.max_batch_size):
+            # Neither documents nor embeddings are requested, only ids and scores
+            results = self.collection.query(
+                query_embeddings=query_embs[i : i + self.max_batch_size],  # noqa
+                n_results=k,
+                where=chroma_where or None,
+                include=["distances"],
+            )
 
-        metadata = []
-        if add_metadata:
-            log_ongoing("Generating chunks metadata...")
-            for chunk in tqdm(chunks):
-                chunk_metadata = self._make_metadata_for_chunk(chunk, content)
-                metadata.append(chunk_metadata)
-            log_done("Successfully generated chunks metadata")
-        self.add_chunks(chunks, metadata)
+            for result_ids, distances in zip(results["ids"], results["distances"]):
+                # Results are unique rows, which are expanded back to their chunks
+                ids, scores = self._expand(
+                    rows=np.array(
+                        [self.id_chunk_map[_id] for _id in result_ids], dtype=np.int64
+                    ),
+                    scores=-np.array(distances),
+                    k=k,
+                )
+                all_spans.append(
+                    make_spans(
+                        ids=ids,
+                        scores=scores,
+                        starts=self.starts[ids],
+                        ends=self.ends[ids],
+                        corpus_ids=self.chunk_corpus[ids],
+                        doc_ids=self.chunk_doc[ids],
+                    )
+                )
+        return all_spans
+
+    def _load_chunk(self, idx: int) -> str:
+        result = self.collection.get(
+            ids=[self.chunk_id_map[int(self.chunk_to_unique[idx])]],
+            include=["documents"],
+        )
+        return result["documents"][0]
 
-    def query(self, query: str, k: int = 10):
-        query_emb = self.embed(query).squeeze().tolist()
+    def _load_chunks(self, ids: List[int]) -> List[str]:
+        # Duplicates share a document, so each one is fetched only once
+        chroma_ids = [self.chunk_id_map[int(self.chunk_to_unique[idx])] for idx in ids]
+        result = self.collection.get(
+            ids=list(dict.fromkeys(chroma_ids)), include=["documents"]
+        )
+        documents = dict(zip(result["ids"], result["documents"]))
+        return [documents[_id] for _id in chroma_ids]
 
-        results = self.collection.query(
-            query_embeddings=[query_emb],
-            n_results=k,
-            include=["documents", "metadatas", "embeddings"],
+    def _load_emb(self, idx: int) -> torch.Tensor:
+        result = self.collection.get(
+            ids=[self.chunk_id_map[int(self.chunk_to_unique[idx])]],
+            include=["embeddings"],
         )
+        return torch.tensor(result["embeddings"][0])
 
-        return [
-            {
-                "chunk": results["documents"][0][i],
-                "emb": torch.tensor(results["embeddings"][0][i]),
-                "metadata": results["metadatas"][0][i],
-            }
-            for i in range(len(results["documents"][0]))
-        ]
+    def _load_embs(self, ids: List[int]) -> torch.Tensor:
+        chroma_ids = [self.chunk_id_map[int(self.chunk_to_unique[idx])] for idx in ids]
+        result = self.collection.get(
+            ids=list(dict.fromkeys(chroma_ids)), include=["embeddings"]
+        )
+        embs = dict(zip(result["ids"], result["embeddings"]))
+        return torch.from_numpy(np.stack([embs[_id] for _id in chroma_ids]))
+
+    def _prepare_fork(self) -> None:
+        # The ChromaDB client runs its own threads and holds open handles,
+        # neither of which survives a fork
+        raise ValueError("ChromaDBRetriever can not be shared by forked workers.")
 
 
 class CosSimRetriever(Retriever):
     """
     This class contains simple implementation of cosine similarity retriever.
-    As the name suggests, will use cosine_similarity to calculate similarities
-    between query embedding and each chunk embedding.
+    As the name suggests, will use cosine similarity to score the query
+    embedding against each chunk embedding.
+
+    If `coarse_dim` is set, queries run in two stages: all the chunks are
+    scored cheaply against a reduced-dimension copy of the embeddings (see
+    `Projection`), and only the top `n_candidates` are re-ranked with the
+    full embeddings.
+
+    The index is updated incrementally. Embeddings are kept in a buffer whose
+    capacity doubles when full, so appending is amortized O(1) per row.
+    Deleted rows are tombstoned, and are dropped by `compact`, which runs
+    automatically once their fraction exceeds `compact_ratio`.
+
+    Queries may run from any number of threads, while the index is being
+    updated. A single writer (see `_write_lock`) publishes an immutable
+    `IndexSnapshot` after every change, and every query runs against the
+    snapshot current when it started, without taking any lock.
     """
 
-    def __init__(self, chunker, emb_model):
+    def __init__(
+        self,
+        chunker,
+        emb_model,
+        coarse_dim: Optional[int] = None,
+        projection: str = "pca",
+        n_candidates: int = 100,
+        compact_ratio: Optional[float] = 0.25,
+    ):
+        # Set before the base initializer, which publishes the first snapshot
+        self.coarse_dim = coarse_dim
+        self.projection = projection
+        self.n_candidates = n_candidates
+        self.compact_ratio = compact_ratio
         super().__init__(chunker, emb_model)
 
+    def set_two_stage(
+        self,
+        coarse_dim: Optional[int] = None,
+        projection: str = "pca",
+        n_candidates: int = 100,
+    ) -> None:
+        """
+        Configure two-stage retrieval. The projection is fitted lazily, on
+        the first query after the configuration changes or the rows are
+        renumbered, and refitted as the index grows (see `CoarseIndex`).
+
+        Args:
+            coarse_dim (Optional[int]): Dimension of coarse scoring. If None,
+                all the chunks are scored with the full embeddings.
+            projection (str): Projection method, "pca" or "truncate".
+            n_candidates (int): Number of coarse candidates to re-rank.
+        """
+        with self._write_lock:
+            self.coarse_dim = coarse_dim
+            self.projection = projection
+            self.n_candidates = n_candidates
+            self._reset_coarse()
+            self._publish()
+
+    def _reset_coarse(self) -> None:
+        """
+        Start a new coarse index, e.g. once rows are renumbered.
+        """
+        self._coarse = None
+        if self.coarse_dim is not None:
+            self._coarse = CoarseIndex(self.coarse_dim, self.projection)
+
+    def _coarse_index(self) -> Tuple[Projection, np.ndarray]:
+        """
+        Get fitted projection, and the reduced-dimension embedding matrix of
+        the current snapshot.
+        """
+        return self.snapshot.coarse_index()
+
+    def _publish(self) -> None:
+        """
+        Publish a snapshot of the index, as of now. Only rows and chunks that
+        are fully appended (i.e. embedded and stored) are part of it.
+        """
+        n_rows = self._n_rows
+        n_chunks = len(self.starts)
+        if self._emb_buffer is None:
+            embs = np.empty((0, 0), dtype=np.float32)
+        else:
+            embs = self._emb_buffer[:n_rows].numpy()
+
+        self.epoch += 1
+        self.snapshot = IndexSnapshot(
+            epoch=self.epoch,
+            embs=embs,
+            norms=self._norm_buffer[:n_rows],
+            row_corpus=self.row_corpus[:n_rows],
+            row_doc=self.row_doc[:n_rows],
+            row_alive=self.row_alive[:n_rows],
+            n_deleted_rows=self.n_deleted_rows,
+            unique_members=self.unique_members,
+            starts=self.starts,
+            ends=self.ends,
+            chunk_corpus=self.chunk_corpus[:n_chunks],
+            chunk_doc=self.chunk_doc[:n_chunks],
+            corpus_names=dict(self.corpus_names),
+            coarse=self._coarse,
+        )
+
     def __getitem__(self, idx: int):
         """
         Implemented as part of easier access.
@@ -312,7 +1337,7 @@ class CosSimRetriever(Retriever):
         # Return full chunk information
         return {
             "chunk": self.chunks[idx],
-            "emb": self.embs[idx],
+            "emb": self.embs[self.chunk_to_unique[idx]],
             "metadata": self.metadata[idx],
         }
 
@@ -331,45 +1356,201 @@ class CosSimRetriever(Retriever):
     ) -> torch.Tensor:  # noqa: E501
         return super().embed(chunks, batch_size)
 
-    def add_chunks(
-        self, chunks: Union[str, List[str]], metadata: List[dict] = []
+    @property
+    def embs(self) -> Union[torch.Tensor, None]:
+        """
+        Embeddings of all the unique rows, i.e. a view of the buffer.
+        """
+        if self._emb_buffer is None:
+            return None
+        return self._emb_buffer[: self._n_rows]
+
+    def _reserve(self, n_rows: int, like: torch.Tensor) -> None:
+        """
+        Make room for given number of rows in the embedding buffer, doubling
+        its capacity, so that rows are copied only O(log n) times overall.
+        Rows are copied into a new buffer, so published snapshots keep
+        viewing the old one.
+        """
+        capacity = 0 if self._emb_buffer is None else len(self._emb_buffer)
+        if n_rows <= capacity:
+            return
+        capacity = max(n_rows, 2 * capacity)
+        buffer = torch.empty((capacity, like.shape[1]), dtype=like.dtype)
+        norms = np.empty(capacity, dtype=np.float32)
+        if self._n_rows > 0:
+            buffer[: self._n_rows] = self.embs
+            norms[: self._n_rows] = self._norm_buffer[: self._n_rows]
+        self._emb_buffer = buffer
+        self._norm_buffer = norms
+
+    def _set_rows(self, embs: torch.Tensor) -> None:
+        """
+        Replace embedding buffer with given embeddings (e.g. once loaded, or
+        compacted), and start a new coarse index.
+        """
+        self._emb_buffer = embs
+        self._norm_buffer = np.linalg.norm(embs.float().numpy(), axis=1)
+        self._norm_buffer = self._norm_buffer.astype(np.float32)
+        self._n_rows = len(embs)
+        self._reset_coarse()
+
+    def _reset_index(self) -> None:
+        super()._reset_index()
+        self.chunks: List[str] = []
+        self.metadata: List[dict] = []
+        self._emb_buffer: Optional[torch.Tensor] = None
+        self._norm_buffer = np.empty(0, dtype=np.float32)
+        self._n_rows = 0
+        self._reset_coarse()
+        self._publish()
+
+    def _append(
+        self,
+        chunks: List[str],
+        metadata: List[dict],
+        texts: List[str],
+        embs: Union[torch.Tensor, None],
     ) -> None:
-        self.chunks = chunks
-        self.embs = self.embed(chunks)
-        self.metadata = metadata
+        super()._append(chunks, metadata, texts, embs)
+        if not metadata:
+            metadata = [{"start_index": -1, "end_index": -1} for _ in chunks]
+
+        # Identical chunks share a single row of `self.embs`.
+        # Rows past the end of the current snapshot are written in place.
+        self.chunks.extend(chunks)
+        self.metadata.extend(metadata)
+        if embs is not None:
+            lo, hi = self._n_rows, self._n_rows + len(embs)
+            self._reserve(hi, embs)
+            self._emb_buffer[lo:hi] = embs
+            self._norm_buffer[lo:hi] = np.linalg.norm(embs.float().numpy(), axis=1)
+            self._n_rows = hi
+        self._publish()
+
+    def _load_index(self, texts: List[str], embs: torch.Tensor) -> None:
+        self.chunks = [texts[row] for row in self.chunk_to_unique.tolist()]
+        self.metadata = [
+            {"start_index": start, "end_index": end}
+            for start, end in zip(self.starts.tolist(), self.ends.tolist())
+        ]
+        self._set_rows(embs)
+        self._publish()
+
+    def _delete_rows(self, rows: np.ndarray) -> None:
+        super()._delete_rows(rows)
+        self._publish()
+        n_rows = len(self.row_alive)
+        if (
+            self.compact_ratio is not None
+            and self.n_deleted_rows > self.compact_ratio * n_rows
+        ):
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Drop deleted rows, their chunks and embeddings, and shrink the
+        embedding buffer. Chunk ids of the remaining chunks are renumbered,
+        so spans returned before compaction are invalidated. Queries already
+        running keep their (old) snapshot.
+        """
+        with self._write_lock:
+            if self.n_deleted_rows == 0:
+                return
+            log_ongoing(f"Compacting {self.n_deleted_rows} deleted row(s)...")
+            alive_rows, alive_chunks = self._compact_index()
+
+            alive_chunks = alive_chunks.tolist()
+            self.chunks = [self.chunks[idx] for idx in alive_chunks]
+            self.metadata = [self.metadata[idx] for idx in alive_chunks]
+            self._set_rows(self.embs[torch.from_numpy(alive_rows)])
+            self.row_nbytes = _rows_nbytes(
+                [self.chunks[members[0]] for members in self.unique_members],
+                self._emb_buffer,
+            )
+            self._publish()
+        log_done(f"Successfully compacted index to {self._n_rows} row(s)!")
+
+    def query_spans(
+        self, query: str, k: int = 10, where: Optional[dict] = None
+    ) -> np.ndarray:
+        return self._search_cached(self.embed(query)[None], k, where=where)[0]
+
+    def query_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+        where: Optional[dict] = None,
+        batch_size: int = 32,
+    ) -> List[np.ndarray]:
+        if not queries:
+            return []
+        query_embs = self.embed(queries, batch_size).reshape(len(queries), -1)
+        return self._search_cached(query_embs, k, where=where)
+
+    def _search_cached(
+        self, query_embs: torch.Tensor, k: int = 10, where: Optional[dict] = None
+    ) -> List[np.ndarray]:
+        """
+        Search for top-k chunks of already embedded queries, through the
+        query cache, if set.
+        """
+        # All the queries of the batch see the same snapshot
+        snapshot = self.snapshot
+        return self._query_cached(
+            query_embs,
+            lambda embs: [
+                self._search(query_emb, k, where=where, snapshot=snapshot)
+                for query_emb in embs
+            ],
+            k,
+            where=where,
+            epoch=snapshot.epoch,
+        )
 
-    def from_document(self, content: str, add_metadata: bool = True) -> None:
+    def _search(
+        self,
+        query_emb: torch.Tensor,
+        k: int = 10,
+        where: Optional[dict] = None,
+        snapshot: Optional[IndexSnapshot] = None,
+    ) -> np.ndarray:
+        """
+        Search for top-k chunks, given an already embedded query.
+        See `query_spans` and `IndexSnapshot.search`.
         """
-        Create chunk database from given document (content).
-        Split document into chunks, embed the chunks, and, if applicable,
-        generate metadata pieces for each chunk.
+        snapshot = self.snapshot if snapshot is None else snapshot
+        return snapshot.search(
+            np.asarray(query_emb), k, where=where, n_candidates=self.n_candidates
+        )
 
-        Args:
-            content (str): Document to chunk.
-            add_metadata (bool): If true, will generate metadata for each chunk.
-                Otherwise, metadata is `None` for all chunks.
+    def _load_chunk(self, idx: int) -> str:
+        return self.chunks[idx]
 
-        Returns:
-            None
-        """
-        chunks = self.chunk(content)
+    def _load_emb(self, idx: int) -> torch.Tensor:
+        return self.embs[self.chunk_to_unique[idx]]
 
-        metadata = None
-        if add_metadata:
-            metadata = []
-            for chunk in chunks:
-                chunk_metadata = super()._make_metadata_for_chunk(chunk, content)
-                metadata.append(chunk_metadata)
+    def _load_embs(self, ids: List[int]) -> torch.Tensor:
+        return self.embs[self.chunk_to_unique[ids]]
 
-        self.add_chunks(chunks, metadata=metadata)
+    def _prepare_fork(self) -> None:
+        super()._prepare_fork()
 
-    def query(self, query: str, k: int = 10):
-        # Embed the query and get the scores for all the chunks
-        query_emb = self.embed(query)
-        scores = cosine_similarity(query_emb.reshape(1, -1), self.embs)
+        # Embeddings live in shared memory, rather than in private pages
+        # that would be copied into every worker
+        with self._write_lock:
+            if self._emb_buffer is not None:
+                self._emb_buffer.share_memory_()
+            # Snapshot is re-published, to view the shared buffer
+            self._publish()
+            if self._coarse is not None and self._n_rows > 0:
+                self._coarse_index()
+                self._coarse.share_memory()
 
-        # Retrieve Top-K chunks, with full embeddings and metadat
-        top_k_idx = np.argsort(scores[0])[::-1][:k]
-        full_chunks = [self.__getitem__(idx) for idx in top_k_idx]
 
-        return full_chunks
+def _rows_nbytes(texts: List[str], embs: torch.Tensor) -> int:
+    """
+    Approximate memory footprint of unique rows, i.e. of their texts and
+    embeddings.
+    """
+    return embs.nelement() * embs.element_size() + sum(len(text) for text in texts)
@@ -0,0 +1,542 @@
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import traceback
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from utils.log import log_done, log_info, log_ongoing
+
+from .result import make_spans
+from .retriever import Retriever
+from .snapshot import GrowableArray, expand_rows, growable_array
+
+
+def balanced_counts(sizes: np.ndarray, n_rows: int) -> np.ndarray:
+    """
+    Split new rows across shards, filling the smallest shards first, so that
+    shard sizes end up as even as possible.
+
+    Args:
+        sizes (np.ndarray): Current number of rows of every shard.
+        n_rows (int): Number of new rows.
+
+    Returns:
+        np.ndarray: Number of new rows per shard, summing up to `n_rows`.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+
+    # Find the highest level every shard can be filled up to
+    lo, hi = int(sizes.min()), int(sizes.min()) + n_rows
+    while lo < hi:
+        level = (lo + hi + 1) // 2
+        if np.maximum(level - sizes, 0).sum() <= n_rows:
+            lo = level
+        else:
+            hi = level - 1
+    counts = np.maximum(lo - sizes, 0)
+
+    # Rows left over raise some of the shards at the level by one
+    remainder = n_rows - int(counts.sum())
+    at_level = np.flatnonzero(sizes <= lo)[:remainder]
+    counts[at_level] += 1
+    return counts
+
+
+class _Shard:
+    """
+    Slice of the index owned by a single shard worker: embeddings of some of
+    the unique rows, their global row ids and their corpus and document ids.
+    Embeddings (and the arrays) are kept in buffers whose capacity doubles
+    when full.
+    """
+
+    rows = growable_array("rows")
+    row_corpus = growable_array("row_corpus")
+    row_doc = growable_array("row_doc")
+
+    def __init__(self) -> None:
+        self._arrays: Dict[str, GrowableArray] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        # Empty buffers, until the first rows are appended
+        self.embs = torch.empty((0, 0))
+        self.norms = torch.empty((0,))
+        self.rows = np.empty(0, dtype=np.int64)
+        self.row_corpus = np.empty(0, dtype=np.int32)
+        self.row_doc = np.empty(0, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def append(
+        self,
+        rows: np.ndarray,
+        embs: np.ndarray,
+        row_corpus: np.ndarray,
+        row_doc: np.ndarray,
+    ) -> int:
+        new_embs = torch.from_numpy(np.ascontiguousarray(embs))
+        lo, hi = len(self), len(self) + len(rows)
+        capacity = len(self.embs)
+        if hi > capacity:
+            capacity = max(hi, 2 * capacity)
+            buffer = torch.empty((capacity, new_embs.shape[1]), dtype=new_embs.dtype)
+            norms = torch.empty((capacity,), dtype=new_embs.dtype)
+            if lo > 0:
+                buffer[:lo] = self.embs[:lo]
+                norms[:lo] = self.norms[:lo]
+            self.embs, self.norms = buffer, norms
+
+        self.embs[lo:hi] = new_embs
+        self.norms[lo:hi] = torch.linalg.vector_norm(new_embs, dim=1)
+        self._arrays["rows"].append(rows)
+        self._arrays["row_corpus"].append(row_corpus)
+        self._arrays["row_doc"].append(row_doc)
+        return len(self)
+
+    def _keep(self, keep: np.ndarray) -> None:
+        """
+        Keep only the rows at given (local) positions, in order.
+        """
+        index = torch.from_numpy(keep)
+        self.embs = self.embs[: len(self)][index].clone()
+        self.norms = self.norms[: len(self)][index].clone()
+        self.rows = self.rows[keep]
+        self.row_corpus = self.row_corpus[keep]
+        self.row_doc = self.row_doc[keep]
+
+    def delete(self, rows: np.ndarray) -> int:
+        self._keep(np.flatnonzero(~np.isin(self.rows, rows)))
+        return len(self)
+
+    def take(
+        self, n_rows: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Remove the last rows, and return them, e.g. to move them to another
+        shard.
+        """
+        lo = len(self) - n_rows
+        taken = (
+            self.rows[lo:],
+            self.embs[lo : len(self)].numpy().copy(),  # noqa: E203
+            self.row_corpus[lo:],
+            self.row_doc[lo:],
+        )
+        self._keep(np.arange(lo))
+        return taken
+
+    def get(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Get embeddings of given (global) rows, in order.
+        """
+        order = np.argsort(self.rows, kind="stable")
+        local = order[np.searchsorted(self.rows, rows, sorter=order)]
+        return self.embs[torch.from_numpy(local)].numpy()
+
+    def search(
+        self,
+        query_embs: np.ndarray,
+        k: int,
+        corpus_ids: Optional[List[int]],
+        doc_ids: Optional[List[int]],
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Get local top-k rows of every query, and their scores, ordered by
+        score. Rows are returned as global row ids.
+        """
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if len(self) == 0:
+            return [empty for _ in query_embs]
+
+        local = None
+        mask = np.ones(len(self), dtype=bool)
+        if corpus_ids is not None:
+            mask &= np.isin(self.row_corpus, corpus_ids)
+        if doc_ids is not None:
+            mask &= np.isin(self.row_doc, doc_ids)
+        if not mask.all():
+            local = np.flatnonzero(mask)
+            if len(local) == 0:
+                return [empty for _ in query_embs]
+
+        embs, norms = self.embs[: len(self)], self.norms[: len(self)]
+        if local is not None:
+            index = torch.from_numpy(local)
+            embs, norms = embs[index], norms[index]
+
+        queries = torch.from_numpy(np.ascontiguousarray(query_embs)).to(embs.dtype)
+        query_norms = torch.linalg.vector_norm(queries, dim=1)
+        scores = (embs @ queries.T) / torch.clamp(
+            norms[:, None] * query_norms[None, :], min=1e-12
+        )
+        top_scores, top_k = torch.topk(scores, min(k, len(embs)), dim=0)
+
+        top_rows = top_k.T.numpy()
+        if local is not None:
+            top_rows = local[top_rows]
+        rows = self.rows[top_rows]
+        return list(zip(rows, top_scores.T.float().numpy()))
+
+
+def _shard_loop(conn, threads_per_shard: int) -> None:
+    """
+    Serve requests received over the pipe, until it is closed.
+    Each message is a pair of (method of `_Shard`, arguments), and is
+    answered with a pair of (success flag, result or formatted traceback).
+    """
+    torch.set_num_threads(threads_per_shard)
+    shard = _Shard()
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+
+        method, args = msg
+        try:
+            conn.send((True, getattr(shard, method)(*args)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+class ShardedRetriever(Retriever):
+    """
+    This class implements a sharded, scatter-gather cosine similarity
+    retriever. Unique rows are partitioned across `n_shards` worker
+    processes, each owning the embeddings (and corpus and document ids) of
+    its rows, while the coordinator (i.e. this process) keeps the chunks,
+    their metadata and the dedupe mappings.
+
+    Queries are embedded once, and broadcast to all the shards, which score
+    their own rows in parallel, and return their local top-k rows. These are
+    merged with a heap into the exact global top-k, and expanded back to
+    chunks. Memory and scoring of the index are hence split across processes
+    (and cores).
+
+    Appended rows fill the smallest shards first, so shards are rebalanced
+    on every append. Deleted rows are dropped by their shard right away, and
+    once shard sizes drift apart by more than `max_imbalance`, rows are moved
+    from the largest shards to the smallest ones.
+    """
+
+    # Shard of every row, or -1, once deleted
+    row_shard = growable_array("row_shard")
+
+    def __init__(
+        self,
+        chunker,
+        emb_model,
+        n_shards: Optional[int] = None,
+        threads_per_shard: int = 1,
+        max_imbalance: float = 0.1,
+    ):
+        """
+        Args:
+            chunker: Chunker to split documents with.
+            emb_model: Embedding model.
+            n_shards (Optional[int]): Number of shard workers. Defaults to the
+                number of CPUs.
+            threads_per_shard (int): Number of torch threads in each shard.
+            max_imbalance (float): Maximum difference of shard sizes, relative
+                to the mean size, tolerated after deletes.
+        """
+        self.n_shards = n_shards or os.cpu_count() or 1
+        self.max_imbalance = max_imbalance
+
+        # Shards are started before the base initializer, which resets them
+        log_ongoing(f"Starting {self.n_shards} shard worker(s)...")
+        ctx = multiprocessing.get_context("fork")
+        self.conns = []
+        self.workers = []
+        for _ in range(self.n_shards):
+            parent_conn, child_conn = ctx.Pipe()
+            worker = ctx.Process(
+                target=_shard_loop, args=(child_conn, threads_per_shard), daemon=True
+            )
+            worker.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.workers.append(worker)
+        # Held by every round-trip to the shards, so that replies never mix,
+        # and by rebalancing, so that queries never miss rows being moved
+        self._conn_lock = threading.RLock()
+        log_done(f"Successfully started {self.n_shards} shard worker(s)!")
+
+        super().__init__(chunker, emb_model)
+
+    def _call(self, calls: dict) -> dict:
+        """
+        Call a method on some of the shards, in parallel.
+
+        Args:
+            calls (dict): Maps shard index to a pair of (method, arguments).
+
+        Returns:
+            dict: Maps shard index to the result of its call.
+        """
+        if not self.conns:
+            raise ValueError("Retriever is closed.")
+        with self._conn_lock:
+            for shard, msg in calls.items():
+                self.conns[shard].send(msg)
+            replies = {shard: self.conns[shard].recv() for shard in calls}
+
+        errors = [res for ok, res in replies.values() if not ok]
+        if errors:
+            raise RuntimeError(f"Shard failed:\n{errors[0]}")
+        return {shard: res for shard, (_, res) in replies.items()}
+
+    def _broadcast(self, method: str, *args) -> dict:
+        return self._call({shard: (method, args) for shard in range(self.n_shards)})
+
+    def __getitem__(self, idx: int):
+        """
+        Implemented as part of easier access.
+        Returns the chunk at given index, with all accompanying embeddings
+        and metadata. See `CosSimRetriever.__getitem__`.
+        """
+        if idx >= len(self.chunks):
+            return None
+        return {
+            "chunk": self.chunks[idx],
+            "emb": self._load_emb(idx),
+            "metadata": self.metadata[idx],
+        }
+
+    def __iter__(self):
+        for idx in range(len(self.chunks)):
+            yield self.__getitem__(idx)
+
+    def _add_rows(self, rows: np.ndarray, embs: np.ndarray) -> None:
+        """
+        Add new rows to the shards, filling the smallest ones first.
+        """
+        counts = balanced_counts(self.shard_sizes, len(rows))
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        calls = {}
+        for shard in np.flatnonzero(counts).tolist():
+            lo, hi = bounds[shard], bounds[shard + 1]
+            shard_rows = rows[lo:hi]
+            calls[shard] = (
+                "append",
+                (
+                    shard_rows,
+                    embs[lo:hi],
+                    self.row_corpus[shard_rows],
+                    self.row_doc[shard_rows],
+                ),
+            )
+            self.row_shard[shard_rows] = shard
+        for shard, size in self._call(calls).items():
+            self.shard_sizes[shard] = size
+
+    def _reset_index(self) -> None:
+        super()._reset_index()
+        self.chunks: List[str] = []
+        self.metadata: List[dict] = []
+        self.row_shard = np.empty(0, dtype=np.int64)
+        self.shard_sizes = np.zeros(self.n_shards, dtype=np.int64)
+        if self.conns:
+            self._broadcast("reset")
+        self.epoch += 1
+
+    def _append(
+        self,
+        chunks: List[str],
+        metadata: List[dict],
+        texts: List[str],
+        embs: Union[torch.Tensor, None],
+    ) -> None:
+        super()._append(chunks, metadata, texts, embs)
+        if not metadata:
+            metadata = [{"start_index": -1, "end_index": -1} for _ in chunks]
+        self.chunks.extend(chunks)
+        self.metadata.extend(metadata)
+
+        if embs is not None:
+            n_rows = len(self.unique_members)
+            rows = np.arange(n_rows - len(texts), n_rows)
+            self._arrays["row_shard"].append(np.full(len(texts), -1))
+            self._add_rows(rows, embs.float().numpy())
+        self.epoch += 1
+
+    def _load_index(self, texts: List[str], embs: torch.Tensor) -> None:
+        self.chunks = [texts[row] for row in self.chunk_to_unique.tolist()]
+        self.metadata = [
+            {"start_index": start, "end_index": end}
+            for start, end in zip(self.starts.tolist(), self.ends.tolist())
+        ]
+        self.row_shard = np.full(len(texts), -1, dtype=np.int64)
+        rows = np.flatnonzero(self.row_alive)
+        self._add_rows(rows, embs[torch.from_numpy(rows)].float().numpy())
+        self.epoch += 1
+
+    def _delete_rows(self, rows: np.ndarray) -> None:
+        super()._delete_rows(rows)
+        shards = self.row_shard[rows]
+        calls = {
+            shard: ("delete", (rows[shards == shard],))
+            for shard in np.unique(shards).tolist()
+        }
+        for shard, size in self._call(calls).items():
+            self.shard_sizes[shard] = size
+        self.row_shard[rows] = -1
+
+        mean_size = self.shard_sizes.mean()
+        spread = self.shard_sizes.max() - self.shard_sizes.min()
+        if spread > max(self.max_imbalance * mean_size, 1):
+            self.rebalance()
+        self.epoch += 1
+
+    def rebalance(self) -> None:
+        """
+        Move rows from the largest shards to the smallest ones, until shard
+        sizes differ by at most one row.
+        """
+        with self._write_lock:
+            total = int(self.shard_sizes.sum())
+            targets = balanced_counts(np.zeros(self.n_shards, dtype=np.int64), total)
+            # Largest shards keep the extra rows, so that fewer rows move
+            order = np.argsort(-self.shard_sizes, kind="stable")
+            targets[order] = np.sort(targets)[::-1]
+
+            surplus = self.shard_sizes - targets
+            calls = {
+                shard: ("take", (int(surplus[shard]),))
+                for shard in np.flatnonzero(surplus > 0).tolist()
+            }
+            if not calls:
+                return
+            log_ongoing(f"Rebalancing {int(surplus[surplus > 0].sum())} row(s)...")
+            with self._conn_lock:
+                taken = self._call(calls)
+                for shard in taken:
+                    self.shard_sizes[shard] = targets[shard]
+
+                rows = np.concatenate([res[0] for res in taken.values()])
+                embs = np.concatenate([res[1] for res in taken.values()])
+                self._add_rows(rows, embs)
+            self.epoch += 1
+        log_done(f"Successfully rebalanced shards to {self.shard_sizes.tolist()} rows!")
+
+    def close(self) -> None:
+        super().close()
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for worker in self.workers:
+            worker.join()
+        self.conns = []
+        self.workers = []
+
+    def _prepare_fork(self) -> None:
+        raise ValueError("Sharded retriever runs its own worker processes.")
+
+    def query_spans(
+        self, query: str, k: int = 10, where: Optional[dict] = None
+    ) -> np.ndarray:
+        return self.query_batch([query], k, where=where)[0]
+
+    def query_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+        where: Optional[dict] = None,
+        batch_size: int = 32,
+    ) -> List[np.ndarray]:
+        if not queries:
+            return []
+        query_embs = self.embed(queries, batch_size).reshape(len(queries), -1)
+        return self._query_cached(
+            query_embs,
+            lambda embs: self._search_batch(embs, k, where),
+            k,
+            where=where,
+            epoch=self.epoch,
+        )
+
+    def _search_batch(
+        self, query_embs: np.ndarray, k: int = 10, where: Optional[dict] = None
+    ) -> List[np.ndarray]:
+        """
+        Search for top-k chunks of already embedded queries: scatter them to
+        all the shards, and gather their local top-k rows.
+        """
+        corpus_ids, doc_ids = None, None
+        if where is not None:
+            corpus_ids, doc_ids = self._resolve_where(where)
+        query_embs = np.asarray(query_embs, dtype=np.float32)
+        results = self._broadcast("search", query_embs, k, corpus_ids, doc_ids)
+        shards = list(results)
+
+        all_spans = []
+        for i in range(len(query_embs)):
+            # Local top-k rows are ordered by score, so a k-way merge suffices
+            merged = heapq.merge(
+                *[zip(-results[shard][i][1], results[shard][i][0]) for shard in shards]
+            )
+            top_k = list(itertools.islice(merged, k))
+            rows = np.array([row for _, row in top_k], dtype=np.int64)
+            scores = -np.array([score for score, _ in top_k], dtype=np.float32)
+
+            # Each row has at least one chunk, so K rows always suffice
+            ids, scores = expand_rows(self.unique_members, rows, scores, k)
+            all_spans.append(
+                make_spans(
+                    ids=ids,
+                    scores=scores,
+                    starts=self.starts[ids],
+                    ends=self.ends[ids],
+                    corpus_ids=self.chunk_corpus[ids],
+                    doc_ids=self.chunk_doc[ids],
+                )
+            )
+        return all_spans
+
+    def _load_chunk(self, idx: int) -> str:
+        return self.chunks[idx]
+
+    def _load_emb(self, idx: int) -> torch.Tensor:
+        return self._load_embs([idx])[0]
+
+    def _load_embs(self, ids: List[int]) -> torch.Tensor:
+        rows = self.chunk_to_unique[ids]
+        shards = self.row_shard[rows]
+        if (shards < 0).any():
+            raise ValueError("Cannot load embeddings of deleted chunks.")
+
+        calls = {
+            shard: ("get", (rows[shards == shard],))
+            for shard in np.unique(shards).tolist()
+        }
+        results = self._call(calls)
+        embs = None
+        for shard, shard_embs in results.items():
+            if embs is None:
+                embs = np.empty((len(rows), shard_embs.shape[1]), shard_embs.dtype)
+            embs[shards == shard] = shard_embs
+        if embs is None:
+            return torch.empty(0)
+        return torch.from_numpy(embs)
+
+    def stats(self) -> dict:
+        """
+        Get shard counters.
+
+        Returns:
+            dict: Number of shards, and number of rows of every shard.
+        """
+        log_info(f"Rows per shard: {self.shard_sizes.tolist()}")
+        return {"shards": self.n_shards, "rows": self.shard_sizes.tolist()}
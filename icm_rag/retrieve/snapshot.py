@@ -0,0 +1,378 @@
+import json
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from .projection import Projection
+from .result import make_spans
+
+
+class GrowableArray:
+    """
+    One-dimensional array, kept in a buffer whose capacity doubles when full,
+    so that appending is amortized O(1) per value. Appends only write past
+    the end of the current values, so earlier views (e.g. held by snapshots)
+    never change.
+    """
+
+    def __init__(self, values: np.ndarray):
+        # Given values become the buffer, without a copy
+        self.buffer = np.asarray(values)
+        self.size = len(self.buffer)
+
+    @property
+    def values(self) -> np.ndarray:
+        return self.buffer[: self.size]
+
+    def append(self, values: np.ndarray) -> None:
+        end = self.size + len(values)
+        if end > len(self.buffer):
+            buffer = np.empty(max(end, 2 * len(self.buffer)), self.buffer.dtype)
+            buffer[: self.size] = self.values
+            self.buffer = buffer
+        self.buffer[self.size : end] = values  # noqa: E203
+        self.size = end
+
+
+def growable_array(name: str) -> property:
+    """
+    Property exposing a `GrowableArray`, kept in the `_arrays` dict of the
+    instance, as a plain array. Assigning replaces the array, e.g. once
+    compacted, while `_arrays[name].append` appends to it.
+    """
+
+    def get(self) -> np.ndarray:
+        return self._arrays[name].values
+
+    def set(self, values: np.ndarray) -> None:
+        self._arrays[name] = GrowableArray(values)
+
+    return property(get, set)
+
+
+def resolve_where(
+    where: dict, corpus_names: Dict[str, int]
+) -> Tuple[Union[List[int], None], Union[List[int], None]]:
+    """
+    Resolve filter into lists of allowed corpus and document ids.
+    None means that the column is not filtered on.
+
+    Args:
+        where (dict): Filter, with optional "corpus" (name or list of names)
+            and "doc_id" (id or list of ids) keys.
+        corpus_names (Dict[str, int]): Maps corpus names to their ids.
+
+    Returns:
+        Tuple[Union[List[int], None], Union[List[int], None]]: Allowed
+            corpus ids and document ids.
+    """
+    unknown = set(where) - {"corpus", "doc_id"}
+    if unknown:
+        raise ValueError(f"Invalid filter keys: {sorted(unknown)}")
+
+    corpus_ids = None
+    if "corpus" in where:
+        names = where["corpus"]
+        names = [names] if isinstance(names, str) else names
+        corpus_ids = [corpus_names[name] for name in names if name in corpus_names]
+
+    doc_ids = None
+    if "doc_id" in where:
+        ids = where["doc_id"]
+        doc_ids = [int(ids)] if isinstance(ids, (int, np.integer)) else list(ids)
+
+    return corpus_ids, doc_ids
+
+
+def filter_rows(
+    row_corpus: np.ndarray,
+    row_doc: np.ndarray,
+    row_alive: np.ndarray,
+    corpus_ids: Union[List[int], None],
+    doc_ids: Union[List[int], None],
+) -> Union[slice, np.ndarray]:
+    """
+    Get live rows of allowed corpora and documents. Documents are ingested
+    one at a time, so their rows are contiguous, and are then returned as a
+    slice, i.e. a zero-copy view of the embeddings. Otherwise, row indices
+    are returned.
+
+    Args:
+        row_corpus (np.ndarray): Corpus id of every row.
+        row_doc (np.ndarray): Document id of every row.
+        row_alive (np.ndarray): Mask of rows that were not deleted.
+        corpus_ids (Union[List[int], None]): Allowed corpus ids, or None.
+        doc_ids (Union[List[int], None]): Allowed document ids, or None.
+
+    Returns:
+        Union[slice, np.ndarray]: Contiguous range of rows, or row indices.
+    """
+    mask = row_alive.copy()
+    if corpus_ids is not None:
+        mask &= np.isin(row_corpus, corpus_ids)
+    if doc_ids is not None:
+        mask &= np.isin(row_doc, doc_ids)
+
+    rows = np.flatnonzero(mask)
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+        rows = slice(int(rows[0]), int(rows[-1]) + 1)
+    return rows
+
+
+def expand_rows(
+    unique_members: List[List[int]],
+    rows: np.ndarray,
+    scores: np.ndarray,
+    k: int,
+    n_chunks: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Expand ranked unique rows back to all of their chunks, keeping the
+    ranking, and cut the result to top-k chunks.
+
+    Args:
+        unique_members (List[List[int]]): Chunk ids of every row, ascending.
+        rows (np.ndarray): Unique rows, ordered by score.
+        scores (np.ndarray): Scores of the rows.
+        k (int): Maximum number of chunks to return.
+        n_chunks (Optional[int]): If given, chunk ids from this one on (i.e.
+            added after a snapshot was taken) are skipped.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Chunk ids and their scores.
+    """
+    ids: List[int] = []
+    id_scores: List[float] = []
+    for row, score in zip(rows.tolist(), scores.tolist()):
+        members = unique_members[row]
+        if n_chunks is not None and members[-1] >= n_chunks:
+            members = [idx for idx in members if idx < n_chunks]
+        members = members[: k - len(ids)]
+        ids.extend(members)
+        id_scores.extend([score] * len(members))
+        if len(ids) >= k:
+            break
+    return np.array(ids, dtype=np.int64), np.array(id_scores, dtype=np.float32)
+
+
+def top_k_scores(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Get indices of the k highest scores, ordered by score. Only the top-k
+    are sorted, the rest are partitioned away.
+    """
+    if k < len(scores):
+        top_k = np.argpartition(-scores, k - 1)[:k]
+        return top_k[np.argsort(-scores[top_k], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+
+class CoarseIndex:
+    """
+    Reduced-dimension copy of the embeddings, for two-stage retrieval.
+    It is shared by all the snapshots between two renumberings of the rows
+    (i.e. resets and compactions), and is extended with appended rows.
+    The projection is fitted lazily, on the first query that needs it. A PCA
+    projection is refitted (on all the rows) while it was fitted on fewer
+    than `dim` rows, or once the rows grow past `refit_growth` times as many
+    as it was fitted on, so that it follows the index as it grows.
+    """
+
+    def __init__(self, dim: int, method: str = "pca", refit_growth: float = 2.0):
+        self.dim = dim
+        self.method = method
+        self.refit_growth = refit_growth
+        self.projection: Optional[Projection] = None
+        self.embs: Optional[np.ndarray] = None
+        # Number of rows the projection was fitted on
+        self.n_fit_rows = 0
+        self._lock = threading.Lock()
+
+    def _needs_fit(self, n_rows: int) -> bool:
+        if self.embs is None:
+            return True
+        # Only snapshots newer than the reduced embeddings refit
+        if self.method != "pca" or n_rows <= len(self.embs):
+            return False
+        return (
+            self.n_fit_rows < self.dim or n_rows > self.refit_growth * self.n_fit_rows
+        )
+
+    def get(self, embs: np.ndarray) -> Tuple[Projection, np.ndarray]:
+        """
+        Get fitted projection, and the reduced-dimension copy of given
+        embeddings. Rows appended since the projection was fitted are only
+        projected, unless the projection is due to be refitted.
+
+        Args:
+            embs (np.ndarray): Full embeddings of a snapshot.
+
+        Returns:
+            Tuple[Projection, np.ndarray]: Projection, and the reduced
+                embeddings, of shape (len(embs), dim).
+        """
+        with self._lock:
+            if self._needs_fit(len(embs)):
+                self.projection = Projection(self.dim, self.method).fit(embs)
+                self.embs = self.projection.transform(embs)
+                self.n_fit_rows = len(embs)
+            elif len(self.embs) < len(embs):
+                new_embs = self.projection.transform(
+                    embs[len(self.embs) :]  # noqa: E203
+                )
+                self.embs = np.concatenate([self.embs, new_embs])
+            return self.projection, self.embs[: len(embs)]
+
+    def share_memory(self) -> None:
+        """
+        Move the reduced embeddings into shared memory.
+        """
+        with self._lock:
+            if self.embs is not None:
+                self.embs = torch.from_numpy(self.embs).share_memory_().numpy()
+
+
+class IndexSnapshot:
+    """
+    Immutable, consistent view of a `CosSimRetriever` index, at one epoch.
+    The writer publishes a new snapshot after every change, by replacing a
+    single reference, so readers never block on it, and never observe chunks
+    and embeddings out of sync.
+
+    Snapshots hold views of the writer's arrays, which the writer never
+    modifies in place: appended rows go past the end of every view, and
+    anything else (e.g. deletes, compaction) replaces the arrays.
+    """
+
+    def __init__(
+        self,
+        epoch: int,
+        embs: np.ndarray,
+        norms: np.ndarray,
+        row_corpus: np.ndarray,
+        row_doc: np.ndarray,
+        row_alive: np.ndarray,
+        n_deleted_rows: int,
+        unique_members: List[List[int]],
+        starts: np.ndarray,
+        ends: np.ndarray,
+        chunk_corpus: np.ndarray,
+        chunk_doc: np.ndarray,
+        corpus_names: Dict[str, int],
+        coarse: Optional[CoarseIndex] = None,
+    ):
+        self.epoch = epoch
+        self.embs = embs
+        self.norms = norms
+        self.row_corpus = row_corpus
+        self.row_doc = row_doc
+        self.row_alive = row_alive
+        self.n_deleted_rows = n_deleted_rows
+        self.unique_members = unique_members
+        self.starts = starts
+        self.ends = ends
+        self.chunk_corpus = chunk_corpus
+        self.chunk_doc = chunk_doc
+        self.corpus_names = corpus_names
+        self.coarse = coarse
+        self._filter_cache: Dict[str, Union[slice, np.ndarray]] = {}
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.embs)
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.starts)
+
+    def live_rows(self, where: Optional[dict]) -> Union[slice, np.ndarray, None]:
+        """
+        Get rows passing given (optional) filter, which were not deleted,
+        computed once per filter and snapshot. None means all the rows.
+        """
+        if where is None and self.n_deleted_rows == 0:
+            return None
+        key = json.dumps(where or {}, sort_keys=True, default=str)
+        rows = self._filter_cache.get(key)
+        if rows is None:
+            corpus_ids, doc_ids = resolve_where(where or {}, self.corpus_names)
+            rows = self._filter_cache[key] = filter_rows(
+                self.row_corpus, self.row_doc, self.row_alive, corpus_ids, doc_ids
+            )
+        return rows
+
+    def coarse_index(self) -> Tuple[Projection, np.ndarray]:
+        """
+        Get fitted projection, and the reduced embeddings of the snapshot.
+        """
+        return self.coarse.get(self.embs)
+
+    def search(
+        self,
+        query_emb: np.ndarray,
+        k: int = 10,
+        where: Optional[dict] = None,
+        n_candidates: int = 100,
+    ) -> np.ndarray:
+        """
+        Search for top-k chunks, given an already embedded query.
+        Scoring is a single matrix-vector product against the (pre-computed)
+        row norms, which runs in NumPy, without holding the GIL.
+
+        Args:
+            query_emb (np.ndarray): Query embedding.
+            k (int): Maximum number of chunks to retrieve.
+            where (Optional[dict]): Filter on chunk corpus and / or document.
+            n_candidates (int): Number of coarse candidates to re-rank, if the
+                snapshot has a coarse index.
+
+        Returns:
+            np.ndarray: Spans, as returned by `Retriever.query_spans`.
+        """
+        # Pre-filter rows (including deleted ones), before any scoring
+        rows = self.live_rows(where)
+        embs = self.embs if rows is None else self.embs[rows]
+        norms = self.norms if rows is None else self.norms[rows]
+        if len(embs) == 0:
+            return make_spans([], [], [], [])
+        query_emb = np.asarray(query_emb, dtype=embs.dtype).reshape(-1)
+        query_norm = np.linalg.norm(query_emb)
+
+        if self.coarse is not None and len(embs) > n_candidates:
+            # Coarse stage: score all the (filtered) chunks in reduced space
+            projection, coarse_embs = self.coarse_index()
+            if rows is not None:
+                coarse_embs = coarse_embs[rows]
+            coarse_scores = coarse_embs @ projection.transform(query_emb[None])[0]
+            candidates = np.argpartition(-coarse_scores, n_candidates)[:n_candidates]
+
+            # Fine stage: re-rank only the candidates, with full embeddings
+            embs, norms = embs[candidates], norms[candidates]
+        else:
+            candidates = None
+        scores = (embs @ query_emb) / np.maximum(norms * query_norm, 1e-12)
+
+        # Retrieve Top-K unique rows, and expand them back to their chunks.
+        # Each row has at least one chunk, so K rows always suffice.
+        top_k = top_k_scores(scores, k)
+        scores = scores[top_k]
+        if candidates is not None:
+            top_k = candidates[top_k]
+        if isinstance(rows, slice):
+            top_k = top_k + rows.start
+        elif rows is not None:
+            top_k = rows[top_k]
+        ids, scores = expand_rows(
+            self.unique_members, top_k, scores, k, n_chunks=self.n_chunks
+        )
+
+        # Return ids, scores and offsets only
+        return make_spans(
+            ids=ids,
+            scores=scores,
+            starts=self.starts[ids],
+            ends=self.ends[ids],
+            corpus_ids=self.chunk_corpus[ids],
+            doc_ids=self.chunk_doc[ids],
+        )
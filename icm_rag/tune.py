@@ -0,0 +1,238 @@
+import itertools
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from eval import Evaluation
+from retrieve import IndexKey, IndexRegistry, Retriever
+from utils.data import QuestionSet
+from utils.log import log_done, log_info, log_ongoing
+
+TUNE_METRICS = ["recall", "precision", "f1"]
+
+# Chunk configuration, as (chunk size, chunk overlap)
+ChunkConfig = Tuple[int, int]
+
+
+def sample_configs(
+    chunk_sizes: Sequence[int],
+    chunk_overlaps: Sequence[int],
+    n_configs: Optional[int] = None,
+    seed: int = 0,
+) -> List[ChunkConfig]:
+    """
+    Sample candidate chunk configurations from a grid. Configurations whose
+    overlap is not smaller than their size are skipped.
+
+    Args:
+        chunk_sizes (Sequence[int]): Chunk sizes of the grid.
+        chunk_overlaps (Sequence[int]): Chunk overlaps of the grid.
+        n_configs (Optional[int]): Number of configurations to sample, without
+            replacement. If None, or larger than the grid, the whole grid is
+            returned.
+        seed (int): Random seed.
+
+    Returns:
+        List[ChunkConfig]: Candidate configurations.
+    """
+    grid = [
+        (size, overlap)
+        for size, overlap in itertools.product(chunk_sizes, chunk_overlaps)
+        if 0 <= overlap < size
+    ]
+    if not grid:
+        raise ValueError("No valid chunk configuration in the grid.")
+    if n_configs is None or n_configs >= len(grid):
+        return grid
+
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(grid), size=n_configs, replace=False)
+    return [grid[idx] for idx in sorted(picked.tolist())]
+
+
+class ChunkTuner:
+    """
+    This class implements a chunk configuration tuner, based on successive
+    halving. All the candidates are first scored on a small sample of the
+    questions, and only the best `1 / eta` of them advance to the next rung,
+    which scores them on `eta` times as many questions, until one is left.
+
+    Questions are visited in a single random order, so every rung extends
+    the sample of the previous one: per-question scores are kept, and only
+    the new questions are scored. Indexes come from an `IndexRegistry`, so
+    every candidate is chunked and embedded once (and reloaded, if it was
+    persisted by a past run), and the token streams of the corpora are shared
+    by all the candidates (see `FixedTokenChunker`). Eliminated candidates are
+    evicted right away.
+    """
+
+    def __init__(
+        self,
+        registry: IndexRegistry,
+        base_key: IndexKey,
+        questions: QuestionSet,
+        datasets: Sequence[str],
+        k: int = 10,
+        metric: str = "f1",
+        eta: int = 2,
+        min_questions: int = 32,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            registry (IndexRegistry): Registry building (or loading) the index
+                of every candidate.
+            base_key (IndexKey): Key of the index, whose chunk size and
+                overlap are replaced by those of every candidate.
+            questions (QuestionSet): Questions to score the candidates on.
+            datasets (Sequence[str]): Corpora whose questions are scored.
+            k (int): Number of chunks to retrieve.
+            metric (str): Metric to rank the candidates by: "recall",
+                "precision", or "f1" (their harmonic mean).
+            eta (int): Reduction factor: a rung keeps the best `1 / eta` of
+                the candidates, and the next one scores `eta` times as many
+                questions.
+            min_questions (int): Number of questions of the first rung.
+            seed (int): Random seed of the question order.
+        """
+        if metric not in TUNE_METRICS:
+            raise ValueError(f"Invalid tuning metric selected: {metric}")
+        if eta < 2:
+            raise ValueError(f"Invalid reduction factor: {eta}")
+
+        self.registry = registry
+        self.base_key = base_key
+        self.k = k
+        self.metric = metric
+        self.eta = eta
+        self.min_questions = min_questions
+
+        # Questions of other corpora are never scored
+        self.questions = questions
+        indices = np.flatnonzero(np.isin(questions.corpus_ids, list(datasets)))
+        if len(indices) == 0:
+            raise ValueError(f"No questions for datasets: {list(datasets)}")
+        self.order = np.random.default_rng(seed).permutation(indices)
+
+        self.scores: Dict[ChunkConfig, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def key(self, config: ChunkConfig) -> IndexKey:
+        """
+        Get index key of given configuration.
+        """
+        return self.base_key._replace(chunk_size=config[0], chunk_overlap=config[1])
+
+    def _score_questions(
+        self, ret: Retriever, indices: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score questions at given (ascending) indices, each against its own
+        corpus. Returns per-question recall and precision, in order.
+        """
+        recall = np.zeros(len(indices))
+        precision = np.zeros(len(indices))
+        corpus_ids = self.questions.corpus_ids[indices]
+        for ds in np.unique(corpus_ids).tolist():
+            mask = corpus_ids == ds
+            res = Evaluation(
+                ret, self.questions.take(indices[mask]), where={"corpus": ds}, k=self.k
+            ).eval(["recall", "precision"])
+            recall[mask] = res["recall_scores"]
+            precision[mask] = res["precision_scores"]
+        return recall, precision
+
+    def _evaluate(self, config: ChunkConfig, n_questions: int) -> dict:
+        """
+        Score configuration on the first `n_questions` questions, scoring only
+        those not scored at an earlier rung.
+        """
+        recall, precision = self.scores.get(config, (np.empty(0), np.empty(0)))
+        if len(recall) < n_questions:
+            ret = self.registry.get(self.key(config))
+            new = np.sort(self.order[len(recall) : n_questions])  # noqa: E203
+            new_recall, new_precision = self._score_questions(ret, new)
+            recall = np.concatenate([recall, new_recall])
+            precision = np.concatenate([precision, new_precision])
+            self.scores[config] = (recall, precision)
+
+        mean_recall = float(np.mean(recall[:n_questions]))
+        mean_precision = float(np.mean(precision[:n_questions]))
+        f1 = (
+            2 * mean_recall * mean_precision / (mean_recall + mean_precision)
+            if mean_recall + mean_precision > 0
+            else 0.0
+        )
+        return {
+            "chunk_size": config[0],
+            "chunk_overlap": config[1],
+            "n_questions": n_questions,
+            "recall": mean_recall,
+            "precision": mean_precision,
+            "f1": f1,
+        }
+
+    def run(self, configs: Sequence[ChunkConfig]) -> Tuple[ChunkConfig, pd.DataFrame]:
+        """
+        Run successive halving over given candidates.
+
+        Args:
+            configs (Sequence[ChunkConfig]): Candidate configurations, e.g. as
+                returned by `sample_configs`.
+
+        Returns:
+            Tuple[ChunkConfig, pd.DataFrame]: Best configuration, and the full
+                trade-off table, with one row per candidate and rung (i.e.
+                `rung`, `chunk_size`, `chunk_overlap`, `n_questions`, `recall`,
+                `precision`, `f1` and `advanced` columns).
+        """
+        survivors = list(dict.fromkeys(configs))
+        if not survivors:
+            raise ValueError("No chunk configurations to tune.")
+        n_configs = len(survivors)
+
+        n_total = len(self.order)
+        log_ongoing(
+            f"Tuning {n_configs} chunk configuration(s) on up to "
+            f"{n_total} questions, by {self.metric}..."
+        )
+
+        rows = []
+        rung = 0
+        while True:
+            # The last candidate standing is scored on all the questions
+            n_questions = n_total
+            if len(survivors) > 1:
+                n_questions = min(self.min_questions * self.eta**rung, n_total)
+            results = [self._evaluate(config, n_questions) for config in survivors]
+
+            # Once all the questions are scored, nothing is gained by more rungs
+            n_keep = math.ceil(len(survivors) / self.eta)
+            if n_questions == n_total:
+                n_keep = 1
+            ranking = sorted(
+                range(len(survivors)), key=lambda idx: -results[idx][self.metric]
+            )
+            kept = set(ranking[:n_keep])
+            for idx, res in enumerate(results):
+                rows.append({"rung": rung, **res, "advanced": idx in kept})
+                if idx not in kept:
+                    self.registry.evict(self.key(survivors[idx]))
+
+            log_info(
+                f"Rung {rung}: scored {len(survivors)} configuration(s) on "
+                f"{n_questions} questions, {n_keep} advance(s)."
+            )
+            survivors = [survivors[idx] for idx in ranking[:n_keep]]
+            if n_questions == n_total:
+                break
+            rung += 1
+
+        best = survivors[0]
+        n_scored = sum(len(recall) for recall, _ in self.scores.values())
+        log_done(
+            f"Best configuration: chunk_size={best[0]}, chunk_overlap={best[1]}, "
+            f"scored {n_scored} questions in total "
+            f"({n_scored / (n_configs * n_total):.1%} of the full grid)."
+        )
+        return best, pd.DataFrame(rows)
@@ -1,18 +1,37 @@
-from .data import load_df, preprocess_df
-from .download import download
+from .data import QuestionSet, compile_questions, load_df, load_questions, preprocess_df
+from .download import (
+    corpus_digest,
+    download,
+    download_all,
+    load_checksums,
+    pin_checksums,
+)
 from .log import log_experiment, log_info, set_log_file
 from .parse import parse_args, parse_txt
 from .path import expand_path, make_path
+from .results import ResultsStore
+from .sweep import SweepQueue, expand_sweep, run_worker
 
 __all__ = [
     "parse_args",
     "parse_txt",
     "load_df",
     "preprocess_df",
+    "QuestionSet",
+    "compile_questions",
+    "load_questions",
     "download",
+    "download_all",
+    "load_checksums",
+    "pin_checksums",
+    "corpus_digest",
     "set_log_file",
     "log_info",
     "log_experiment",
     "make_path",
     "expand_path",
+    "ResultsStore",
+    "SweepQueue",
+    "expand_sweep",
+    "run_worker",
 ]
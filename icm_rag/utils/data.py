@@ -1,5 +1,23 @@
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
 import pandas as pd
-from utils.log import log_done, log_ongoing
+import requests  # type: ignore
+from utils.log import log_done, log_ongoing, log_warning
+from utils.path import is_url
+
+QUESTIONS_CACHE_ARRAYS = [
+    "questions",
+    "corpus_ids",
+    "ref_starts",
+    "ref_ends",
+    "ref_offsets",
+]
 
 
 def load_df(df_path: str) -> pd.DataFrame:
@@ -37,3 +55,299 @@ def preprocess_df(df: pd.DataFrame, dataset: str) -> pd.DataFrame:
     log_done(f"Successfully preprocessed DataFrame!")
 
     return df
+
+
+class QuestionSet:
+    """
+    Columnar view over a compiled questions cache.
+    Questions are sorted by corpus, so every corpus occupies a contiguous
+    range of rows. References of question `i` are stored flat, in
+    `ref_starts[ref_offsets[i] : ref_offsets[i + 1]]` (likewise `ref_ends`).
+    All arrays may be memory-mapped; filtering only slices them.
+    """
+
+    def __init__(
+        self,
+        questions: np.ndarray,
+        corpus_ids: np.ndarray,
+        ref_starts: np.ndarray,
+        ref_ends: np.ndarray,
+        ref_offsets: np.ndarray,
+        source_hash: str = "",
+    ):
+        self.questions = questions
+        self.corpus_ids = corpus_ids
+        self.ref_starts = ref_starts
+        self.ref_ends = ref_ends
+        self.ref_offsets = ref_offsets
+        self.source_hash = source_hash
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def references(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get reference spans of the question at given index.
+
+        Args:
+            idx (int): Index of the question.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Starting and ending indices of the
+                question's references.
+        """
+        lo, hi = self.ref_offsets[idx], self.ref_offsets[idx + 1]
+        return self.ref_starts[lo:hi], self.ref_ends[lo:hi]
+
+    def filter(self, dataset: str) -> "QuestionSet":
+        """
+        Keep only the questions of given corpus. Since questions are sorted by
+        corpus, this is a contiguous slice, and no data is copied.
+
+        Args:
+            dataset (str): Corpus to keep, e.g. "wikitexts".
+
+        Returns:
+            QuestionSet: Questions of given corpus.
+        """
+        lo = int(np.searchsorted(self.corpus_ids, dataset, side="left"))
+        hi = int(np.searchsorted(self.corpus_ids, dataset, side="right"))
+        return QuestionSet(
+            questions=self.questions[lo:hi],
+            corpus_ids=self.corpus_ids[lo:hi],
+            ref_starts=self.ref_starts,
+            ref_ends=self.ref_ends,
+            ref_offsets=self.ref_offsets[lo : hi + 1],  # noqa: E203
+            source_hash=self.source_hash,
+        )
+
+    def take(self, indices: np.ndarray) -> "QuestionSet":
+        """
+        Keep only the questions at given indices, in order. Their references
+        are gathered into new flat arrays. Indices should be ascending, so
+        that questions stay sorted by corpus.
+
+        Args:
+            indices (np.ndarray): Indices of the questions to keep.
+
+        Returns:
+            QuestionSet: Questions at given indices.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        lo = np.asarray(self.ref_offsets[indices], dtype=np.int64)
+        n_refs = self.ref_offsets[indices + 1] - lo
+        ref_offsets = np.concatenate([[0], np.cumsum(n_refs)]).astype(np.int64)
+
+        # Position of every kept reference, within the original flat arrays
+        refs = np.repeat(lo - ref_offsets[:-1], n_refs) + np.arange(ref_offsets[-1])
+        return QuestionSet(
+            questions=self.questions[indices],
+            corpus_ids=self.corpus_ids[indices],
+            ref_starts=self.ref_starts[refs],
+            ref_ends=self.ref_ends[refs],
+            ref_offsets=ref_offsets,
+            source_hash=self.source_hash,
+        )
+
+
+def _hash_bytes(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+# Response headers identifying a version of a remote source
+VALIDATOR_HEADERS = {"ETag": "If-None-Match", "Last-Modified": "If-Modified-Since"}
+
+
+def _read_source(
+    df_path: str, validators: Optional[Dict[str, str]] = None
+) -> Tuple[Optional[bytes], Dict[str, str]]:
+    """
+    Read raw bytes of the questions CSV, from local path or URL.
+    Remote sources are requested conditionally, if `validators` (i.e. ETag
+    and / or Last-Modified of an earlier response) are given.
+
+    Returns:
+        Tuple[Optional[bytes], Dict[str, str]]: Raw bytes, or None, if the
+            remote source did not change, and validators of the response.
+    """
+    if is_url(df_path):
+        headers = {
+            VALIDATOR_HEADERS[name]: value
+            for name, value in (validators or {}).items()
+            if name in VALIDATOR_HEADERS
+        }
+        response = requests.get(df_path, headers=headers, timeout=30)
+        if response.status_code == 304:
+            return None, dict(validators or {})
+        response.raise_for_status()
+        return response.content, {
+            name: response.headers[name]
+            for name in VALIDATOR_HEADERS
+            if name in response.headers
+        }
+
+    with open(df_path, "rb") as file:
+        return file.read(), {}
+
+
+def questions_cache_path(df_path: str, cache_dir: Union[Path, str]) -> Path:
+    """
+    Get the directory of the compiled questions cache, for given source.
+
+    Args:
+        df_path (str): Path to the questions CSV. Can be URL.
+        cache_dir (Union[Path, str]): Root caching directory.
+
+    Returns:
+        Path: Directory holding the compiled cache of `df_path`.
+    """
+    key = hashlib.sha256(str(df_path).encode("utf-8")).hexdigest()[:16]
+    return Path(cache_dir) / "questions" / key
+
+
+def _read_meta(cache_path: Path) -> Optional[dict]:
+    meta_path = cache_path / "meta.json"
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _write_meta(cache_path: Path, meta: dict) -> None:
+    with open(cache_path / "meta.json", "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+
+
+def _revalidate(
+    df_path: str, cache_path: Path, meta: dict
+) -> Tuple[bool, Optional[bytes], Dict[str, str]]:
+    """
+    Check whether the cache still matches its source. Remote sources are
+    revalidated with a conditional request, and are trusted as cached if
+    unreachable, so that compiled questions remain usable offline.
+
+    Returns:
+        Tuple[bool, Optional[bytes], Dict[str, str]]: Whether the cache is
+            valid, raw bytes of the source, if they had to be read, and their
+            validators.
+    """
+    validators = meta.get("validators", {})
+    try:
+        raw, validators = _read_source(df_path, validators)
+    except requests.RequestException as e:
+        log_warning(f"Could not revalidate questions at {df_path}: {e!r}")
+        return True, None, validators
+
+    if raw is None:
+        return True, None, validators
+    if _hash_bytes(raw) != meta["source_hash"]:
+        return False, raw, validators
+
+    # Unchanged content, served anew, e.g. by a server ignoring validators
+    if validators != meta.get("validators", {}):
+        _write_meta(cache_path, {**meta, "validators": validators})
+    return True, raw, validators
+
+
+def compile_questions(
+    df_path: str, cache_dir: Union[Path, str], force: bool = False
+) -> Path:
+    """
+    Compile questions CSV into a columnar cache of `.npy` arrays.
+    References are parsed only once, here, and are stored as flat start / end
+    arrays with per-question offsets. The hash of the source CSV is stored
+    alongside, and is used for cache invalidation. For remote sources, ETag
+    and Last-Modified of the response are stored as well, and every load
+    revalidates the cache with a conditional request.
+
+    Args:
+        df_path (str): Path to the questions CSV. Can be URL.
+        cache_dir (Union[Path, str]): Root caching directory.
+        force (bool): If True, recompile even if a valid cache exists.
+
+    Returns:
+        Path: Directory holding the compiled cache.
+    """
+    cache_path = questions_cache_path(df_path, cache_dir)
+    raw, validators = None, {}
+    meta = _read_meta(cache_path)
+    if not force and meta is not None:
+        valid, raw, validators = _revalidate(df_path, cache_path, meta)
+        if valid:
+            return cache_path
+
+    log_ongoing(f"Compiling questions cache for: {df_path}")
+    if raw is None:
+        raw, validators = _read_source(df_path)
+    df = pd.read_csv(io.BytesIO(raw))
+    df = df.sort_values("corpus_id", kind="stable")
+
+    ref_starts = []
+    ref_ends = []
+    ref_offsets = [0]
+    for references in df["references"]:
+        for ref in json.loads(references):
+            ref_starts.append(int(ref["start_index"]))
+            ref_ends.append(int(ref["end_index"]))
+        ref_offsets.append(len(ref_starts))
+
+    arrays = {
+        "questions": df["question"].to_numpy(dtype=str),
+        "corpus_ids": df["corpus_id"].to_numpy(dtype=str),
+        "ref_starts": np.array(ref_starts, dtype=np.int64),
+        "ref_ends": np.array(ref_ends, dtype=np.int64),
+        "ref_offsets": np.array(ref_offsets, dtype=np.int64),
+    }
+
+    os.makedirs(cache_path, exist_ok=True)
+    for name in QUESTIONS_CACHE_ARRAYS:
+        np.save(cache_path / f"{name}.npy", arrays[name])
+
+    # Written last, so that only complete caches are ever considered valid
+    _write_meta(
+        cache_path,
+        {
+            "source": str(df_path),
+            "source_hash": _hash_bytes(raw),
+            "validators": validators,
+        },
+    )
+
+    log_done(f"Successfully compiled {len(df)} questions to: {cache_path}")
+    return cache_path
+
+
+def load_questions(
+    df_path: str,
+    cache_dir: Union[Path, str],
+    dataset: Optional[str] = None,
+    force: bool = False,
+) -> QuestionSet:
+    """
+    Load questions from the columnar cache, compiling it first if needed.
+
+    Args:
+        df_path (str): Path to the questions CSV. Can be URL.
+        cache_dir (Union[Path, str]): Root caching directory.
+        dataset (Optional[str]): If given, keep only questions of this corpus.
+        force (bool): If True, recompile the cache.
+
+    Returns:
+        QuestionSet: Memory-mapped questions, optionally filtered by corpus.
+    """
+    cache_path = compile_questions(df_path, cache_dir, force=force)
+
+    log_ongoing(f"Loading questions cache at: {cache_path}")
+    with open(cache_path / "meta.json", "r", encoding="utf-8") as file:
+        meta = json.load(file)
+
+    arrays = {
+        name: np.load(cache_path / f"{name}.npy", mmap_mode="r")
+        for name in QUESTIONS_CACHE_ARRAYS
+    }
+    questions = QuestionSet(**arrays, source_hash=meta["source_hash"])
+    if dataset is not None:
+        questions = questions.filter(dataset)
+    log_done(f"Successfully loaded {len(questions)} questions!")
+
+    return questions
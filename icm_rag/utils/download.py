@@ -1,11 +1,139 @@
+#!/usr/bin/env python3
+
+import hashlib
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Union
+from typing import Dict, List, Optional, Union
 from urllib.parse import urljoin, urlparse
 
 import requests  # type: ignore
-from utils.log import log_error, log_info
-from utils.path import is_url
+from requests.adapters import HTTPAdapter  # type: ignore
+from utils.log import log_done, log_info, log_ongoing, log_warning
+from utils.path import expand_path, is_url, make_path
+
+DOWNLOAD_CHUNK_SIZE = 1 << 16  # 64 KiB per streamed chunk
+
+
+def make_session(pool_size: int = 8, max_retries: int = 3) -> requests.Session:
+    """
+    Create HTTP session with a connection pool, shared between downloads.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections per host.
+        max_retries (int): Number of retries on connection errors.
+
+    Returns:
+        requests.Session: Session to use for downloads.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=max_retries,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def load_checksums(manifest_path: Union[Path, str, None]) -> Dict[str, str]:
+    """
+    Load checksum manifest, in `sha256sum` format, i.e. one "<sha256> <file>"
+    pair per line.
+
+    Args:
+        manifest_path (Union[Path, str, None]): Path to the manifest.
+
+    Returns:
+        Dict[str, str]: Mapping of file name to its expected SHA-256 digest.
+            Empty, if no manifest is given, or it does not exist yet.
+    """
+    if not manifest_path or not os.path.exists(expand_path(manifest_path)):
+        return {}
+
+    checksums = {}
+    with open(expand_path(manifest_path), "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            digest, file_name = line.split(maxsplit=1)
+            checksums[os.path.basename(file_name.lstrip("*"))] = digest.lower()
+    return checksums
+
+
+def pin_checksums(
+    manifest_path: Union[Path, str, None], paths: Dict[str, Union[Path, None]]
+) -> Dict[str, str]:
+    """
+    Add digests of downloaded files missing from the manifest, so that they
+    are verified from then on (trust on first use). Digests already in the
+    manifest are kept as they are.
+
+    Args:
+        manifest_path (Union[Path, str, None]): Path to the manifest. If None,
+            nothing is pinned.
+        paths (Dict[str, Union[Path, None]]): Local path of each dataset, or
+            None, if its download failed, as returned by `download_all`.
+
+    Returns:
+        Dict[str, str]: Updated mapping of file name to SHA-256 digest.
+    """
+    checksums = load_checksums(manifest_path)
+    if not manifest_path:
+        return checksums
+
+    new = {
+        os.path.basename(path): _sha256(Path(path))
+        for path in paths.values()
+        if path is not None and os.path.basename(path) not in checksums
+    }
+    if new:
+        checksums.update(new)
+        manifest_path = expand_path(manifest_path)
+        os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+        with open(manifest_path, "w", encoding="utf-8") as file:
+            for file_name, digest in sorted(checksums.items()):
+                file.write(f"{digest}  {file_name}\n")
+        log_info(f"Pinned checksums of {len(new)} file(s) in: {manifest_path}")
+    return checksums
+
+
+def corpus_digest(
+    paths: Dict[str, Union[Path, None]], checksums: Optional[Dict[str, str]] = None
+) -> str:
+    """
+    Get content identity of given corpora, i.e. a hash of the SHA-256 digest
+    of every file, so that changed corpora get a new one.
+
+    Args:
+        paths (Dict[str, Union[Path, None]]): Local path of each dataset, as
+            returned by `download_all`.
+        checksums (Optional[Dict[str, str]]): Known (i.e. verified) digests of
+            files, by file name, as returned by `pin_checksums`. Files missing
+            from it are hashed.
+
+    Returns:
+        str: Hexadecimal SHA-256 digest.
+    """
+    checksums = checksums or {}
+    digest = hashlib.sha256()
+    for dataset, path in sorted(paths.items()):
+        if path is None:
+            raise ValueError(f"Corpus of {dataset} was not downloaded.")
+        file_digest = checksums.get(os.path.basename(path)) or _sha256(Path(path))
+        digest.update(f"{dataset} {file_digest}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _sha256(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 def download(
@@ -13,17 +141,30 @@ def download(
     local_dir: Path,
     dataset: str,
     force_download: bool = False,  # noqa: E501
+    session: Optional[requests.Session] = None,
+    checksums: Optional[Dict[str, str]] = None,
 ) -> Union[Path, None]:
     """
     Download file, given the base url and dataset.
     Is used for corpus downlaod.
     If GitHub link is provided, it must be in RAW format.
 
+    The body is streamed, in chunks, to a temporary `.part` file, which is
+    atomically moved to its final path once complete. If a `.part` file is
+    left over from an interrupted download, it is resumed via Range request.
+    Network errors keep the `.part` file, so that the next attempt resumes it.
+    Files with a known digest are verified, including previously downloaded
+    ones, which are downloaded again on mismatch.
+
     Args:
         base_url (str): Base URL to search for the dataset.
         locaL_dir (Path): Path to local dir, to download the dataset.
         dataset (str): Name of the dataset, e.g. "wikitexts".
         force_download (bool): If True, override downloaded corpus at path.
+        session (Optional[requests.Session]): Session to download with.
+            If None, a new one is created.
+        checksums (Optional[Dict[str, str]]): Mapping of file name to expected
+            SHA-256 digest. Files not present in mapping are not verified.
 
     Returns:
         Union[Path, None]: If successfully downloaded, return the local path
@@ -39,19 +180,113 @@ def download(
         return None
 
     file_name = os.path.basename(urlparse(url).path)
-    local_path = local_dir / file_name
+    local_path = Path(local_dir) / file_name
+    part_path = local_path.with_name(file_name + ".part")
+    expected = (checksums or {}).get(file_name)
 
     if os.path.exists(local_path) and not force_download:
-        return local_path
+        if expected is None or _sha256(local_path) == expected.lower():
+            return local_path
+        log_warning(f"Checksum mismatch for {file_name}, downloading it again.")
+        os.remove(local_path)
+
+    if force_download and os.path.exists(part_path):
+        os.remove(part_path)
+
+    session = session if session is not None else make_session()
+
+    # Resume from partially downloaded file, if any
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
 
     log_info("Downloading from url: " + url)
-    response = requests.get(url)
-    if response.status_code == 200:
-        response = requests.get(url)
-        with open(local_path, "wb") as file:
-            file.write(response.content)
-        log_info("Download complete.")
-        return local_path
-    else:
-        log_error(f"Failed to download file: {response.status_code}")
+    try:
+        with session.get(url, headers=headers, stream=True, timeout=30) as response:
+            if response.status_code == 416:
+                # Requested range is past the end, i.e. `.part` is complete
+                pass
+            elif response.status_code in (200, 206):
+                # Server may ignore the Range header, in which case, start over
+                mode = "ab" if response.status_code == 206 else "wb"
+                with open(part_path, mode) as file:
+                    for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(block)
+            else:
+                log_warning(f"Failed to download file: {response.status_code}")
+                return None
+    except requests.RequestException as e:
+        log_warning(f"Failed to download {file_name}, kept partial file: {e!r}")
         return None
+
+    if expected is not None and _sha256(part_path) != expected.lower():
+        log_warning(f"Checksum mismatch for {file_name}, discarding download.")
+        os.remove(part_path)
+        return None
+
+    os.replace(part_path, local_path)
+    log_info("Download complete.")
+    return local_path
+
+
+def download_all(
+    base_url: str,
+    local_dir: Path,
+    datasets: List[str],
+    force_download: bool = False,
+    checksums: Optional[Dict[str, str]] = None,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Union[Path, None]]:
+    """
+    Download multiple datasets concurrently, over a single pooled session.
+
+    Args:
+        base_url (str): Base URL to search for the datasets.
+        local_dir (Path): Path to local dir, to download the datasets.
+        datasets (List[str]): Names of the datasets, e.g. ["wikitexts"].
+        force_download (bool): If True, override downloaded corpora at path.
+        checksums (Optional[Dict[str, str]]): Mapping of file name to expected
+            SHA-256 digest.
+        max_workers (Optional[int]): Number of concurrent downloads.
+            Defaults to the number of datasets.
+
+    Returns:
+        Dict[str, Union[Path, None]]: Local path of each dataset, or None, if
+            its download failed.
+    """
+    max_workers = max_workers or max(len(datasets), 1)
+    session = make_session(pool_size=max_workers)
+
+    log_ongoing(f"Downloading {len(datasets)} dataset(s)...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            dataset: executor.submit(
+                download,
+                base_url=base_url,
+                local_dir=local_dir,
+                dataset=dataset,
+                force_download=force_download,
+                session=session,
+                checksums=checksums,
+            )
+            for dataset in datasets
+        }
+        paths = {dataset: future.result() for dataset, future in futures.items()}
+    session.close()
+    log_done("Finished downloading datasets!")
+
+    return paths
+
+
+if __name__ == "__main__":
+    # Prefetch corpora, e.g.: ./download.py "$DATASET_DIR" wikitexts chatlogs
+    local_dir = make_path(sys.argv[1])
+    manifest_path = os.getenv("DEFAULT__CORPORA_CHECKSUMS_PATH")
+    paths = download_all(
+        base_url=os.getenv("DEFAULT__CORPORA_GITHUB_RAW_URL", ""),
+        local_dir=local_dir,
+        datasets=sys.argv[2:],
+        checksums=load_checksums(manifest_path),
+    )
+    pin_checksums(manifest_path, paths)
+    if any(path is None for path in paths.values()):
+        sys.exit(1)
@@ -43,10 +43,17 @@ def parse_args():
         help="Path to questions DataFrame.",
         default=os.getenv("DEFAULT__QUESTIONS_DF_PATH"),
     )
+    parser.add_argument(
+        "--recompile_questions",
+        action="store_true",
+        help="Recompile questions cache, even if its source did not change.",
+    )
     parser.add_argument(
         "--dataset",
         type=str,
+        nargs="+",
         choices=["chatlogs", "state_of_the_union", "wikitexts"],
+        help="Dataset(s) to evaluate on. Multiple corpora share a single index.",
         required=True,
     )
     parser.add_argument(
@@ -55,6 +62,13 @@ def parse_args():
         help="Path to caching directory.",
         default=os.getenv("DEFAULT__CACHE_DIR"),
     )
+    parser.add_argument(
+        "--index_dir",
+        type=str,
+        help="Path to persisted indexes. If set, the index is loaded from here, "
+        "or built and saved, if missing.",
+        default=None,
+    )
     parser.add_argument(
         "--data_dir",
         type=str,
@@ -73,14 +87,32 @@ def parse_args():
         help="Path to log file.",
         default=None,
     )
+    parser.add_argument(
+        "--results_db",
+        type=str,
+        help="Path to SQLite results store.",
+        default=os.getenv("DEFAULT__RESULTS_DB_PATH"),
+    )
+    parser.add_argument(
+        "--results_shared",
+        action="store_true",
+        help="Results store is on a shared filesystem, written by many hosts.",
+    )
 
     parser.add_argument(
         "--ret_type",
         type=str,
-        choices=["cos_sim", "chromadb"],
+        choices=["cos_sim", "chromadb", "sharded"],
         help="Type of vector database to use.",
         default="chromadb",
     )
+    parser.add_argument(
+        "--chunker",
+        type=str,
+        choices=["fixed_token", "recursive_token"],
+        help="Chunker to use for document chunking.",
+        default="fixed_token",
+    )
     parser.add_argument(
         "--chunk_size",
         type=int,
@@ -109,6 +141,195 @@ def parse_args():
         default=16,
         help="Batch size for chunk embedding.",
     )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Chunk, generate metadata, embed and index chunks concurrently.",
+    )
+    parser.add_argument(
+        "--late_chunking",
+        action="store_true",
+        help="Encode each document once, and pool chunk embeddings from its "
+        "token embeddings.",
+    )
+    parser.add_argument(
+        "--rerank_model",
+        type=str,
+        help="Cross-encoder to re-rank retrieved candidates with. If not set, "
+        "no re-ranking is done.",
+        default=None,
+    )
+    parser.add_argument(
+        "--rerank_candidates",
+        type=int,
+        help="Maximum number of candidates re-ranked per question.",
+        default=50,
+    )
+    parser.add_argument(
+        "--rerank_budget_ms",
+        type=float,
+        help="Re-ranking latency budget per question, capping the candidates.",
+        default=None,
+    )
+    parser.add_argument(
+        "--rerank_batch_size",
+        type=int,
+        help="Number of query / chunk pairs scored at once.",
+        default=64,
+    )
+    parser.add_argument(
+        "--ci_width",
+        type=float,
+        help="If set, evaluate sequentially, with questions in random order, "
+        "until confidence intervals are narrower than this width.",
+        default=None,
+    )
+    parser.add_argument(
+        "--baseline_recall",
+        type=float,
+        help="Stop sequential evaluation once recall is clearly below this value.",
+        default=None,
+    )
+    parser.add_argument(
+        "--baseline_precision",
+        type=float,
+        help="Stop sequential evaluation once precision is clearly below this "
+        "value.",
+        default=None,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of pre-forked workers, sharing the model and index (cos_sim).",
+        default=1,
+    )
+    parser.add_argument(
+        "--n_shards",
+        type=int,
+        help="Number of shard worker processes (sharded). Defaults to CPU count.",
+        default=None,
+    )
+    parser.add_argument(
+        "--coarse_dim",
+        type=int,
+        help="Dimension of coarse scoring, for two-stage retrieval (cos_sim).",
+        default=None,
+    )
+    parser.add_argument(
+        "--projection",
+        type=str,
+        choices=["pca", "truncate"],
+        help="Projection used for coarse scoring.",
+        default="pca",
+    )
+    parser.add_argument(
+        "--n_candidates",
+        type=int,
+        help="Number of coarse candidates re-ranked with full embeddings.",
+        default=100,
+    )
+    parser.add_argument(
+        "--two_stage_report",
+        type=str,
+        help="Path to save recall@k vs. speed report of two-stage retrieval.",
+        default=None,
+    )
+    parser.add_argument(
+        "--concurrency_report",
+        type=str,
+        help="Path to save query throughput report during ingestion.",
+        default=None,
+    )
+    parser.add_argument(
+        "--query_cache_report",
+        type=str,
+        help="Path to save hit rate vs. quality report of semantic query cache.",
+        default=None,
+    )
+    parser.add_argument(
+        "--tune_configs",
+        type=int,
+        help="If set, tune chunk size and overlap by successive halving, over this "
+        "many configurations sampled from the tuning grid, instead of evaluating "
+        "the given ones.",
+        default=None,
+    )
+    parser.add_argument(
+        "--tune_chunk_sizes",
+        type=int,
+        nargs="+",
+        help="Chunk sizes of the tuning grid.",
+        default=[100, 200, 400, 800, 1500],
+    )
+    parser.add_argument(
+        "--tune_chunk_overlaps",
+        type=int,
+        nargs="+",
+        help="Chunk overlaps of the tuning grid.",
+        default=[0, 50, 100, 200, 500],
+    )
+    parser.add_argument(
+        "--tune_metric",
+        type=str,
+        choices=["recall", "precision", "f1"],
+        help="Metric to rank chunk configurations by, when tuning.",
+        default="f1",
+    )
+    parser.add_argument(
+        "--tune_min_questions",
+        type=int,
+        help="Number of questions of the first successive halving rung.",
+        default=32,
+    )
+    parser.add_argument(
+        "--tune_report",
+        type=str,
+        help="Path to save chunk configuration tuning report.",
+        default=None,
+    )
+    parser.add_argument(
+        "--load_mode",
+        type=str,
+        choices=["closed", "open"],
+        help="If set, run load tests of given mode, and log them to the results "
+        "store.",
+        default=None,
+    )
+    parser.add_argument(
+        "--load_concurrency",
+        type=int,
+        nargs="+",
+        help="Numbers of concurrent clients of closed-loop load tests. The largest "
+        "one caps the queries in flight of open-loop load tests.",
+        default=[1, 4, 8],
+    )
+    parser.add_argument(
+        "--load_rate",
+        type=float,
+        nargs="+",
+        help="Arrival rates (queries per second) of open-loop load tests.",
+        default=[],
+    )
+    parser.add_argument(
+        "--load_k",
+        type=int,
+        nargs="+",
+        help="Values of k to load test. Defaults to `k`.",
+        default=None,
+    )
+    parser.add_argument(
+        "--load_duration",
+        type=float,
+        help="Duration of every load test, in seconds.",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--load_synthetic",
+        type=int,
+        help="If set, load test with this many synthetic questions, sampled from "
+        "the indexed chunks, instead of the dataset questions.",
+        default=None,
+    )
     parser.add_argument(
         "--k", type=int, default=10, help="Retrieve top-k chunks."
     )  # noqa: E501
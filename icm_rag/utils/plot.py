@@ -1,38 +1,79 @@
 #!/usr/bin/env python3
 
+import hashlib
+import json
 import os
 import sys
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
 
+import matplotlib
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 from utils.log import log_info
 from utils.path import expand_path
+from utils.results import METRIC_COLUMNS, ResultsStore
+
+RESULTS_DB_SUFFIXES = (".db", ".sqlite", ".sqlite3")
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
 
-def recall_vs_precision(key: str, key2: str = None, path: str = "", save_to: str = ""):
-    log_info(f"Generating recall vs precision plot for key {key} and key2 {key2}")
+def _load_source(path: str) -> pd.DataFrame:
+    """
+    Load experiment results, with one row per configuration (or run).
+    Results stores are read from the pre-aggregated `config_metrics` view,
+    while CSV logs are read as-is, with each row counting as a single run.
+
+    Args:
+        path (str): Path to the CSV log or SQLite results store.
+
+    Returns:
+        pd.DataFrame: Experiment results, with metric and `n_runs` columns.
+    """
+    if str(path).endswith(RESULTS_DB_SUFFIXES):
+        with ResultsStore(path) as store:
+            return store.config_metrics()
 
     df = pd.read_csv(path)
+    df["n_runs"] = 1
+    return df
 
-    group_keys = [key] if key2 is None else [key, key2]
 
-    # Group by key(s) and compute mean/std
-    agg_df = (
-        df.groupby(group_keys)
-        .agg(
-            {
-                "recall": "mean",
-                "recall_std": "mean",
-                "precision": "mean",
-                "precision_std": "mean",
-            }
-        )
-        .reset_index()
-    )
+def _aggregate(
+    df: pd.DataFrame, group_keys: List[str], filters: Optional[Dict] = None
+) -> pd.DataFrame:
+    """
+    Filter results and compute mean of every metric, by given key(s).
+    Means are weighted by `n_runs`, so pre-aggregated rows give the same
+    result as the underlying runs.
+
+    Args:
+        df (pd.DataFrame): Experiment results, as given by `_load_source`.
+        group_keys (List[str]): Columns to group by.
+        filters (Optional[Dict]): Equality filters, e.g. {"dataset": "chatlogs"}.
+
+    Returns:
+        pd.DataFrame: One row per group, with mean of every metric column.
+    """
+    for col, value in (filters or {}).items():
+        df = df[df[col] == value]
+
+    weighted = df[METRIC_COLUMNS].mul(df["n_runs"], axis=0)
+    weighted[group_keys] = df[group_keys]
+    weighted["n_runs"] = df["n_runs"]
+
+    agg_df = weighted.groupby(group_keys).sum()
+    agg_df[METRIC_COLUMNS] = agg_df[METRIC_COLUMNS].div(agg_df["n_runs"], axis=0)
+    return agg_df.reset_index()
+
+
+def _plot_recall_vs_precision(
+    agg_df: pd.DataFrame, key: str, key2: str = None, save_to: str = ""
+) -> None:
+    group_keys = [key] if key2 is None else [key, key2]
 
     # Melt value metrics
     plot_df = pd.melt(
@@ -56,7 +97,7 @@ def recall_vs_precision(key: str, key2: str = None, path: str = "", save_to: str
     y_max = plot_df["upper"].max()
     y_lim = max(1.0, y_max + 0.05)
 
-    plt.figure(figsize=(10, 6))
+    fig = plt.figure(figsize=(10, 6))
 
     if key2 is None:
         sns.barplot(
@@ -81,34 +122,18 @@ def recall_vs_precision(key: str, key2: str = None, path: str = "", save_to: str
         )
         plt.xlabel(f"{key} | {key2}")
 
-    # Add error bars manually
+    # Add all error bars in one call. Bars are laid out per hue, i.e. all
+    # recall bars first, then all precision bars, same as rows of `plot_df`.
     ax = plt.gca()
-    group_size = len(plot_df) // 2  # Because we have recall and precision per group
-    for i in range(group_size):
-        recall_row = plot_df.iloc[i * 2]
-        precision_row = plot_df.iloc[i * 2 + 1]
-
-        # Get the corresponding bar for recall and precision
-        recall_bar = ax.patches[i * 2]  # First bar is recall
-        precision_bar = ax.patches[i * 2 + 1]  # Second bar is precision
-
-        # Add error bars
-        ax.errorbar(
-            recall_bar.get_x() + recall_bar.get_width() / 2,
-            recall_bar.get_height(),
-            yerr=recall_row["std"],
-            fmt="none",
-            c="black",
-            capsize=5,
-        )
-        ax.errorbar(
-            precision_bar.get_x() + precision_bar.get_width() / 2,
-            precision_bar.get_height(),
-            yerr=precision_row["std"],
-            fmt="none",
-            c="black",
-            capsize=5,
-        )
+    bars = ax.patches[: len(plot_df)]
+    ax.errorbar(
+        [bar.get_x() + bar.get_width() / 2 for bar in bars],
+        [bar.get_height() for bar in bars],
+        yerr=plot_df["std"].to_numpy(),
+        fmt="none",
+        c="black",
+        capsize=5,
+    )
 
     plt.title("Recall vs. Precision")
     plt.ylabel("Score")
@@ -119,10 +144,123 @@ def recall_vs_precision(key: str, key2: str = None, path: str = "", save_to: str
     if save_to:
         log_info(f"Saving figure to: {save_to}")
         plt.savefig(save_to, dpi=300)
+        plt.close(fig)
     else:
         plt.show()
 
 
+def recall_vs_precision(key: str, key2: str = None, path: str = "", save_to: str = ""):
+    log_info(f"Generating recall vs precision plot for key {key} and key2 {key2}")
+
+    group_keys = [key] if key2 is None else [key, key2]
+
+    if str(path).endswith(RESULTS_DB_SUFFIXES):
+        # Aggregation is pushed into the results store
+        with ResultsStore(path) as store:
+            agg_df = store.aggregate(group_keys)
+    else:
+        agg_df = _aggregate(_load_source(path), group_keys)
+
+    _plot_recall_vs_precision(agg_df, key, key2=key2, save_to=save_to)
+
+
+def _init_worker() -> None:
+    matplotlib.use("Agg")
+
+
+def _render_job(job: dict) -> str:
+    _plot_recall_vs_precision(
+        job["agg_df"], job["key"], key2=job["key2"], save_to=job["save_to"]
+    )
+    return job["save_to"]
+
+
+def _fingerprint(agg_df: pd.DataFrame, plot: dict) -> str:
+    digest = hashlib.sha256(json.dumps(plot, sort_keys=True).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(agg_df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def recall_vs_precision_batch(
+    spec: dict, workers: Optional[int] = None, force: bool = False
+) -> List[str]:
+    """
+    Render many recall vs precision plots, in parallel, using the
+    non-interactive Agg backend.
+    Every source is loaded once, and is shared by all the plots using it.
+    Plots whose aggregated inputs have not changed since the last render are
+    skipped; fingerprints are kept in a `<save_to>.sha256` file next to each
+    figure.
+
+    Args:
+        spec (dict): Plot specification, in format:
+            {
+                "source": <default path to CSV log or results store>,
+                "plots": [
+                    {
+                        "key": <str>,
+                        "key2": <Optional[str]>,
+                        "filter": <Optional[dict]>,
+                        "source": <Optional[str], overrides default>,
+                        "save_to": <str>,
+                    },
+                    ...
+                ],
+            }
+        workers (Optional[int]): Number of rendering processes.
+            Defaults to the number of CPUs.
+        force (bool): If True, render all plots, even if unchanged.
+
+    Returns:
+        List[str]: Paths of (re-)rendered figures.
+    """
+    matplotlib.use("Agg")
+
+    sources: Dict[str, pd.DataFrame] = {}
+    jobs = []
+    for plot in spec["plots"]:
+        source = str(expand_path(plot.get("source", spec.get("source", ""))))
+        if source not in sources:
+            sources[source] = _load_source(source)
+
+        key, key2 = plot["key"], plot.get("key2")
+        group_keys = [key] if key2 is None else [key, key2]
+        agg_df = _aggregate(sources[source], group_keys, plot.get("filter"))
+
+        save_to = str(expand_path(plot["save_to"]))
+        fingerprint = _fingerprint(agg_df, {**plot, "source": source})
+        fingerprint_path = save_to + ".sha256"
+        if not force and os.path.exists(save_to) and os.path.exists(fingerprint_path):
+            with open(fingerprint_path, "r") as file:
+                if file.read().strip() == fingerprint:
+                    log_info(f"Skipping unchanged figure: {save_to}")
+                    continue
+
+        jobs.append(
+            {
+                "agg_df": agg_df,
+                "key": key,
+                "key2": key2,
+                "save_to": save_to,
+                "fingerprint": fingerprint,
+            }
+        )
+
+    if not jobs:
+        return []
+
+    log_info(f"Rendering {len(jobs)} figure(s)...")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        rendered = list(pool.map(_render_job, jobs))
+
+    # Fingerprints are written only after the figures are successfully saved
+    for job in jobs:
+        with open(job["save_to"] + ".sha256", "w") as file:
+            file.write(job["fingerprint"])
+
+    return rendered
+
+
 if __name__ == "__main__":
     FUNC = os.environ.get("FUNC")
     if FUNC == "recall_vs_precision":
@@ -141,3 +279,12 @@ if __name__ == "__main__":
                 path=expand_path(sys.argv[2]),
                 save_to=expand_path(sys.argv[3]),
             )
+    if FUNC == "recall_vs_precision_batch":
+        # Usage: FUNC=recall_vs_precision_batch ./plot.py <spec.json> [workers]
+        with open(expand_path(sys.argv[1]), "r") as file:
+            spec = json.load(file)
+        recall_vs_precision_batch(
+            spec,
+            workers=int(sys.argv[2]) if len(sys.argv) > 2 else None,
+            force=os.environ.get("FORCE") == "1",
+        )
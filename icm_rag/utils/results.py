@@ -0,0 +1,421 @@
+import csv
+import json
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+from utils.log import log_done, log_ongoing
+from utils.path import expand_path
+
+# Columns identifying an experiment configuration. Any other setup entry
+# (except for the experiment name) is stored in the JSON `params` column.
+CONFIG_DEFAULTS = {
+    "dataset": "",
+    "chunker": "",
+    "chunk_size": -1,
+    "chunk_overlap": -1,
+    "ret_type": "",
+    "k": -1,
+    "emb_model": "",
+}
+CONFIG_COLUMNS = list(CONFIG_DEFAULTS)
+METRIC_COLUMNS = ["recall", "recall_std", "precision", "precision_std"]
+LOAD_COLUMNS = [
+    "mode",
+    "concurrency",
+    "rate",
+    "duration",
+    "n_queries",
+    "n_errors",
+    "n_dropped",
+    "qps",
+    "mean_ms",
+    "p50_ms",
+    "p95_ms",
+    "p99_ms",
+    "max_ms",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    config_id INTEGER PRIMARY KEY,
+    dataset TEXT NOT NULL DEFAULT '',
+    chunker TEXT NOT NULL DEFAULT '',
+    chunk_size INTEGER NOT NULL DEFAULT -1,
+    chunk_overlap INTEGER NOT NULL DEFAULT -1,
+    ret_type TEXT NOT NULL DEFAULT '',
+    k INTEGER NOT NULL DEFAULT -1,
+    emb_model TEXT NOT NULL DEFAULT '',
+    params TEXT NOT NULL DEFAULT '{}',
+    UNIQUE (
+        dataset, chunker, chunk_size, chunk_overlap, ret_type, k, emb_model, params
+    )
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    config_id INTEGER NOT NULL REFERENCES configs (config_id),
+    exp_name TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    n_questions INTEGER,
+    recall REAL,
+    recall_std REAL,
+    precision REAL,
+    precision_std REAL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    question_idx INTEGER NOT NULL,
+    recall REAL,
+    precision REAL,
+    PRIMARY KEY (run_id, question_idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run_id, stage)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS load_tests (
+    load_id INTEGER PRIMARY KEY,
+    config_id INTEGER NOT NULL REFERENCES configs (config_id),
+    exp_name TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    mode TEXT NOT NULL,
+    concurrency INTEGER,
+    rate REAL,
+    duration REAL,
+    n_queries INTEGER,
+    n_errors INTEGER,
+    n_dropped INTEGER,
+    qps REAL,
+    mean_ms REAL,
+    p50_ms REAL,
+    p95_ms REAL,
+    p99_ms REAL,
+    max_ms REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_configs_dataset ON configs (dataset);
+CREATE INDEX IF NOT EXISTS idx_runs_config ON runs (config_id);
+CREATE INDEX IF NOT EXISTS idx_timings_stage ON timings (stage);
+CREATE INDEX IF NOT EXISTS idx_load_tests_config ON load_tests (config_id);
+
+-- Run-level metrics, joined with their configuration
+CREATE VIEW IF NOT EXISTS run_metrics AS
+SELECT
+    r.run_id, r.exp_name, r.created_at, r.n_questions,
+    c.dataset, c.chunker, c.chunk_size, c.chunk_overlap, c.ret_type, c.k,
+    c.emb_model, c.params,
+    r.recall, r.recall_std, r.precision, r.precision_std
+FROM runs AS r JOIN configs AS c USING (config_id);
+
+-- Metrics aggregated over all runs of the same configuration
+CREATE VIEW IF NOT EXISTS config_metrics AS
+SELECT
+    c.config_id, c.dataset, c.chunker, c.chunk_size, c.chunk_overlap,
+    c.ret_type, c.k, c.emb_model, c.params,
+    COUNT(r.run_id) AS n_runs,
+    AVG(r.recall) AS recall, AVG(r.recall_std) AS recall_std,
+    AVG(r.precision) AS precision, AVG(r.precision_std) AS precision_std
+FROM configs AS c JOIN runs AS r USING (config_id)
+GROUP BY c.config_id;
+
+-- Mean duration of every stage, per configuration
+CREATE VIEW IF NOT EXISTS stage_timings AS
+SELECT r.config_id, t.stage, COUNT(*) AS n_runs, AVG(t.seconds) AS seconds
+FROM timings AS t JOIN runs AS r USING (run_id)
+GROUP BY r.config_id, t.stage;
+
+-- Load test results, joined with their configuration
+CREATE VIEW IF NOT EXISTS load_metrics AS
+SELECT
+    l.load_id, l.exp_name, l.created_at,
+    c.dataset, c.chunker, c.chunk_size, c.chunk_overlap, c.ret_type, c.k,
+    c.emb_model, c.params,
+    l.mode, l.concurrency, l.rate, l.duration,
+    l.n_queries, l.n_errors, l.n_dropped, l.qps,
+    l.mean_ms, l.p50_ms, l.p95_ms, l.p99_ms, l.max_ms
+FROM load_tests AS l JOIN configs AS c USING (config_id);
+"""
+
+# Run entry, as (setup, results, stage timings)
+RunEntry = Tuple[dict, dict, Optional[Dict[str, float]]]
+
+
+class ResultsStore:
+    """
+    This class implements an SQLite-backed store of experiment results.
+    Keeps configurations, runs, per-question scores, stage timings and load
+    tests in separate, indexed tables. Aggregations are computed in SQL, over the
+    `run_metrics` and `config_metrics` views.
+
+    A store written by many hosts at once (e.g. by sweep workers) must be
+    opened as `shared`: the rollback journal is then used instead of WAL,
+    which requires shared memory, which network filesystems do not provide.
+    """
+
+    def __init__(
+        self, db_path: Union[Path, str], shared: bool = False, timeout: float = 60.0
+    ):
+        """
+        Args:
+            db_path (Union[Path, str]): Path to the SQLite database.
+            shared (bool): If True, the database is on a shared filesystem,
+                written by processes of multiple hosts.
+            timeout (float): Time to wait for locks of other writers, in
+                seconds.
+        """
+        self.db_path = expand_path(db_path)
+        self.conn = sqlite3.connect(self.db_path, timeout=timeout)
+        self.conn.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _config_id(self, setup: dict) -> int:
+        """
+        Get id of the configuration described by `setup`, inserting it first,
+        if not present.
+        """
+        row = {col: setup.get(col, CONFIG_DEFAULTS[col]) for col in CONFIG_COLUMNS}
+        params = {
+            key: value
+            for key, value in setup.items()
+            if key not in CONFIG_COLUMNS and key != "exp_name"
+        }
+        row["params"] = json.dumps(params, sort_keys=True, default=str)
+
+        cols = ", ".join(row)
+        marks = ", ".join("?" for _ in row)
+        self.conn.execute(
+            f"INSERT OR IGNORE INTO configs ({cols}) VALUES ({marks})",
+            list(row.values()),
+        )
+
+        where = " AND ".join(f"{col} = ?" for col in row)
+        cur = self.conn.execute(
+            f"SELECT config_id FROM configs WHERE {where}", list(row.values())
+        )
+        return cur.fetchone()[0]
+
+    def log_runs(self, entries: Iterable[RunEntry]) -> List[int]:
+        """
+        Log multiple runs within a single transaction.
+        Per-question scores and stage timings are inserted in batches.
+
+        Args:
+            entries (Iterable[RunEntry]): Runs, each given as tuple of
+                (1) setup (dict): Experiment setup, as for `log_experiment`.
+                (2) res (dict): Experiment results, optionally including
+                    per-question `recall_scores` and `precision_scores`, and
+                    `question_idx` of the scores, if not all in order.
+                (3) timings (Optional[Dict[str, float]]): Duration of each
+                    pipeline stage, in seconds.
+
+        Returns:
+            List[int]: Ids of inserted runs.
+        """
+        run_ids = []
+        with self.conn:
+            for setup, res, timings in entries:
+                recall_scores = res.get("recall_scores") or []
+                precision_scores = res.get("precision_scores") or []
+                n_questions = max(len(recall_scores), len(precision_scores))
+
+                # Sequential evaluation scores only a (shuffled) subset
+                question_idx = res.get("question_idx") or range(n_questions)
+
+                cur = self.conn.execute(
+                    "INSERT INTO runs (config_id, exp_name, n_questions, "
+                    "recall, recall_std, precision, precision_std) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        self._config_id(setup),
+                        setup.get("exp_name", ""),
+                        n_questions or res.get("n_questions"),
+                        *[res.get(col) for col in METRIC_COLUMNS],
+                    ],
+                )
+                run_id = cur.lastrowid
+                run_ids.append(run_id)
+
+                self.conn.executemany(
+                    "INSERT INTO scores (run_id, question_idx, recall, precision) "
+                    "VALUES (?, ?, ?, ?)",
+                    (
+                        (
+                            run_id,
+                            int(idx),
+                            _at(recall_scores, pos),
+                            _at(precision_scores, pos),
+                        )
+                        for pos, idx in enumerate(question_idx)
+                    ),
+                )
+                self.conn.executemany(
+                    "INSERT INTO timings (run_id, stage, seconds) VALUES (?, ?, ?)",
+                    ((run_id, stage, secs) for stage, secs in (timings or {}).items()),
+                )
+        return run_ids
+
+    def log_run(
+        self, setup: dict, res: dict, timings: Optional[Dict[str, float]] = None
+    ) -> int:
+        """
+        Log a single run. See `log_runs`.
+        """
+        return self.log_runs([(setup, res, timings)])[0]
+
+    def log_load_tests(self, setup: dict, results: Iterable[dict]) -> List[int]:
+        """
+        Log results of load tests of a single configuration, within a single
+        transaction.
+
+        Args:
+            setup (dict): Experiment setup, as for `log_run`.
+            results (Iterable[dict]): Result of every load test, as returned by
+                `LoadGenerator.run`.
+
+        Returns:
+            List[int]: Ids of inserted load tests.
+        """
+        cols = ", ".join(["config_id", "exp_name", *LOAD_COLUMNS])
+        marks = ", ".join("?" for _ in range(len(LOAD_COLUMNS) + 2))
+        load_ids = []
+        with self.conn:
+            config_id = self._config_id(setup)
+            for result in results:
+                cur = self.conn.execute(
+                    f"INSERT INTO load_tests ({cols}) VALUES ({marks})",
+                    [
+                        config_id,
+                        setup.get("exp_name", ""),
+                        *[result.get(col) for col in LOAD_COLUMNS],
+                    ],
+                )
+                load_ids.append(cur.lastrowid)
+        return load_ids
+
+    def load_metrics(self) -> pd.DataFrame:
+        """
+        Get load test results, joined with their configuration, from
+        `load_metrics`.
+
+        Returns:
+            pd.DataFrame: One row per load test, with throughput and latency
+                percentiles.
+        """
+        return pd.read_sql_query(
+            "SELECT * FROM load_metrics ORDER BY load_id", self.conn
+        )
+
+    def import_csv(self, csv_path: Union[Path, str]) -> List[int]:
+        """
+        Import experiments logged by `log_experiment` into the store.
+        CSV logs only hold run-level metrics, so no per-question scores are
+        imported.
+
+        Args:
+            csv_path (Union[Path, str]): Path to the CSV experiment log.
+
+        Returns:
+            List[int]: Ids of imported runs.
+        """
+        log_ongoing(f"Importing experiments from: {csv_path}")
+        with open(expand_path(csv_path), "r", newline="") as file:
+            rows = list(csv.DictReader(file))
+
+        entries = []
+        for row in rows:
+            setup = {
+                key: _parse_value(row[key]) for key in row if key not in METRIC_COLUMNS
+            }
+            res = {key: _parse_value(row[key]) for key in METRIC_COLUMNS}
+            entries.append((setup, res, None))
+
+        run_ids = self.log_runs(entries)
+        log_done(f"Successfully imported {len(run_ids)} experiments!")
+        return run_ids
+
+    def aggregate(
+        self,
+        group_keys: List[str],
+        filters: Optional[Dict[str, Union[str, int]]] = None,
+    ) -> pd.DataFrame:
+        """
+        Aggregate run metrics by given configuration keys, in SQL.
+
+        Args:
+            group_keys (List[str]): Configuration columns to group by.
+            filters (Optional[Dict[str, Union[str, int]]]): Equality filters on
+                configuration columns, e.g. {"dataset": "wikitexts"}.
+
+        Returns:
+            pd.DataFrame: One row per group, with mean of every metric column
+                and the number of aggregated runs.
+        """
+        filters = filters or {}
+        for col in [*group_keys, *filters]:
+            if col not in CONFIG_COLUMNS:
+                raise ValueError(f"Invalid configuration column: {col}")
+
+        keys = ", ".join(group_keys)
+        metrics = ", ".join(f"AVG({col}) AS {col}" for col in METRIC_COLUMNS)
+        where = " AND ".join(f"{col} = ?" for col in filters) or "1"
+
+        return pd.read_sql_query(
+            f"SELECT {keys}, {metrics}, COUNT(*) AS n_runs FROM run_metrics "
+            f"WHERE {where} GROUP BY {keys} ORDER BY {keys}",
+            self.conn,
+            params=list(filters.values()),
+        )
+
+    def config_metrics(self) -> pd.DataFrame:
+        """
+        Get metrics pre-aggregated per configuration, from `config_metrics`.
+
+        Returns:
+            pd.DataFrame: One row per configuration, with mean of every metric
+                column and the number of aggregated runs (`n_runs`).
+        """
+        return pd.read_sql_query("SELECT * FROM config_metrics", self.conn)
+
+    def scores(self, run_id: int) -> pd.DataFrame:
+        """
+        Get per-question scores of a single run.
+
+        Args:
+            run_id (int): Id of the run.
+
+        Returns:
+            pd.DataFrame: Per-question recall and precision.
+        """
+        return pd.read_sql_query(
+            "SELECT question_idx, recall, precision FROM scores "
+            "WHERE run_id = ? ORDER BY question_idx",
+            self.conn,
+            params=[run_id],
+        )
+
+
+def _at(values: list, idx: int):
+    return float(values[idx]) if idx < len(values) else None
+
+
+def _parse_value(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return None if value == "N/A" else value
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from utils.log import log_done, log_info, log_ongoing, log_warning
+from utils.path import expand_path
+
+SRC_ROOT = Path(__file__).resolve().parents[1]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    sweep TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    returncode INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, job_id);
+"""
+
+JOB_STATUSES = ["queued", "running", "done", "failed"]
+
+
+class SweepQueue:
+    """
+    This class implements a durable queue of experiment jobs, kept in an
+    SQLite database on a (shared) filesystem.
+    Workers claim jobs with time-limited leases, which they keep renewing
+    while the job runs. Jobs whose lease expires (i.e. whose worker died) are
+    requeued, up to `max_attempts` times.
+
+    All state changes run in `BEGIN IMMEDIATE` transactions, so that claims
+    are atomic across processes and hosts. The rollback journal is used
+    instead of WAL, since WAL requires shared memory, which network
+    filesystems do not provide.
+    """
+
+    def __init__(self, db_path: Union[Path, str], lease_seconds: float = 300.0):
+        self.db_path = expand_path(db_path)
+        self.lease_seconds = lease_seconds
+        self.conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # Write lock is taken upfront, so that no two workers read the same
+        # queued job before either of them claims it
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def submit(
+        self, configs: List[dict], sweep: str = "default", max_attempts: int = 3
+    ) -> List[int]:
+        """
+        Put experiment configurations into the queue.
+
+        Args:
+            configs (List[dict]): Arguments of `main.py`, one dict per job,
+                e.g. {"dataset": "wikitexts", "chunk_size": 400}.
+            sweep (str): Name of the sweep the jobs belong to.
+            max_attempts (int): Maximum number of times a job is run.
+
+        Returns:
+            List[int]: Ids of submitted jobs.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            job_ids = [
+                conn.execute(
+                    "INSERT INTO jobs (sweep, args, max_attempts, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [sweep, json.dumps(config), max_attempts, now],
+                ).lastrowid
+                for config in configs
+            ]
+        log_info(f"Submitted {len(job_ids)} job(s) to sweep: {sweep}")
+        return job_ids
+
+    def _requeue_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < max_attempts "
+            "THEN 'queued' ELSE 'failed' END, worker = NULL, lease_until = NULL, "
+            "error = 'lease expired' "
+            "WHERE status = 'running' AND lease_until < ?",
+            [now],
+        )
+
+    def requeue_expired(self) -> None:
+        """
+        Requeue jobs whose lease has expired, i.e. whose worker died.
+        Jobs out of attempts are marked as failed.
+        """
+        with self._transaction() as conn:
+            self._requeue_expired(conn, time.time())
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """
+        Claim the oldest queued job, leasing it for `lease_seconds`.
+        Expired leases are requeued first.
+
+        Args:
+            worker (str): Id of the claiming worker.
+
+        Returns:
+            Optional[dict]: Claimed job, with `job_id`, `sweep`, `args` and
+                `attempts` keys, or None, if no job is queued.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._requeue_expired(conn, now)
+            row = conn.execute(
+                "SELECT job_id, sweep, args, attempts FROM jobs "
+                "WHERE status = 'queued' ORDER BY job_id LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, "
+                    "lease_until = ?, started_at = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ?",
+                    [worker, now + self.lease_seconds, now, row["job_id"]],
+                )
+
+        if row is None:
+            return None
+        return {
+            "job_id": row["job_id"],
+            "sweep": row["sweep"],
+            "args": json.loads(row["args"]),
+            "attempts": row["attempts"] + 1,
+        }
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """
+        Renew the lease of a running job.
+
+        Returns:
+            bool: True, if the job is still leased by `worker`. False, if the
+                lease was lost, e.g. the job was requeued after it expired.
+        """
+        cur = self.conn.execute(
+            "UPDATE jobs SET lease_until = ? "
+            "WHERE job_id = ? AND worker = ? AND status = 'running'",
+            [time.time() + self.lease_seconds, job_id, worker],
+        )
+        return cur.rowcount == 1
+
+    def complete(
+        self, job_id: int, worker: str, returncode: int, error: str = ""
+    ) -> None:
+        """
+        Record the outcome of a job. Failed jobs are requeued, unless out of
+        attempts. Outcomes of jobs no longer leased by `worker` are ignored.
+        """
+        status = "done" if returncode == 0 else "failed"
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN ? = 'failed' "
+                "AND attempts < max_attempts THEN 'queued' ELSE ? END, "
+                "worker = NULL, lease_until = NULL, finished_at = ?, "
+                "returncode = ?, error = ? "
+                "WHERE job_id = ? AND worker = ? AND status = 'running'",
+                [status, status, time.time(), returncode, error, job_id, worker],
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Get number of jobs in each status.
+        """
+        counts = {status: 0 for status in JOB_STATUSES}
+        for row in self.conn.execute(
+            "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+        ):
+            counts[row["status"]] = row["n"]
+        return counts
+
+
+def expand_sweep(spec: dict) -> List[dict]:
+    """
+    Expand sweep specification into a list of job configurations.
+
+    Args:
+        spec (dict): Sweep specification, in format:
+            {
+                "sweep": <str>,
+                "common": <dict of arguments shared by all jobs>,
+                "grid": <dict of argument name to list of values>,
+                "jobs": <Optional[List[dict]], explicit extra jobs>,
+            }
+            Every combination of `grid` values is a job. Jobs without an
+            `exp_name` are named `<sweep>_<idx>`.
+
+    Returns:
+        List[dict]: Arguments of each job.
+    """
+    sweep = spec.get("sweep", "default")
+    common = spec.get("common", {})
+    grid = spec.get("grid", {})
+
+    configs = []
+    if grid:
+        keys = list(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            configs.append({**common, **dict(zip(keys, values))})
+    configs.extend({**common, **job} for job in spec.get("jobs", []))
+
+    for idx, config in enumerate(configs):
+        config.setdefault("exp_name", f"{sweep}_{idx}")
+    return configs
+
+
+def to_cmdline(args: dict) -> List[str]:
+    """
+    Convert job arguments into `main.py` command-line arguments.
+    Environment variables in values are expanded on the worker's host.
+    """
+    cmdline = []
+    for key, value in args.items():
+        if value is None or value is False:
+            continue
+        cmdline.append(f"--{key}")
+        if value is True:
+            continue
+        values = value if isinstance(value, list) else [value]
+        cmdline.extend(os.path.expandvars(str(v)) for v in values)
+    return cmdline
+
+
+def run_worker(
+    db_path: Union[Path, str],
+    worker: Optional[str] = None,
+    lease_seconds: float = 300.0,
+    poll_seconds: float = 5.0,
+    script: Union[Path, str] = SRC_ROOT / "main.py",
+) -> int:
+    """
+    Run sweep jobs until the queue is drained.
+    Each job runs `main.py` in a subprocess, and its lease is renewed every
+    third of `lease_seconds` while it runs. Results are recorded by `main.py`
+    itself, e.g. via `results_db` job argument. Such a results store is
+    shared by all the workers, so it is opened with `results_shared`.
+
+    Args:
+        db_path (Union[Path, str]): Path to the sweep queue database.
+        worker (Optional[str]): Id of the worker. Defaults to `<host>:<pid>`.
+        lease_seconds (float): Duration of job leases.
+        poll_seconds (float): Waiting time, while jobs of dead workers may
+            still be requeued.
+        script (Union[Path, str]): Script run by every job.
+
+    Returns:
+        int: Number of jobs run by this worker.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    n_jobs = 0
+
+    with SweepQueue(db_path, lease_seconds=lease_seconds) as queue:
+        while True:
+            job = queue.claim(worker)
+            if job is None:
+                # Running jobs may still be requeued, if their worker died
+                if queue.counts()["running"] == 0:
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            log_ongoing(
+                f"[{worker}] Running job {job['job_id']} "
+                f"(attempt {job['attempts']}): {job['args']}"
+            )
+            returncode, error = _run_job(queue, job, worker, lease_seconds, script)
+            if returncode is None:
+                log_warning(f"[{worker}] Lost lease of job {job['job_id']}")
+                continue
+
+            queue.complete(job["job_id"], worker, returncode, error)
+            n_jobs += 1
+            if returncode == 0:
+                log_done(f"[{worker}] Finished job {job['job_id']}")
+            else:
+                log_warning(f"[{worker}] Job {job['job_id']} failed: {error}")
+
+    log_done(f"[{worker}] Sweep queue drained, after running {n_jobs} job(s).")
+    return n_jobs
+
+
+def _run_job(
+    queue: SweepQueue,
+    job: dict,
+    worker: str,
+    lease_seconds: float,
+    script: Union[Path, str] = SRC_ROOT / "main.py",
+) -> Tuple[Optional[int], str]:
+    """
+    Run a single job, renewing its lease while it runs.
+    If the lease is lost, the job is killed, since it has been handed to
+    another worker.
+
+    Returns:
+        Tuple[Optional[int], str]: Return code (None, if the lease was lost)
+            and the tail of stderr, if the job failed.
+    """
+    args = dict(job["args"])
+    if args.get("results_db") is not None:
+        args.setdefault("results_shared", True)
+    cmd = [sys.executable, str(script), *to_cmdline(args)]
+
+    # stderr goes to a file, rather than a pipe, which would fill up with
+    # progress bars and block the job
+    with tempfile.TemporaryFile("w+") as stderr:
+        proc = subprocess.Popen(cmd, cwd=SRC_ROOT, stderr=stderr, text=True)
+        while True:
+            try:
+                returncode = proc.wait(timeout=lease_seconds / 3)
+                break
+            except subprocess.TimeoutExpired:
+                if not queue.heartbeat(job["job_id"], worker):
+                    proc.kill()
+                    proc.wait()
+                    return None, ""
+
+        # Only the tail of stderr is kept, e.g. the traceback
+        error = ""
+        if returncode != 0:
+            stderr.seek(0)
+            error = stderr.read()[-2000:]
+    return returncode, error
+
+
+def run_local_workers(db_path: Union[Path, str], processes: int, **kwargs) -> None:
+    """
+    Run multiple workers on this host, each in its own process.
+    """
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(db_path,), kwargs=kwargs)
+        for _ in range(processes)
+    ]
+    for proc in workers:
+        proc.start()
+    for proc in workers:
+        proc.join()
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   ./sweep.py submit <spec.json>
+    #   ./sweep.py worker [--processes N]
+    #   ./sweep.py status
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db",
+        type=str,
+        help="Path to the sweep queue database, on a shared filesystem.",
+        default=os.getenv("DEFAULT__SWEEP_DB_PATH"),
+    )
+    parser.add_argument("--lease_seconds", type=float, default=300.0)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit")
+    submit_parser.add_argument("spec", type=str)
+    submit_parser.add_argument("--max_attempts", type=int, default=3)
+
+    worker_parser = subparsers.add_parser("worker")
+    worker_parser.add_argument("--processes", type=int, default=1)
+    worker_parser.add_argument("--poll_seconds", type=float, default=5.0)
+
+    subparsers.add_parser("status")
+
+    args = parser.parse_args()
+    if args.db is None:
+        raise ValueError("Sweep queue database path is not set.")
+
+    if args.command == "submit":
+        with open(expand_path(args.spec), "r") as file:
+            spec = json.load(file)
+        with SweepQueue(args.db, lease_seconds=args.lease_seconds) as queue:
+            queue.submit(
+                expand_sweep(spec),
+                sweep=spec.get("sweep", "default"),
+                max_attempts=args.max_attempts,
+            )
+    elif args.command == "worker":
+        run_local_workers(
+            args.db,
+            args.processes,
+            lease_seconds=args.lease_seconds,
+            poll_seconds=args.poll_seconds,
+        )
+    elif args.command == "status":
+        with SweepQueue(args.db, lease_seconds=args.lease_seconds) as queue:
+            queue.requeue_expired()
+            for status, count in queue.counts().items():
+                log_info(f"{status}: {count}")
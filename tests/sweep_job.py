@@ -0,0 +1,30 @@
+"""
+Stand-in for `main.py` in sweep tests: logs a single run with the given
+setup into the results store, after failing once, if asked to.
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "icm_rag"))
+
+from utils.results import ResultsStore  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exp_name", type=str)
+    parser.add_argument("--chunk_size", type=int)
+    parser.add_argument("--results_db", type=str)
+    parser.add_argument("--results_shared", action="store_true")
+    parser.add_argument("--fail_once", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.fail_once is not None and not os.path.exists(args.fail_once):
+        open(args.fail_once, "w").close()
+        sys.exit("Failing on purpose, once.")
+
+    setup = {"exp_name": args.exp_name, "chunk_size": args.chunk_size}
+    with ResultsStore(args.results_db, shared=args.results_shared) as store:
+        store.log_run(setup, {"recall": 1.0, "precision": 1.0})
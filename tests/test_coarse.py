@@ -0,0 +1,58 @@
+import numpy as np
+from retrieve import Retriever
+from test_concurrency import _StubModel
+
+RNG = np.random.default_rng(0)
+CHUNKS = [
+    " ".join(f"w{word}" for word in RNG.integers(0, 300, 8)) + f" id{idx}"
+    for idx in range(510)
+]
+
+
+def _retriever(**kwargs):
+    return Retriever.from_kwargs(
+        type="cos_sim", chunker=None, emb_model=_StubModel(), **kwargs
+    )
+
+
+def _agreement(ret, exact, n=100):
+    """
+    Number of the first `n` chunks, queried by their own embedding, whose
+    top-1 matches the one of (single-stage) `exact`.
+    """
+    embs = exact.snapshot.embs
+    return sum(
+        ret._search(embs[idx], 1)["id"][0] == exact._search(embs[idx], 1)["id"][0]
+        for idx in range(n)
+    )
+
+
+def test_projection_is_refitted_as_index_grows():
+    exact = _retriever()
+    exact.add_chunks(CHUNKS, corpus="c")
+    fresh = _retriever(coarse_dim=8, n_candidates=5)
+    fresh.add_chunks(CHUNKS, corpus="c")
+
+    # Fitted on fewer rows than dimensions, then the index grows 51 times
+    ret = _retriever(coarse_dim=8, n_candidates=5)
+    ret.add_chunks(CHUNKS[:10], corpus="c")
+    ret._coarse_index()
+    assert ret.snapshot.coarse.n_fit_rows == 10
+    ret.add_chunks(CHUNKS[10:], corpus="c")
+
+    assert _agreement(ret, exact) == _agreement(fresh, exact)
+    assert ret.snapshot.coarse.n_fit_rows == len(CHUNKS)
+    projection, coarse_embs = ret._coarse_index()
+    assert np.allclose(coarse_embs, projection.transform(ret.snapshot.embs), atol=1e-5)
+
+
+def test_projection_is_kept_while_index_grows_little():
+    ret = _retriever(coarse_dim=8, n_candidates=5)
+    ret.add_chunks(CHUNKS[:300], corpus="c")
+    projection, _ = ret._coarse_index()
+    ret.add_chunks(CHUNKS[300:], corpus="c")
+
+    new_projection, coarse_embs = ret._coarse_index()
+    assert new_projection is projection
+    assert ret.snapshot.coarse.n_fit_rows == 300
+    assert len(coarse_embs) == len(CHUNKS)
@@ -0,0 +1,146 @@
+"""
+Stress test of concurrent querying, while a single writer keeps adding and
+deleting documents. Can also be run as a script, to report query throughput
+per number of query threads:
+
+    PYTHONPATH=icm_rag python tests/test_concurrency.py
+"""
+
+import threading
+import time
+import zlib
+
+import numpy as np
+import pytest
+import torch
+from retrieve import Retriever
+
+DIM = 16
+N_DOCS = 150
+CHUNKS_PER_DOC = 32
+KEEP_DOCS = 4
+
+
+class _StubModel:
+    """
+    Deterministic hashing encoder: every word adds one to a fixed dimension.
+    """
+
+    def encode(self, chunks, batch_size=32, convert_to_tensor=False, **kwargs):
+        texts = [chunks] if isinstance(chunks, str) else chunks
+        embs = np.full((len(texts), DIM), 1e-3, dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.split():
+                embs[row, zlib.crc32(word.encode()) % DIM] += 1.0
+        embs = embs[0] if isinstance(chunks, str) else embs
+        return torch.from_numpy(embs) if convert_to_tensor else embs
+
+
+def _document(doc_id):
+    """
+    Chunks of a document, with offsets that encode the document they belong
+    to, i.e. `start_index // 1000 == doc_id`.
+    """
+    chunks = [
+        f"doc{doc_id} part{idx} w{(doc_id + idx) % 7}" for idx in range(CHUNKS_PER_DOC)
+    ]
+    metadata = [
+        {
+            "start_index": doc_id * 1000 + idx * 10,
+            "end_index": doc_id * 1000 + idx * 10 + 9,
+        }
+        for idx in range(CHUNKS_PER_DOC)
+    ]
+    return chunks, metadata
+
+
+def _corpus(doc_id):
+    return f"c{doc_id % 3}"
+
+
+def run_stress(n_threads, k=5):
+    """
+    Query from `n_threads` threads while a writer adds `N_DOCS` documents,
+    and deletes all but the latest `KEEP_DOCS` (so compactions run as well).
+    Every returned span is checked against the snapshot it was served from.
+
+    Returns:
+        Tuple[int, float, int]: Number of queries, their throughput (queries
+            per second) and the number of snapshots published meanwhile.
+    """
+    ret = Retriever.from_kwargs(type="cos_sim", chunker=None, emb_model=_StubModel())
+    ret.add_chunks(*_document(0), corpus=_corpus(0), doc_id=0)
+    query_embs = ret.embed([f"w{idx % 7} part{idx}" for idx in range(64)], 32)
+    done = threading.Event()
+    errors = []
+    counts = [0] * n_threads
+
+    def write():
+        try:
+            for doc_id in range(1, N_DOCS):
+                chunks, metadata = _document(doc_id)
+                ret.add_chunks(chunks, metadata, corpus=_corpus(doc_id), doc_id=doc_id)
+                old_id = doc_id - KEEP_DOCS
+                if old_id >= 0:
+                    ret.delete_document(_corpus(old_id), old_id)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def query(thread_idx):
+        try:
+            idx = thread_idx
+            while not done.is_set():
+                snapshot = ret.snapshot
+                where = {"corpus": _corpus(idx)} if idx % 2 else None
+                emb = query_embs[idx % len(query_embs)]
+                spans = ret._search(emb, k, where=where, snapshot=snapshot)
+
+                ids = spans["id"]
+                assert len(spans) <= k
+                assert (spans["start_index"] == snapshot.starts[ids]).all()
+                assert (spans["end_index"] == snapshot.ends[ids]).all()
+                assert (spans["corpus_id"] == snapshot.chunk_corpus[ids]).all()
+                assert (spans["doc_id"] == snapshot.chunk_doc[ids]).all()
+                # Offsets, corpus and document all belong to the same chunk
+                doc_ids = spans["start_index"] // 1000
+                assert (spans["doc_id"] == doc_ids).all()
+                assert (spans["end_index"] - spans["start_index"] == 9).all()
+                corpus_ids = [snapshot.corpus_names[_corpus(d)] for d in doc_ids]
+                assert spans["corpus_id"].tolist() == corpus_ids
+                if where is not None:
+                    assert {_corpus(d) for d in doc_ids} <= {where["corpus"]}
+                idx += n_threads
+                counts[thread_idx] += 1
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=query, args=(idx,)) for idx in range(n_threads)]
+    writer = threading.Thread(target=write)
+    epoch = ret.epoch
+    start = time.perf_counter()
+    for thread in threads + [writer]:
+        thread.start()
+    for thread in [writer] + threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        raise errors[0]
+    assert ret.snapshot.row_alive.sum() == KEEP_DOCS * CHUNKS_PER_DOC
+    return sum(counts), sum(counts) / elapsed, ret.epoch - epoch
+
+
+@pytest.mark.parametrize("n_threads", [1, 2, 4, 8])
+def test_queries_see_consistent_snapshots(n_threads):
+    n_queries, qps, n_epochs = run_stress(n_threads)
+    print(f"threads={n_threads} queries={n_queries} qps={qps:.0f} epochs={n_epochs}")
+    assert n_queries > 0
+
+
+if __name__ == "__main__":
+    print(f"{'threads':>8} {'queries':>8} {'qps':>8} {'epochs':>8}")
+    for n_threads in [1, 2, 4, 8]:
+        n_queries, qps, n_epochs = run_stress(n_threads)
+        print(f"{n_threads:>8} {n_queries:>8} {qps:>8.0f} {n_epochs:>8}")
@@ -0,0 +1,151 @@
+import hashlib
+import http.server
+import threading
+
+import pytest
+from utils.download import (
+    corpus_digest,
+    download,
+    load_checksums,
+    make_session,
+    pin_checksums,
+)
+
+PAYLOAD = bytes(range(256)) * 1024
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves `PAYLOAD` at any path. `server.mode` selects the behaviour:
+    "range" honours Range requests, "ignore" always sends the whole body,
+    and "cut" sends half of the body, then drops the connection.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get("Range"))
+        start = 0
+        if self.server.mode == "range" and self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            if start >= len(PAYLOAD):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+        else:
+            self.send_response(200)
+
+        body = PAYLOAD[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.mode == "cut":
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.connection.close()
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.mode = "range"
+    httpd.ranges = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _download(server, tmp_path, **kwargs):
+    base_url = f"http://127.0.0.1:{server.server_port}/"
+    session = make_session(max_retries=0)
+    return download(base_url, tmp_path, "corpus", session=session, **kwargs)
+
+
+def test_resumes_partial_download(server, tmp_path):
+    (tmp_path / "corpus.md.part").write_bytes(PAYLOAD[:1000])
+
+    path = _download(server, tmp_path)
+
+    assert server.ranges == ["bytes=1000-"]
+    assert path.read_bytes() == PAYLOAD
+    assert not (tmp_path / "corpus.md.part").exists()
+
+
+def test_restarts_if_range_is_ignored(server, tmp_path):
+    server.mode = "ignore"
+    (tmp_path / "corpus.md.part").write_bytes(b"stale bytes")
+
+    path = _download(server, tmp_path)
+
+    assert path.read_bytes() == PAYLOAD
+
+
+def test_completes_part_on_416(server, tmp_path):
+    (tmp_path / "corpus.md.part").write_bytes(PAYLOAD)
+
+    path = _download(server, tmp_path)
+
+    assert server.ranges == [f"bytes={len(PAYLOAD)}-"]
+    assert path.read_bytes() == PAYLOAD
+
+
+def test_keeps_part_on_network_error(server, tmp_path):
+    server.mode = "cut"
+    assert _download(server, tmp_path) is None
+    part_size = (tmp_path / "corpus.md.part").stat().st_size
+    assert 0 < part_size < len(PAYLOAD)
+
+    server.mode = "range"
+    path = _download(server, tmp_path)
+    assert server.ranges[-1] == f"bytes={part_size}-"
+    assert path.read_bytes() == PAYLOAD
+
+
+def test_checksum_mismatch(server, tmp_path):
+    digest = hashlib.sha256(PAYLOAD).hexdigest()
+
+    assert _download(server, tmp_path, checksums={"corpus.md": "0" * 64}) is None
+    assert not (tmp_path / "corpus.md.part").exists()
+    assert not (tmp_path / "corpus.md").exists()
+
+    path = _download(server, tmp_path, checksums={"corpus.md": digest})
+    assert path.read_bytes() == PAYLOAD
+
+
+def test_verifies_existing_file(server, tmp_path):
+    digest = hashlib.sha256(PAYLOAD).hexdigest()
+    (tmp_path / "corpus.md").write_bytes(b"corrupted")
+
+    path = _download(server, tmp_path, checksums={"corpus.md": digest})
+
+    assert server.ranges == [None]
+    assert path.read_bytes() == PAYLOAD
+
+
+def test_pins_checksums_on_first_download(server, tmp_path):
+    manifest_path = tmp_path / "corpora.sha256"
+    path = _download(server, tmp_path, checksums=load_checksums(manifest_path))
+    pin_checksums(manifest_path, {"corpus": path})
+
+    checksums = load_checksums(manifest_path)
+    assert checksums == {"corpus.md": hashlib.sha256(PAYLOAD).hexdigest()}
+
+    path.write_bytes(b"corrupted")
+    assert _download(server, tmp_path, checksums=checksums).read_bytes() == PAYLOAD
+
+
+def test_corpus_digest_changes_with_content(tmp_path):
+    path = tmp_path / "corpus.md"
+    path.write_bytes(PAYLOAD)
+    digest = corpus_digest({"corpus": path})
+    checksums = {"corpus.md": hashlib.sha256(PAYLOAD).hexdigest()}
+
+    assert corpus_digest({"corpus": path}, checksums) == digest
+    path.write_bytes(PAYLOAD[::-1])
+    assert corpus_digest({"corpus": path}) != digest
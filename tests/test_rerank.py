@@ -0,0 +1,86 @@
+import numpy as np
+from retrieve.rerank import Reranker
+from retrieve.result import make_spans
+
+CHUNKS = [f"chunk {idx}" for idx in range(20)]
+
+
+class _StubModel:
+    """
+    Scores a pair by the number in its chunk, i.e. "chunk 7" scores 7, and
+    records every pair it is asked to score.
+    """
+
+    def __init__(self):
+        self.pairs = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.pairs.extend(pairs)
+        return [float(text.split()[1]) for _, text in pairs]
+
+
+class _StubRetriever:
+    def _load_chunks(self, ids):
+        return [CHUNKS[idx] for idx in ids]
+
+
+def _candidates(ids):
+    ids = np.array(ids)
+    return make_spans(
+        ids=ids,
+        scores=np.linspace(1.0, 0.0, len(ids)),
+        starts=ids * 10,
+        ends=ids * 10 + 10,
+        corpus_ids=np.zeros(len(ids), dtype=np.int32),
+        doc_ids=np.zeros(len(ids), dtype=np.int32),
+    )
+
+
+def test_orders_by_model_scores():
+    reranker = Reranker(_StubModel(), n_candidates=10)
+    (spans,) = reranker.rerank(_StubRetriever(), ["q"], [_candidates([3, 9, 1, 7])], 3)
+
+    assert spans["id"].tolist() == [9, 7, 3]
+    assert spans["score"].tolist() == [9.0, 7.0, 3.0]
+    assert spans["start_index"].tolist() == [90, 70, 30]
+
+
+def test_scores_every_pair_once():
+    model = _StubModel()
+    reranker = Reranker(model, n_candidates=10)
+    ret = _StubRetriever()
+
+    reranker.rerank(ret, ["q1", "q1"], [_candidates([1, 2]), _candidates([2, 3])], 2)
+    reranker.rerank(ret, ["q1", "q2"], [_candidates([1, 3]), _candidates([1, 3])], 2)
+
+    assert len(model.pairs) == len(set(model.pairs)) == 5
+    assert reranker.scored_pairs == 5
+
+
+def test_budget_caps_candidates_but_not_below_k():
+    model = _StubModel()
+    reranker = Reranker(model, n_candidates=10, budget_ms=4.0)
+    # Measured throughput of 1 ms per pair, i.e. 4 pairs fit the budget
+    reranker.scored_pairs, reranker.scoring_seconds = 100, 0.1
+
+    assert reranker.candidate_budget(2) == 4
+    assert reranker.candidate_budget(6) == 6
+
+    (spans,) = reranker.rerank(_StubRetriever(), ["q"], [_candidates(range(10))], 2)
+    assert [text for _, text in model.pairs] == CHUNKS[:4]
+    assert spans["id"].tolist() == [3, 2]
+
+
+def test_cache_is_bounded():
+    model = _StubModel()
+    reranker = Reranker(model, n_candidates=10, max_cache_entries=3)
+    ret = _StubRetriever()
+
+    # More pairs than cache entries are still all re-ranked
+    (spans,) = reranker.rerank(ret, ["q"], [_candidates([1, 2, 3, 4, 5])], 5)
+    assert spans["id"].tolist() == [5, 4, 3, 2, 1]
+    assert len(reranker.cache) == 3
+
+    # Least recently used pairs were evicted, and are scored again
+    reranker.rerank(ret, ["q"], [_candidates([1, 5])], 2)
+    assert [text for _, text in model.pairs[5:]] == ["chunk 1"]
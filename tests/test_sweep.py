@@ -0,0 +1,42 @@
+import sqlite3
+import time
+from pathlib import Path
+
+from utils.sweep import SweepQueue, expand_sweep, run_local_workers
+
+JOB_SCRIPT = Path(__file__).resolve().parent / "sweep_job.py"
+
+
+def test_local_workers_drain_queue(tmp_path):
+    queue_path = tmp_path / "sweep.db"
+    results_path = tmp_path / "results.db"
+    spec = {
+        "sweep": "test",
+        "common": {"results_db": str(results_path)},
+        "grid": {"chunk_size": [100, 200, 400, 800, 1600, 3200, 6400, 12800]},
+    }
+    configs = expand_sweep(spec)
+    configs[1]["fail_once"] = str(tmp_path / "failed_once")
+
+    with SweepQueue(queue_path, lease_seconds=1.0) as queue:
+        queue.submit(configs, sweep="test")
+        # Claimed by a worker which dies right away, i.e. never heartbeats
+        dead_job = queue.claim("dead")
+    time.sleep(1.0)
+
+    run_local_workers(
+        queue_path, 4, lease_seconds=1.0, poll_seconds=0.1, script=JOB_SCRIPT
+    )
+
+    with SweepQueue(queue_path) as queue:
+        assert queue.counts() == {"queued": 0, "running": 0, "done": 8, "failed": 0}
+        attempts = dict(queue.conn.execute("SELECT job_id, attempts FROM jobs"))
+    assert attempts[dead_job["job_id"]] == 2
+    assert sorted(attempts.values()) == [1] * 6 + [2] * 2
+
+    # Every job recorded its run exactly once, through the rollback journal
+    conn = sqlite3.connect(results_path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    exp_names = [row[0] for row in conn.execute("SELECT exp_name FROM runs")]
+    conn.close()
+    assert sorted(exp_names) == sorted(config["exp_name"] for config in configs)